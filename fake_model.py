@@ -0,0 +1,103 @@
+"""Offline stand-in for the Gemini itinerary model.
+
+Selected with TRAVEL_PLANNER_MODEL_BACKEND=fake, for load tests and local runs
+without an API key. It answers after FAKE_MODEL_LATENCY seconds with a
+deterministic itinerary in the seven-section format, sized to the duration in
+the prompt, and counts its calls process-wide.
+"""
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+FAKE_MODEL_LATENCY_SECONDS = float(os.getenv("FAKE_MODEL_LATENCY", "0.5"))
+MAX_DAYS = 30
+
+DESTINATION_LINE = re.compile(r"^- Destination: (.+)$", re.MULTILINE)
+DURATION_LINE = re.compile(r"^- Duration: (\d+)", re.MULTILINE)
+SECTIONS_LINE = re.compile(r"^Rewrite only these sections: (.+)$", re.MULTILINE)
+
+_calls = {"lock": threading.Lock(), "count": 0, "first": None, "last": None}
+
+
+def build_itinerary(destination, days):
+    lines = [
+        "## 1. Trip Overview",
+        f"A {days}-day trip to {destination} covering the main sights, local food and a relaxed pace.",
+        "",
+        "## 2. Daily Itinerary",
+    ]
+    for day in range(1, days + 1):
+        lines += [
+            f"**Day {day}: Exploring {destination}**",
+            f"- **Morning:** Walking tour of the old town, stop {day} (9:00 AM)",
+            f"- **Afternoon:** Museum visit and a train to viewpoint {day} (2:00 PM)",
+            f"- **Evening:** Sunset at the waterfront, taxi back to the hotel (6:30 PM)",
+            "- **Meals:**",
+            f"  - Breakfast: Cafe {day}",
+            f"  - Lunch: Market stall {day}",
+            f"  - Dinner: Bistro {day}",
+            f"- **Accommodation:** Central Hotel {destination}, mid-range rooms near the station",
+            "",
+        ]
+    lines += [
+        "## 3. Accommodation Details",
+        f"Central Hotel {destination}: mid-range, close to transport, breakfast included.",
+        "",
+        "## 4. Dining Recommendations",
+        "Try the market stalls for lunch and book dinner tables in advance.",
+        "",
+        "## 5. Attractions & Activities",
+        "Old town, city museum, waterfront promenade.",
+        "",
+        "## 6. Budget Breakdown",
+        "Accommodation 40%, food 25%, transport 15%, activities 15%, misc 5%.",
+        "",
+        "## 7. Essential Information",
+        "Flight into the main airport, then local bus or metro. Carry some cash.",
+    ]
+    return "\n".join(lines)
+
+
+class FakeItineraryModel:
+    """Duck-types the parts of genai.GenerativeModel the app uses"""
+
+    def __init__(self, latency=None):
+        self.latency = FAKE_MODEL_LATENCY_SECONDS if latency is None else latency
+
+    def generate_content(self, prompt):
+        with _calls["lock"]:
+            now = time.time()
+            _calls["count"] += 1
+            _calls["first"] = _calls["first"] or now
+            _calls["last"] = now
+        time.sleep(self.latency)
+
+        destination = DESTINATION_LINE.search(prompt)
+        duration = DURATION_LINE.search(prompt)
+        days = min(int(duration.group(1)), MAX_DAYS) if duration else 3
+        text = build_itinerary(destination.group(1).strip() if destination else "your destination", max(days, 1))
+        sections = SECTIONS_LINE.search(prompt)
+        if sections:
+            # Section updates answer with just the requested sections
+            titles = sections.group(1).split(", ")
+            blocks = re.split(r"\n(?=## )", text)
+            text = "\n".join(block for block in blocks if block.split("\n", 1)[0].split(". ", 1)[-1] in titles)
+        usage = SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            cached_content_token_count=0,
+            candidates_token_count=len(text) // 4,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+def call_stats():
+    """{"count", "first", "last"} for every fake model call in this process"""
+    with _calls["lock"]:
+        return {key: value for key, value in _calls.items() if key != "lock"}
+
+
+def reset_call_stats():
+    with _calls["lock"]:
+        _calls.update(count=0, first=None, last=None)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# tk.py and travel_planner.py are top-level scripts, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
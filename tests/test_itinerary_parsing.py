@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+import fake_model
+import tk
+from travel_planner import FUZZ_ALPHABET, PATHOLOGICAL_ITINERARIES
+
+PARIS_ITINERARY = """## 1. Trip Overview
+Two days in Paris.
+
+## 2. Daily Itinerary
+**Day 1: Left Bank**
+- **Date:** 5th May 2026
+- **Morning:** Visit the Louvre
+- **Afternoon:** Walk the Tuileries
+- **Evening:** Stroll past the spot we had lunch at Café de Flore earlier
+- **Meals:**
+  - Breakfast: Hotel buffet
+  - Lunch: Café Marly
+  - Dinner: Le Train Bleu
+- Check in at Hotel Lutetia
+
+**Day 2: Montmartre**
+- **Morning:** Explore Sacré-Cœur, then dinner at Chez Janou
+- **Meals:**
+  - Lunch: Le Consulat
+
+## 3. Accommodation Details
+Hotel Lutetia.
+
+## 4. Dining Recommendations
+Bistros.
+
+## 5. Attractions & Activities
+Museums.
+
+## 6. Budget Breakdown
+€1,200.
+
+## 7. Essential Information
+Take the metro.
+"""
+
+MODES = ["standard", "hardened"]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_labeled_meal_replaces_meal_named_in_passing(mode):
+    day = tk.parse_itinerary_data(PARIS_ITINERARY, mode=mode)["days"][0]
+    assert day["meals"] == {"breakfast": "Hotel buffet", "lunch": "Café Marly", "dinner": "Le Train Bleu"}
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_meal_named_in_passing_fills_missing_meal(mode):
+    day = tk.parse_itinerary_data(PARIS_ITINERARY, mode=mode)["days"][1]
+    assert day["meals"] == {"breakfast": "", "lunch": "Le Consulat", "dinner": "Chez Janou"}
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_stay_prefix_is_stripped_whole(mode):
+    day = tk.parse_itinerary_data(PARIS_ITINERARY, mode=mode)["days"][0]
+    assert day["accommodation"] == "Hotel Lutetia"
+
+
+@pytest.mark.parametrize("text", [
+    PARIS_ITINERARY,
+    fake_model.build_itinerary("Paris", 3),
+    fake_model.build_itinerary("Bangkok, Phuket", 12),
+], ids=["paris", "fake-3-days", "fake-12-days"])
+def test_hardened_parse_matches_standard(text):
+    assert tk.parse_itinerary_data(text, mode="hardened") == tk.parse_itinerary_data(text, mode="standard")
+
+
+@pytest.mark.parametrize("name", sorted(PATHOLOGICAL_ITINERARIES))
+def test_pathological_itinerary_parses_within_deadline(name):
+    text = PATHOLOGICAL_ITINERARIES[name](50000)
+    parsed = tk.parse_itinerary_data_hardened(text)
+    assert not parsed.get("parse_incomplete")
+
+
+def test_hardened_parse_survives_fuzzed_input():
+    rng = random.Random(0)
+    for _ in range(200):
+        text = "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(1, 400)))
+        parsed = tk.parse_itinerary_data_hardened(text)
+        assert not parsed.get("parse_incomplete")
+        assert all(isinstance(day["day_number"], int) for day in parsed["days"])
@@ -0,0 +1,30 @@
+import pytest
+
+import tk
+from travel_planner import PATHOLOGICAL_REQUESTS
+
+
+def test_nearby_places_leave_out_the_anchor():
+    description = tk.describe_nearby_places("I want to go near Pune for a week")
+    assert description.startswith("Near Pune: ")
+    places = description.split(": ", 1)[1].split(", ")
+    assert places
+    assert not any(place.startswith("Pune (") for place in places)
+
+
+def test_near_needs_a_capitalized_place():
+    assert tk.describe_nearby_places("a hotel near the beach in Goa") is None
+
+
+@pytest.mark.parametrize("name", sorted(PATHOLOGICAL_REQUESTS))
+def test_pathological_request_caps_fuzzy_lookups(name, monkeypatch):
+    calls = []
+    resolve_place_name = tk.resolve_place_name
+
+    def counting(name):
+        calls.append(name)
+        return resolve_place_name(name)
+
+    monkeypatch.setattr(tk, "resolve_place_name", counting)
+    tk.resolve_locations(tk.nlp.make_doc(PATHOLOGICAL_REQUESTS[name](5000)))
+    assert len(calls) <= tk.LOCATION_FUZZY_MAX_LOOKUPS
@@ -4,13 +4,27 @@ import dateparser
 import re
 import pandas as pd
 from dateparser import parse
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateparser.search import search_dates
 import geonamescache
 from word2number import w2n
 import json
+import math
+import calendar
 import google.generativeai as genai
 import traceback
+import os
+import time
+import threading
+import unicodedata
+import hashlib
+import inspect
+import sys
+import uuid
+import zlib
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import NamedTuple
 
 # Configure the Streamlit page
 st.set_page_config(
@@ -165,11 +179,173 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-def setup_gemini():
-    import os
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# "gemini" for the real API, "fake" for the offline model in fake_model.py
+MODEL_BACKEND = os.getenv("TRAVEL_PLANNER_MODEL_BACKEND", "gemini")
+
+# USD per million tokens as (input, cached input, output) for the models we
+# deploy; cached context tokens are billed at a quarter of the input rate
+GEMINI_PRICING = {
+    "gemini-1.5-flash": (0.075, 0.01875, 0.30),
+    "gemini-1.5-flash-8b": (0.0375, 0.01, 0.15),
+    "gemini-1.5-pro": (1.25, 0.3125, 5.00),
+}
+# Lifetime of the cached instruction context. The model wrapping it is
+# rebuilt a few minutes earlier, so no request reaches an expired cache.
+CONTEXT_CACHE_TTL = timedelta(hours=1)
+CONTEXT_CACHE_REFRESH = CONTEXT_CACHE_TTL - timedelta(minutes=5)
+
+# Static instruction block shared by every itinerary request. Bump the version
+# whenever the wording changes so contexts cached under the old one are dropped.
+ITINERARY_INSTRUCTIONS_VERSION = "2"
+ITINERARY_INSTRUCTIONS = """You are a travel planner. Write a detailed, practical itinerary in Markdown tailored to the trip details, with specific names, locations and realistic times. Use exactly these sections:
+
+## 1. Trip Overview
+Short summary and key highlights.
+
+## 2. Daily Itinerary
+For each day:
+**Day X: [Location/Theme]**
+- **Morning:** activities with times
+- **Afternoon:** activities with times
+- **Evening:** activities with times
+- **Meals:**
+  - Breakfast: restaurant or place
+  - Lunch: restaurant or place
+  - Dinner: restaurant or place
+- **Accommodation:** hotel with a one-line description
+
+## 3. Accommodation Details
+Hotels with location, nightly price range, key amenities and why they fit.
+
+## 4. Dining Recommendations
+Must-try restaurants and local specialties with price ranges.
+
+## 5. Attractions & Activities
+Top attractions and experiences with entry fees and timings.
+
+## 6. Budget Breakdown
+Accommodation, transportation, food, activities, shopping/misc and total.
+
+## 7. Essential Information
+Flights and local transport, weather and packing, customs, emergency numbers, currency and payments, useful phrases."""
+
+# Extracted fields included in the prompt, in order, with their prompt labels
+PROMPT_FIELDS = [
+    ("Destination", "Destination"),
+    ("Starting Location", "Starting Location"),
+    ("Trip Duration", "Duration"),
+    ("Start Date", "Start Date"),
+    ("End Date", "End Date"),
+    ("Number of Travelers", "Travelers"),
+    ("Budget Range", "Budget"),
+    ("Budget Per Person", "Budget per person"),
+    ("Budget Per Day", "Budget per day"),
+    ("Trip Type", "Trip Type"),
+    ("Transportation Preferences", "Transportation"),
+    ("Accommodation Preferences", "Accommodation"),
+    ("Special Requirements", "Special Requirements"),
+    ("Destination Type", "Destination type"),
+    ("Travel Distance", "Distances"),
+    ("Route Plan", "Suggested route (follow this order)"),
+    ("Nearby Places", "Places nearby"),
+]
+
+# The raw request still carries interests the extractor does not capture,
+# but there is no reason to send an essay of it
+PROMPT_MAX_REQUEST_CHARS = 600
+
+def setup_gemini(system_instruction=None):
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "default_key")
     genai.configure(api_key=GOOGLE_API_KEY)
-    return genai.GenerativeModel('gemini-1.5-flash')
+    if system_instruction:
+        try:
+            return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
+        except TypeError:
+            # google-generativeai < 0.5 has no system instructions
+            pass
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+@st.cache_resource(ttl=CONTEXT_CACHE_REFRESH)
+def get_itinerary_model(instructions_version):
+    """Return (model, instructions_in_context) for the given instruction version.
+
+    With GEMINI_CONTEXT_CACHE=1 the instruction block is uploaded as cached
+    content, again every CONTEXT_CACHE_REFRESH before the previous upload
+    expires; otherwise it is attached as a system instruction. When neither
+    is supported the caller has to prepend the instructions to every prompt.
+    """
+    if MODEL_BACKEND == "fake":
+        from fake_model import FakeItineraryModel
+        return FakeItineraryModel(), True
+    if os.getenv("GEMINI_CONTEXT_CACHE") == "1" and hasattr(genai, "caching"):
+        try:
+            setup_gemini()
+            cached = genai.caching.CachedContent.create(
+                model=f"models/{GEMINI_MODEL_NAME}",
+                display_name=f"itinerary-instructions-v{instructions_version}",
+                system_instruction=ITINERARY_INSTRUCTIONS,
+                ttl=CONTEXT_CACHE_TTL,
+            )
+            return genai.GenerativeModel.from_cached_content(cached), True
+        except Exception:
+            # Backend rejected the cache (e.g. below the minimum token count)
+            pass
+    model = setup_gemini(system_instruction=ITINERARY_INSTRUCTIONS)
+    return model, bool(getattr(model, "_system_instruction", None))
+
+@st.cache_resource
+def get_usage_log():
+    """Process-wide log of token usage and cost for recent model requests"""
+    return deque(maxlen=1000)
+
+def build_itinerary_prompt(details, user_input):
+    """Build the per-request part of the itinerary prompt.
+
+    Only fields that were actually extracted are listed; the static
+    instructions are kept in ITINERARY_INSTRUCTIONS.
+    """
+    lines = ["Trip details:"]
+    for key, label in PROMPT_FIELDS:
+        value = details.get(key)
+        if value:
+            lines.append(f"- {label}: {value}")
+    
+    scope = destination_scope(details.get("Destination"))
+    if scope:
+        lines.append(f"- Scope: {DESTINATION_SCOPE_HINTS[scope]}")
+    
+    request = " ".join((user_input or "").split())
+    if len(request) > PROMPT_MAX_REQUEST_CHARS:
+        request = request[:PROMPT_MAX_REQUEST_CHARS].rsplit(" ", 1)[0] + "..."
+    if request:
+        lines.append(f"Request: {request}")
+    
+    return "\n".join(lines)
+
+def record_usage(response, latency, model_name=GEMINI_MODEL_NAME):
+    """Record token counts and cost of a model response in the usage log"""
+    usage = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    
+    input_price, cached_price, output_price = GEMINI_PRICING.get(model_name, (0.0, 0.0, 0.0))
+    # prompt_token_count includes the cached tokens
+    cost = ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + output_tokens * output_price) / 1_000_000
+    
+    entry = {
+        "timestamp": datetime.now().isoformat(),
+        "model": model_name,
+        "instructions_version": ITINERARY_INSTRUCTIONS_VERSION,
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": output_tokens,
+        "cost_usd": round(cost, 6),
+        "latency_seconds": round(latency, 3),
+    }
+    get_usage_log().append(entry)
+    return entry
 
 # Load spaCy model globally
 @st.cache_resource
@@ -182,9 +358,563 @@ def load_spacy_model():
 
 nlp = load_spacy_model()
 
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def fold_name(name):
+    """Lowercase a place name and strip accents, so 'Thāne' and 'thane' compare equal"""
+    decomposed = unicodedata.normalize("NFKD", name.strip().lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+class CityIndex:
+    """Grid index over city coordinates for nearest, radius and distance queries.
+
+    Cities are bucketed into GRID_DEGREES-sized latitude/longitude cells, so a
+    query only measures the cities in the cells its search circle overlaps.
+    Where several cities share a name, name lookups return the most populous.
+    """
+    
+    GRID_DEGREES = 1.0
+    KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+    
+    def __init__(self, cities):
+        self.cities = []
+        self.by_name = {}
+        self.cells = {}
+        for city in sorted(cities, key=lambda c: c.get("population", 0), reverse=True):
+            record = {
+                "name": city["name"],
+                "latitude": city["latitude"],
+                "longitude": city["longitude"],
+                "countrycode": city.get("countrycode"),
+                "admin1code": city.get("admin1code"),
+                "population": city.get("population", 0),
+            }
+            self.cities.append(record)
+            self.by_name.setdefault(fold_name(record["name"]), record)
+            self.cells.setdefault(self.cell(record["latitude"], record["longitude"]), []).append(record)
+        self.lon_cells = int(round(360 / self.GRID_DEGREES))
+    
+    def cell(self, lat, lon):
+        return int(math.floor(lat / self.GRID_DEGREES)), int(math.floor(lon / self.GRID_DEGREES))
+    
+    def lookup(self, name):
+        """Return the most populous city called name, or None"""
+        return self.by_name.get(fold_name(name)) if name else None
+    
+    def within_radius(self, lat, lon, radius_km, limit=None):
+        """Return [(distance_km, city)] within radius_km, nearest first"""
+        lat_span = radius_km / self.KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(89.0, abs(lat) + lat_span)))
+        lon_span = min(180.0, lat_span / max(cos_lat, 1e-6))
+        
+        lat_lo, lon_lo = self.cell(max(-90.0, lat - lat_span), lon - lon_span)
+        lat_hi, lon_hi = self.cell(min(90.0, lat + lat_span), lon + lon_span)
+        lon_cells = range(lon_lo, lon_hi + 1)
+        if len(lon_cells) > self.lon_cells:
+            lon_cells = range(0, self.lon_cells)
+        
+        results = []
+        for lat_cell in range(lat_lo, lat_hi + 1):
+            for lon_cell in lon_cells:
+                # Wrap around the antimeridian
+                wrapped = (lon_cell + self.lon_cells // 2) % self.lon_cells - self.lon_cells // 2
+                for city in self.cells.get((lat_cell, wrapped), ()):
+                    distance = haversine_km(lat, lon, city["latitude"], city["longitude"])
+                    if distance <= radius_km:
+                        results.append((distance, city))
+        results.sort(key=lambda item: item[0])
+        return results[:limit] if limit else results
+    
+    def nearest(self, lat, lon, k=1, exclude=None):
+        """Return the k nearest [(distance_km, city)], widening the search until found"""
+        radius_km = 50.0
+        while True:
+            results = [item for item in self.within_radius(lat, lon, radius_km) if item[1] is not exclude]
+            if len(results) >= k or radius_km >= math.pi * EARTH_RADIUS_KM:
+                return results[:k]
+            radius_km *= 2
+    
+    def distance(self, place_a, place_b):
+        """Distance in km between two city names or records, or None if unknown"""
+        a = self.lookup(place_a) if isinstance(place_a, str) else place_a
+        b = self.lookup(place_b) if isinstance(place_b, str) else place_b
+        if not a or not b:
+            return None
+        return haversine_km(a["latitude"], a["longitude"], b["latitude"], b["longitude"])
+
 # Load city database from geonamescache
-gc = geonamescache.GeonamesCache()
-cities_dict = {city["name"].lower(): city["name"] for city in gc.get_cities().values()}
+@st.cache_resource
+def load_city_index():
+    gc = geonamescache.GeonamesCache()
+    return CityIndex(gc.get_cities().values())
+
+city_index = load_city_index()
+
+# Travel regions geonamescache has no entry for:
+# name -> (country code, city whose coordinates stand in for the region)
+KNOWN_REGIONS = {
+    "Goa": ("IN", "Panjim"),
+    "Rajasthan": ("IN", "Jaipur"),
+    "Kerala": ("IN", "Kochi"),
+    "Kashmir": ("IN", "Srinagar"),
+    "Ladakh": ("IN", "Leh"),
+    "Himachal Pradesh": ("IN", "Shimla"),
+    "Sikkim": ("IN", "Gangtok"),
+    "Uttarakhand": ("IN", "Dehradun"),
+    "Andaman Islands": ("IN", "Port Blair"),
+    "Bali": ("ID", "Denpasar"),
+    "Tuscany": ("IT", "Florence"),
+    "Amalfi Coast": ("IT", "Salerno"),
+    "Provence": ("FR", "Marseille"),
+    "French Riviera": ("FR", "Nice"),
+    "French Countryside": ("FR", None),
+    "Andalusia": ("ES", "Sevilla"),
+    "Scottish Highlands": ("GB", "Inverness"),
+    "Swiss Alps": ("CH", "Luzern"),
+    "Himalayas": ("NP", "Kathmandu"),
+    "Patagonia": ("AR", "San Carlos de Bariloche"),
+    "Lapland": ("FI", "Rovaniemi"),
+}
+
+# Everyday names that differ from the gazetteer's
+PLACE_ALIASES = {
+    "new york": "New York City",
+    "nyc": "New York City",
+    "bombay": "Mumbai",
+    "calcutta": "Kolkata",
+    "madras": "Chennai",
+    "bangalore": "Bengaluru",
+    "simla": "Shimla",
+    "pondicherry": "Puducherry",
+    "seville": "Sevilla",
+    "lucerne": "Luzern",
+    "saigon": "Ho Chi Minh City",
+    "peking": "Beijing",
+    "uk": "United Kingdom",
+    "england": "United Kingdom",
+    "usa": "United States",
+    "america": "United States",
+    "uae": "United Arab Emirates",
+}
+
+class PlaceIndex:
+    """Unified lookup over cities, countries, US states and known regions.
+
+    Every folded name and alias maps straight to one record, so resolving a
+    token or phrase is a single dict lookup. Records carry a "type" tag
+    (country, region, state or city), a "parent" link (the country, or the
+    continent for countries) and coordinates where known. When a name exists
+    at several levels the broader place wins, so "Goa" is the Indian state.
+    """
+    
+    TYPE_PRECEDENCE = {"country": 0, "region": 1, "state": 2, "city": 3}
+    
+    def __init__(self, gc, city_index):
+        self.by_name = {}
+        self.max_words = 1
+        
+        countries = gc.get_countries()
+        continents = {code: continent["name"] for code, continent in gc.get_continents().items()}
+        country_names = {code: country["name"] for code, country in countries.items()}
+        # Cities by (name, country), and each US state's most populous city
+        cities_by_country = {}
+        state_cities = {}
+        for city in city_index.cities:
+            cities_by_country.setdefault((fold_name(city["name"]), city["countrycode"]), city)
+            if city["countrycode"] == "US":
+                state_cities.setdefault(city["admin1code"], city)
+        
+        for city in city_index.by_name.values():
+            self.add(dict(city, type="city", parent=country_names.get(city["countrycode"])))
+        
+        for code, state in gc.get_us_states().items():
+            self.add(self.located(state["name"], "state", "US", "United States", state_cities.get(code)))
+        
+        for name, (code, city_name) in KNOWN_REGIONS.items():
+            anchor = cities_by_country.get((fold_name(city_name), code)) if city_name else None
+            self.add(self.located(name, "region", code, country_names.get(code), anchor))
+        
+        for code, country in countries.items():
+            capital = cities_by_country.get((fold_name(country.get("capital") or ""), code))
+            record = self.located(country["name"], "country", code, continents.get(country.get("continentcode")), capital)
+            record["population"] = country.get("population") or 0
+            self.add(record)
+        
+        for alias, name in PLACE_ALIASES.items():
+            record = self.by_name.get(fold_name(name))
+            if record:
+                self.by_name[alias] = record
+    
+    @staticmethod
+    def located(name, place_type, countrycode, parent, anchor):
+        """Build a non-city record that borrows coordinates from an anchor city"""
+        return {
+            "name": name,
+            "type": place_type,
+            "parent": parent,
+            "countrycode": countrycode,
+            "latitude": anchor["latitude"] if anchor else None,
+            "longitude": anchor["longitude"] if anchor else None,
+            "population": anchor["population"] if anchor else 0,
+        }
+    
+    def add(self, record):
+        key = fold_name(record["name"])
+        existing = self.by_name.get(key)
+        if existing is None or self.TYPE_PRECEDENCE[record["type"]] < self.TYPE_PRECEDENCE[existing["type"]]:
+            self.by_name[key] = record
+        self.max_words = max(self.max_words, len(key.split()))
+    
+    def lookup(self, name):
+        return self.by_name.get(fold_name(name)) if name else None
+    
+    def single_word_place(self, token, record):
+        if not token[:1].isupper():
+            return False
+        return record["type"] != "city" or record["population"] >= SINGLE_WORD_CITY_POPULATION
+
+SINGLE_WORD_CITY_POPULATION = 1000000
+
+@st.cache_resource
+def load_place_index():
+    return PlaceIndex(geonamescache.GeonamesCache(), city_index)
+
+place_index = load_place_index()
+
+class TrigramIndex:
+    """Character-trigram index for fuzzy, population-ranked name lookup.
+
+    Candidates are gathered from the postings of the query's trigrams and only
+    the MAX_CANDIDATES with the most shared trigrams are scored, so a lookup
+    makes a bounded number of full comparisons instead of scanning every name.
+    """
+    
+    MAX_CANDIDATES = 50
+    # Postings longer than this carry almost no signal (" sa", "an ") and
+    # dominate lookup cost, so they are skipped when rarer trigrams exist
+    MAX_POSTING = 2000
+    # Weight of log10(population) in the ranking, relative to similarity
+    POPULATION_WEIGHT = 0.01
+    
+    def __init__(self, entries):
+        self.keys = []
+        self.records = []
+        self.gram_counts = []
+        self.postings = {}
+        for key, record in entries:
+            grams = self.trigrams(key)
+            entry_id = len(self.keys)
+            self.keys.append(key)
+            self.records.append(record)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(entry_id)
+    
+    @staticmethod
+    def trigrams(text):
+        padded = f"  {fold_name(text)} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def search(self, query, limit=5):
+        """Return up to limit [(rank, similarity, record)], best first"""
+        grams = self.trigrams(query)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        rare = [posting for posting in postings if len(posting) <= self.MAX_POSTING]
+        
+        shared = Counter()
+        for posting in rare or postings:
+            shared.update(posting)
+        
+        results = []
+        for entry_id, _ in shared.most_common(self.MAX_CANDIDATES):
+            # Dice coefficient over the full trigram sets
+            common = len(grams & self.trigrams(self.keys[entry_id]))
+            similarity = 2 * common / (len(grams) + self.gram_counts[entry_id])
+            population = self.records[entry_id].get("population") or 0
+            rank = similarity + self.POPULATION_WEIGHT * math.log10(population + 1)
+            results.append((rank, similarity, self.records[entry_id]))
+        results.sort(key=lambda item: item[0], reverse=True)
+        return results[:limit]
+
+@st.cache_resource
+def load_place_trigram_index():
+    return TrigramIndex(place_index.by_name.items())
+
+place_trigram_index = load_place_trigram_index()
+
+# Fuzzy matches below this similarity are not trusted
+FUZZY_PLACE_THRESHOLD = 0.6
+# Weak matches on small places are more often coincidence than typo
+# ("Relax" -> "Relau"), so they need a closer match
+FUZZY_SMALL_PLACE_THRESHOLD = 0.8
+FUZZY_SMALL_PLACE_POPULATION = 100000
+FUZZY_MIN_QUERY_CHARS = 4
+
+# Words that regex extraction drags along with a place name ("Thailand For")
+PLACE_EDGE_STOPWORDS = {"the", "for", "in", "on", "and", "or", "with", "during", "trip", "tour", "vacation", "holiday"}
+
+def strip_place_stopwords(name):
+    words = name.split()
+    while words and words[-1].lower() in PLACE_EDGE_STOPWORDS:
+        words.pop()
+    while words and words[0].lower() in PLACE_EDGE_STOPWORDS:
+        words.pop(0)
+    return " ".join(words)
+
+def resolve_place_name(name):
+    """Resolve a possibly misspelled place name to (canonical_name, confidence).
+
+    Stray leading/trailing words like "for" are dropped first. Exact case- and
+    accent-insensitive matches win with confidence 1.0; otherwise the best
+    trigram match is used if its similarity clears the threshold. Returns
+    (None, similarity) when nothing is trusted.
+    """
+    cleaned = strip_place_stopwords(name)
+    if not cleaned:
+        return None, 0.0
+    record = place_index.lookup(cleaned)
+    if record:
+        return record["name"], 1.0
+    if len(cleaned) < FUZZY_MIN_QUERY_CHARS:
+        return None, 0.0
+    
+    for _, similarity, record in place_trigram_index.search(cleaned, limit=1):
+        small = (record.get("population") or 0) < FUZZY_SMALL_PLACE_POPULATION
+        if similarity >= (FUZZY_SMALL_PLACE_THRESHOLD if small else FUZZY_PLACE_THRESHOLD):
+            return record["name"], similarity
+        return None, similarity
+    return None, 0.0
+
+# Routes with at most this many stops are improved with 2-opt and or-opt after
+# the nearest-neighbour pass; longer ones keep the greedy order
+ROUTE_2OPT_MAX_STOPS = 12
+
+def resolve_place_coordinates(name):
+    """Resolve a place name to a gazetteer record with coordinates, or None"""
+    record = place_index.lookup(name)
+    return record if record and record["latitude"] is not None else None
+
+def route_length(points, distances):
+    return sum(distances[a][b] for a, b in zip(points, points[1:]))
+
+def order_route(distances, start=0):
+    """Order points into a short open path from start.
+
+    distances is a square matrix. Uses nearest neighbour, then 2-opt segment
+    reversals and single-stop moves for small inputs. Returns the list of
+    point indices.
+    """
+    remaining = set(range(len(distances))) - {start}
+    path = [start]
+    while remaining:
+        nearest = min(remaining, key=lambda point: distances[path[-1]][point])
+        path.append(nearest)
+        remaining.remove(nearest)
+    
+    if len(path) - 1 > ROUTE_2OPT_MAX_STOPS:
+        return path
+    
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(path) - 1):
+            for j in range(i + 1, len(path)):
+                # Reverse path[i..j]; the path is open, so there may be no edge after j
+                before = distances[path[i - 1]][path[i]] + (distances[path[j]][path[j + 1]] if j + 1 < len(path) else 0)
+                after = distances[path[i - 1]][path[j]] + (distances[path[i]][path[j + 1]] if j + 1 < len(path) else 0)
+                if after < before - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+        # Or-opt: move a single stop elsewhere, which 2-opt alone cannot do
+        for i in range(1, len(path)):
+            length = route_length(path, distances)
+            for j in range(1, len(path)):
+                if i == j:
+                    continue
+                candidate = path[:i] + path[i + 1:]
+                candidate.insert(j, path[i])
+                if route_length(candidate, distances) < length - 1e-9:
+                    path = candidate
+                    improved = True
+                    break
+    return path
+
+def split_days(weights, total_days):
+    """Split total_days across stops in proportion to weights, at least one day each.
+
+    Callers drop stops first when there are fewer days than stops.
+    """
+    if not weights or not total_days:
+        return [None] * len(weights)
+    if total_days < len(weights):
+        raise ValueError(f"cannot give {len(weights)} stops at least one of {total_days} days")
+    
+    spare = total_days - len(weights)
+    total_weight = sum(weights)
+    shares = [spare * weight / total_weight for weight in weights]
+    days = [1 + int(share) for share in shares]
+    # Hand out the leftover days by largest remainder
+    by_remainder = sorted(range(len(weights)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:total_days - sum(days)]:
+        days[i] += 1
+    return days
+
+def plan_route(start_location, destinations, total_days=None):
+    """Order destinations into a short route from the start location.
+
+    Destinations are resolved through the gazetteer; those that cannot be
+    resolved are appended in their original order. Days are split in
+    proportion to log-population, so bigger places get more time. When there
+    are fewer days than stops, the smallest places are dropped so every stop
+    keeps at least a day. Returns {"stops": [{"name", "days", "leg_km"}],
+    "dropped": [name], "total_km"} or None if fewer than two destinations
+    resolve.
+    """
+    resolved = [(name, resolve_place_coordinates(name)) for name in destinations]
+    located = [(name, record) for name, record in resolved if record]
+    unresolved = [name for name, record in resolved if not record]
+    if len(located) < 2:
+        return None
+    
+    start_record = resolve_place_coordinates(start_location) if start_location else None
+    points = ([start_record] if start_record else []) + [record for _, record in located]
+    distances = [
+        [haversine_km(a["latitude"], a["longitude"], b["latitude"], b["longitude"]) for b in points]
+        for a in points
+    ]
+    
+    if start_record:
+        order = [i - 1 for i in order_route(distances, start=0)[1:]]
+    else:
+        # No known start: try each destination as the first stop and keep the shortest
+        order = min(
+            (order_route(distances, start=first) for first in range(len(points))),
+            key=lambda path: route_length(path, distances)
+        )
+    
+    offset = 1 if start_record else 0
+    stops = []
+    for index in order:
+        name, record = located[index]
+        stops.append({"name": name, "point": index + offset, "population": record.get("population") or 0})
+    stops += [{"name": name, "point": None, "population": 0} for name in unresolved]
+    
+    weights = [math.log10(stop["population"] + 10) for stop in stops]
+    dropped = []
+    if total_days and total_days < len(stops):
+        kept = set(sorted(range(len(stops)), key=weights.__getitem__, reverse=True)[:total_days])
+        dropped = [stop["name"] for i, stop in enumerate(stops) if i not in kept]
+        stops = [stop for i, stop in enumerate(stops) if i in kept]
+        weights = [weight for i, weight in enumerate(weights) if i in kept]
+    
+    # Legs are measured after dropping, from the previous kept stop
+    previous = 0 if start_record else None
+    for stop, days in zip(stops, split_days(weights, total_days)):
+        point = stop.pop("point")
+        stop["leg_km"] = distances[previous][point] if previous is not None and point is not None else None
+        if point is not None:
+            previous = point
+        stop["days"] = days
+        del stop["population"]
+    
+    total_km = sum(stop["leg_km"] for stop in stops if stop["leg_km"])
+    return {"stops": stops, "dropped": dropped, "total_km": total_km}
+
+def describe_route(start_location, route):
+    """Format a route plan, e.g. 'Mumbai → Bangkok (3,001 km, 4 days) → Phuket (...)'"""
+    parts = [start_location] if start_location else []
+    for stop in route["stops"]:
+        notes = []
+        if stop["leg_km"]:
+            notes.append(f"{stop['leg_km']:,.0f} km")
+        if stop["days"]:
+            notes.append(f"{stop['days']} day{'s' if stop['days'] != 1 else ''}")
+        parts.append(f"{stop['name']} ({', '.join(notes)})" if notes else stop["name"])
+    description = " → ".join(parts)
+    if route.get("dropped"):
+        description += f" (no days left for {', '.join(route['dropped'])})"
+    return description
+
+# Prompt hint per destination scope, so country-wide trips ask for a few
+# concise bases and city trips for neighbourhood-level detail
+DESTINATION_SCOPE_HINTS = {
+    "country": "Country-wide trip: pick a few bases, keep each day's plan concise and include transfers between them.",
+    "region": "Regional trip: cover the region's main towns with realistic transfers.",
+    "state": "Regional trip: cover the state's main towns with realistic transfers.",
+    "city": "City trip: go neighbourhood by neighbourhood, with at most one or two day trips.",
+}
+
+def classify_destinations(destination):
+    """Return [(name, record or None)] for each comma-separated destination"""
+    if not destination:
+        return []
+    return [(place.strip(), place_index.lookup(place)) for place in destination.split(",") if place.strip()]
+
+def describe_destination_types(destination):
+    """Describe destinations by type, e.g. 'Rajasthan: region of India; Nepal: country in Asia'"""
+    parts = []
+    for name, record in classify_destinations(destination):
+        if not record:
+            continue
+        if record["type"] == "country":
+            parts.append(f"{name}: country in {record['parent']}" if record["parent"] else f"{name}: country")
+        else:
+            parts.append(f"{name}: {record['type']} of {record['parent']}" if record["parent"] else f"{name}: {record['type']}")
+    return "; ".join(parts) or None
+
+def destination_scope(destination):
+    """The broadest place type among the destinations, or None"""
+    types = [record["type"] for _, record in classify_destinations(destination) if record]
+    return min(types, key=PlaceIndex.TYPE_PRECEDENCE.get) if types else None
+
+# Radius used to resolve "near X" requests
+NEARBY_RADIUS_KM = 150
+NEARBY_MAX_PLACES = 5
+
+def describe_distances(start_location, destination):
+    """Describe the distance from the start to each destination, e.g. 'Delhi → Shimla: 280 km'"""
+    if not start_location or not destination:
+        return None
+    start = resolve_place_coordinates(start_location)
+    if not start:
+        return None
+    legs = []
+    for place in destination.split(","):
+        record = resolve_place_coordinates(place)
+        if record and record is not start:
+            distance = haversine_km(start["latitude"], start["longitude"], record["latitude"], record["longitude"])
+            legs.append(f"{start_location} → {place.strip()}: {distance:,.0f} km")
+    return "; ".join(legs) or None
+
+def describe_nearby_places(text):
+    """Resolve 'near X' in a request to the largest places within NEARBY_RADIUS_KM of X"""
+    near_match = NEAR_PLACE_PATTERN.search(text)
+    if not near_match:
+        return None
+    # The capture may run past the place name ("near Pune for a week")
+    words = near_match.group(1).split()
+    for n in range(len(words), 0, -1):
+        anchor = resolve_place_coordinates(" ".join(words[:n]))
+        if anchor:
+            break
+    else:
+        return None
+    # Place records are copies of the city index entries, so the anchor city
+    # is recognised by name and position rather than identity
+    anchor_key = (anchor["name"], anchor["latitude"], anchor["longitude"])
+    nearby = [
+        (distance, city) for distance, city in city_index.within_radius(anchor["latitude"], anchor["longitude"], NEARBY_RADIUS_KM)
+        if (city["name"], city["latitude"], city["longitude"]) != anchor_key
+    ]
+    nearby.sort(key=lambda item: item[1]["population"], reverse=True)
+    places = [f"{city['name']} ({distance:,.0f} km)" for distance, city in nearby[:NEARBY_MAX_PLACES]]
+    return f"Near {anchor['name']}: " + ", ".join(places) if places else None
 
 # Define seasonal mappings
 seasonal_mappings = {
@@ -200,126 +930,561 @@ seasonal_mappings = {
     "spring": "04-01"  
 }
 
-def extract_details(text):
-    doc = nlp(text)
-    text_lower = text.lower()
-    details = {
-        "Starting Location": None,
-        "Destination": None,
-        "Start Date": None,
-        "End Date": None,
-        "Trip Duration": None,
-        "Trip Type": None,
-        "Number of Travelers": None,
-        "Budget Range": None,
-        "Transportation Preferences": None,
-        "Accommodation Preferences": None,
-        "Special Requirements": None
+# Every regular expression used by extraction and parsing is compiled once and
+# registered under a name. With TRAVEL_PLANNER_REGEX_TIMING=1 (or
+# set_pattern_timing(True)) each call is timed, so get_pattern_stats() shows
+# which patterns dominate CPU and which have slow worst cases.
+PATTERN_TIMING_ENABLED = os.getenv("TRAVEL_PLANNER_REGEX_TIMING") == "1"
+
+class RegisteredPattern:
+    """A named, precompiled pattern whose match methods can be timed"""
+    
+    METHODS = ("search", "match", "fullmatch", "findall", "finditer", "sub", "subn", "split")
+    # sub/subn take the replacement first; the subject string comes second
+    SUBJECT_ARGUMENT = {"sub": 1, "subn": 1}
+    
+    def __init__(self, name, compiled, flags=0):
+        self.name = name
+        self.flags = flags
+        self.compiled = compiled
+        self.pattern = compiled.pattern
+        self.bind(PATTERN_TIMING_ENABLED)
+    
+    def bind(self, timed):
+        # Untimed patterns expose the compiled methods directly, so the
+        # registry costs nothing unless instrumentation is switched on
+        for method in self.METHODS:
+            func = getattr(self.compiled, method)
+            setattr(self, method, self.timed(method, func) if timed else func)
+    
+    def timed(self, method, func):
+        position = self.SUBJECT_ARGUMENT.get(method, 0)
+        def wrapper(*args, **kwargs):
+            subject = kwargs["string"] if "string" in kwargs else args[position]
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            if method == "finditer":
+                # The matching work happens while iterating
+                result = iter(list(result))
+            record_pattern_time(self.name, time.perf_counter() - started, len(subject))
+            return result
+        return wrapper
+
+@st.cache_resource
+def get_pattern_registry():
+    """Process-wide registry so reruns reuse the compiled patterns"""
+    return {"patterns": {}, "stats": {}, "lock": threading.Lock()}
+
+def register_pattern(name, pattern, flags=0):
+    """Compile and register a pattern under name (once per process)"""
+    patterns = get_pattern_registry()["patterns"]
+    registered = patterns.get(name)
+    if registered is None or registered.pattern != pattern or registered.flags != flags:
+        registered = RegisteredPattern(name, re.compile(pattern, flags), flags)
+        patterns[name] = registered
+    return registered
+
+def record_pattern_time(name, seconds, input_chars):
+    registry = get_pattern_registry()
+    with registry["lock"]:
+        stats = registry["stats"].setdefault(name, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "max_input_chars": 0})
+        stats["calls"] += 1
+        stats["total_seconds"] += seconds
+        if seconds > stats["max_seconds"]:
+            stats["max_seconds"] = seconds
+            stats["max_input_chars"] = input_chars
+
+def set_pattern_timing(enabled):
+    """Switch per-call timing on or off for every registered pattern"""
+    global PATTERN_TIMING_ENABLED
+    PATTERN_TIMING_ENABLED = enabled
+    for registered in get_pattern_registry()["patterns"].values():
+        registered.bind(enabled)
+
+def get_pattern_stats():
+    """Return per-pattern timing stats, most expensive first"""
+    registry = get_pattern_registry()
+    with registry["lock"]:
+        rows = [{"name": name, **stats} for name, stats in registry["stats"].items()]
+    return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+def reset_pattern_stats():
+    registry = get_pattern_registry()
+    with registry["lock"]:
+        registry["stats"].clear()
+
+NUMBER_WORDS = r'one|two|three|four|five|six|seven|eight|nine|ten'
+DURATION_UNITS = r'day|days|week|weeks|month|months'
+
+# extract_details
+DURATION_PATTERN = register_pattern("duration", rf'(?P<value>\d+|{NUMBER_WORDS})\s*[-]?\s*(?P<unit>day|days|night|nights|week|weeks|month|months)', re.IGNORECASE)
+# Unit words without a number ("a week in Bali"); whole words, so "Holiday"
+# is not a day
+DURATION_BARE_UNIT_PATTERN = register_pattern("duration_bare_unit", r'\b(day|days|night|nights|week|weeks|month|months)\b', re.IGNORECASE)
+# dateparser's search_dates also reads durations ("5 days"), pronouns ("me")
+# and amounts ("$3000") as dates; its matches are only used when they name a
+# month, a weekday, a numeric day/month or a relative day
+DATE_ANCHOR_WORDS = "|".join(
+    [name.lower() for name in calendar.month_name[1:] + calendar.month_abbr[1:] + calendar.day_name[:]]
+    + ["sept", "today", "tomorrow", "tonight", "weekend", "next", "this"]
+)
+DATE_ANCHOR_PATTERN = register_pattern("date_anchor", rf'\b(?:{DATE_ANCHOR_WORDS})\b|\d{{1,2}}[/\-.]\d{{1,2}}', re.IGNORECASE)
+DATE_RANGE_ORDINAL_PATTERN = register_pattern("date_range_ordinal", r'from\s+(\d{1,2})(?:st|nd|rd|th)?-(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?', re.IGNORECASE)
+DATE_TO_DATE_PATTERN = register_pattern("date_to_date", r'from\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?\s+to\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?', re.IGNORECASE)
+NUMERIC_DATE_RANGE_PATTERN = register_pattern("numeric_date_range", r'from\s+(\d{1,2})-(\d{1,2})-(\d{4})\s+to\s+(\d{1,2})-(\d{1,2})-(\d{4})', re.IGNORECASE)
+DATE_FOR_DURATION_PATTERN = register_pattern("date_for_duration", rf'from\s+(\d{{1,2}})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{{4}}))?\s+for\s+(\d+|{NUMBER_WORDS})\s+({DURATION_UNITS})', re.IGNORECASE)
+DURATION_FROM_DATE_PATTERN = register_pattern("duration_from_date", rf'for\s+(\d+|a|an|{NUMBER_WORDS})\s+({DURATION_UNITS})\s+from\s+(\d{{1,2}})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{{4}}))?', re.IGNORECASE)
+DURATION_ON_DATE_PATTERN = register_pattern("duration_on_date", rf'for\s+(\d+|a|an|{NUMBER_WORDS})\s+({DURATION_UNITS})\s+on\s+(\d{{1,2}})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{{4}}))?', re.IGNORECASE)
+ON_DATE_FOR_DURATION_PATTERN = register_pattern("on_date_for_duration", rf'on\s+(\d{{1,2}})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{{4}}))?\s+for\s+(\d+|a|an|{NUMBER_WORDS})\s+({DURATION_UNITS})', re.IGNORECASE)
+DURATION_ON_NUMERIC_DATE_PATTERN = register_pattern("duration_on_numeric_date", rf'for\s+(\d+|a|an|{NUMBER_WORDS})\s+({DURATION_UNITS})\s+on\s+(\d{{1,2}})[/\-](\d{{1,2}})[/\-](\d{{4}})', re.IGNORECASE)
+ON_NUMERIC_DATE_FOR_DURATION_PATTERN = register_pattern("on_numeric_date_for_duration", rf'on\s+(\d{{1,2}})[/\-](\d{{1,2}})[/\-](\d{{4}})\s+for\s+(\d+|a|an|{NUMBER_WORDS})\s+({DURATION_UNITS})', re.IGNORECASE)
+BUDGET_PATTERN = register_pattern("budget", r'(?:budget|spend|cost|price|money|funds)\s*(?:is|of)?\s*(?:around|about|approximately)?\s*(?P<prefix>[\$₹€£]|(?:rs\.?|inr|us\$|usd|eur|gbp|aed|sgd|thb|jpy|aud|cad|chf)\s?)?(?P<amount>\d+(?:,\d+)*(?:\.\d+)?)\s*(?P<scale>k|thousand|lakhs?|crores?|million|billion)?\b\s*(?P<suffix>rupees?|inr|rs|dollars?|usd|euros?|eur|pounds?|gbp|aed|dirhams?|sgd|thb|baht|jpy|yen|aud|cad|chf|francs?)?\b', re.IGNORECASE)
+TRAVELERS_PATTERN = register_pattern("travelers", r'(?:(\d+)\s*(?:people|person|travelers?|pax|individuals?|adults?)|(?:family|group)\s*of\s*(\d+)|(?:me|I)\s*(?:and|with)\s*(\d+)\s*(?:others?|friends?|family)?)', re.IGNORECASE)
+KEYWORD_TOKEN_PATTERN = register_pattern("keyword_token", r"[a-z0-9]+")
+# Case-sensitive: the capture has to start with a capitalised word, so "near
+# the beach" does not become a place lookup
+NEAR_PLACE_PATTERN = register_pattern("near_place", r'\b[Nn]ear\s+([A-Z][A-Za-z]+(?:\s[A-Z][A-Za-z]+){0,2})')
+
+# parse_itinerary_data
+OVERVIEW_SECTION_PATTERN = register_pattern("section_overview", r'##\s*1\.\s*Trip Overview(.*?)(?=##\s*2\.|$)', re.DOTALL | re.IGNORECASE)
+DAILY_SECTION_PATTERN = register_pattern("section_daily", r'##\s*2\.\s*Daily Itinerary(.*?)(?=##\s*3\.|$)', re.DOTALL | re.IGNORECASE)
+ACCOMMODATION_SECTION_PATTERN = register_pattern("section_accommodation", r'##\s*3\.\s*Accommodation Details(.*?)(?=##\s*4\.|$)', re.DOTALL | re.IGNORECASE)
+DINING_SECTION_PATTERN = register_pattern("section_dining", r'##\s*4\.\s*Dining Recommendations(.*?)(?=##\s*5\.|$)', re.DOTALL | re.IGNORECASE)
+ATTRACTIONS_SECTION_PATTERN = register_pattern("section_attractions", r'##\s*5\.\s*Attractions & Activities(.*?)(?=##\s*6\.|$)', re.DOTALL | re.IGNORECASE)
+BUDGET_SECTION_PATTERN = register_pattern("section_budget", r'##\s*6\.\s*Budget Breakdown(.*?)(?=##\s*7\.|$)', re.DOTALL | re.IGNORECASE)
+ESSENTIAL_SECTION_PATTERN = register_pattern("section_essential", r'##\s*7\.\s*Essential Information(.*?)$', re.DOTALL | re.IGNORECASE)
+DAY_HEADER_PATTERN = register_pattern("day_header", r'\*\*Day (\d+):[^*]*\*\*', re.IGNORECASE)
+DAY_DATE_PATTERN = register_pattern("day_date", r'(?:Date|On):\s*(\d{1,2}(?:st|nd|rd|th)?\s+\w+(?:\s+\d{4})?|\d{4}-\d{2}-\d{2}|\w+\s+\d{1,2}(?:st|nd|rd|th)?,\s*\d{4})', re.IGNORECASE)
+MORNING_PATTERN = register_pattern("day_morning", r'(?:Morning|AM)(?:[\s\-:]+)([\s\S]*?)(?=(?:Afternoon|Lunch|PM|Evening|Dinner|Accommodation|Day|$))', re.IGNORECASE)
+MORNING_BULLET_PATTERN = register_pattern("day_morning_bullet", r'(?:\*|\-)\s+\*\*Morning:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Afternoon|Lunch|Evening|Dinner|Meals|Accommodation)|$)', re.IGNORECASE)
+AFTERNOON_PATTERN = register_pattern("day_afternoon", r'(?:Afternoon|PM)(?:[\s\-:]+)([\s\S]*?)(?=(?:Evening|Dinner|Accommodation|Day|$))', re.IGNORECASE)
+AFTERNOON_BULLET_PATTERN = register_pattern("day_afternoon_bullet", r'(?:\*|\-)\s+\*\*Afternoon:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Evening|Dinner|Meals|Accommodation)|$)', re.IGNORECASE)
+EVENING_PATTERN = register_pattern("day_evening", r'(?:Evening|Night)(?:[\s\-:]+)([\s\S]*?)(?=(?:Accommodation|Day|$))', re.IGNORECASE)
+EVENING_BULLET_PATTERN = register_pattern("day_evening_bullet", r'(?:\*|\-)\s+\*\*Evening:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Meals|Accommodation)|$)', re.IGNORECASE)
+MEALS_SECTION_PATTERN = register_pattern("day_meals_section", r'(?:\*|\-)\s+\*\*Meals:\*\*([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Accommodation)|$)', re.IGNORECASE)
+MEAL_LINE_PATTERNS = {
+    meal_type: register_pattern(f"day_meal_line_{meal_type}", rf'{meal_type}:\s+([^\n]+)', re.IGNORECASE)
+    for meal_type in ("breakfast", "lunch", "dinner")
+}
+MEAL_INLINE_PATTERNS = {
+    meal_type: register_pattern(f"day_meal_inline_{meal_type}", rf'(?:{meal_type})(?:[\s\-:]+)([^#\n]+)', re.IGNORECASE)
+    for meal_type in ("breakfast", "lunch", "dinner")
+}
+ACCOMMODATION_BULLET_PATTERN = register_pattern("day_accommodation_bullet", r'(?:\*|\-)\s+\*\*Accommodation:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*|$)', re.IGNORECASE)
+ACCOMMODATION_INLINE_PATTERN = register_pattern("day_accommodation_inline", r'(?:Accommodation|Stay|Hotel)(?:[\s\-:]+)([^#\n]+)', re.IGNORECASE)
+ACTIVITY_PATTERN = register_pattern("day_activity", r'(?:Visit|Explore|Experience|Activity)(?:[\s\-:]+)([^#\n]+)', re.IGNORECASE)
+BULLET_ACTIVITY_PATTERN = register_pattern("day_bullet_activity", r'(?:^|\n)(?:\d+\.|\*|\-)\s*([^*#\n]+)', re.MULTILINE)
+SLOT_HEADER_PATTERN = register_pattern("day_slot_header", r'\*\*(Morning|Afternoon|Evening|Meals|Accommodation):')
+ACTIVITY_SEPARATOR_PATTERN = register_pattern("day_activity_separator", r'[,;]')
+SKIP_LINE_PATTERN = register_pattern("day_skip_line", r'^\*+|^#+|^Day \d+|^\-+$')
+BULLET_LINE_PATTERN = register_pattern("day_bullet_line", r'^[\*\-•]\s*')
+NUMBERED_LINE_PATTERN = register_pattern("day_numbered_line", r'^\d+\.')
+LIST_MARKER_PATTERN = register_pattern("day_list_marker", r'^[\*\-•]\s*|\d+\.\s*')
+MEAL_FALLBACK_PATTERNS = {
+    meal_type: [
+        register_pattern(f"day_meal_fallback_{meal_type}_label", rf'{meal_type}[:\-]\s*([^\n,;]+)', re.IGNORECASE),
+        register_pattern(f"day_meal_fallback_{meal_type}_at", rf'\b{meal_type}\s+at\s+([^\n,;]+)', re.IGNORECASE),
+        register_pattern(f"day_meal_fallback_{meal_type}_for", rf'for\s+{meal_type}[:\-]?\s*([^\n,;]+)', re.IGNORECASE),
+    ]
+    for meal_type in ("breakfast", "lunch", "dinner")
+}
+ACCOMMODATION_FALLBACK_PATTERNS = [
+    register_pattern("day_accommodation_fallback_label", r'(?:accommodation|hotel|stay|lodge|resort)[:\-]\s*([^\n,;]+)', re.IGNORECASE),
+    register_pattern("day_accommodation_fallback_stay_at", r'stay\s+at\s+([^\n,;]+)', re.IGNORECASE),
+    register_pattern("day_accommodation_fallback_overnight", r'overnight\s+at\s+([^\n,;]+)', re.IGNORECASE),
+    register_pattern("day_accommodation_fallback_loose", r'accommodation[:\-]?\s*([^\n,;]+)', re.IGNORECASE),
+]
+
+# parse_itinerary_data_hardened: applied to one length-capped line at a time
+HARDENED_SECTION_HEADING_PATTERN = register_pattern("hardened_section_heading", r'^#{1,3}[ \t]*([1-7])\.')
+HARDENED_DAY_HEADING_PATTERN = register_pattern("hardened_day_heading", r'\*\*Day[ \t]*(\d{1,3})[ \t]*:[^*]{0,200}\*\*', re.IGNORECASE)
+HARDENED_LIST_MARKER_PATTERN = register_pattern("hardened_list_marker", r'^(?:[*\-•]|\d{1,3}[.)])[ \t]*')
+INLINE_MEAL_PATTERN = register_pattern("inline_meal", r'\b(breakfast|lunch|dinner)\s+at\s+([^.;,\n]{1,120})', re.IGNORECASE)
+
+# extract_transportation: lines are tokenized once and only lines with a
+# keyword token get the alternation over every mode keyword, matched on whole
+# words so "trail" and "business" are not rail and bus
+TRANSPORT_MODES = {
+    "flight": ("✈️", "Flight", ["flight", "flights", "fly", "flies", "flying", "airline", "airlines", "plane", "planes", "air travel"]),
+    "train": ("🚂", "Train", ["train", "trains", "railway", "railways", "rail"]),
+    "bus": ("🚌", "Bus", ["bus", "buses", "coach", "minivan"]),
+    "metro": ("🚇", "Metro", ["metro", "subway", "underground", "tram", "bts", "mrt"]),
+    "taxi": ("🚕", "Taxi", ["taxi", "taxis", "cab", "cabs", "uber", "tuk-tuk", "tuk tuk", "rickshaw"]),
+    "ferry": ("⛴️", "Ferry", ["ferry", "ferries", "boat", "speedboat", "cruise"]),
+    "car": ("🚗", "Car", ["rental car", "car rental", "self-drive", "drive", "driving"]),
+    "local": ("🚌", "Local Transport", ["local transport", "public transport"]),
+}
+TRANSPORT_KEYWORD_MODES = {keyword: mode for mode, (_, _, keywords) in TRANSPORT_MODES.items() for keyword in keywords}
+TRANSPORT_KEYWORD_PATTERN = register_pattern(
+    "transport_keyword",
+    r"(?<![\w-])(" + "|".join(re.escape(keyword) for keyword in sorted(TRANSPORT_KEYWORD_MODES, key=len, reverse=True)) + r")(?![\w-])",
+    re.IGNORECASE
+)
+TRANSPORT_TOKEN_PATTERN = register_pattern("transport_token", r"[a-z]+")
+# First word of every keyword; a line without one cannot mention transport
+TRANSPORT_TRIGGER_TOKENS = frozenset(TRANSPORT_TOKEN_PATTERN.findall(" ".join(TRANSPORT_KEYWORD_MODES)))
+TRANSPORT_CLAUSE_SPLIT_PATTERN = register_pattern("transport_clause_split", r"(?<=[.!?;])\s+")
+TRANSPORT_FROM_PATTERN = register_pattern("transport_from", r"\bfrom\s+([A-Z][\w'’.\-]*(?:\s+[A-Z][\w'’.\-]*){0,3})")
+TRANSPORT_TO_PATTERN = register_pattern("transport_to", r"\b(?:to|into|towards?)\s+([A-Z][\w'’.\-]*(?:\s+[A-Z][\w'’.\-]*){0,3})")
+TRANSPORT_NORMALIZE_PATTERN = register_pattern("transport_normalize", r"[^\w]+")
+
+# Raw-section fallbacks shown by main() when a tab has no parsed content
+RAW_SECTION_PATTERNS = {
+    "daily": register_pattern("raw_section_daily", r'##\s*2\.\s*Daily Itinerary(.*?)(?=##\s*3\.|$)', re.DOTALL | re.IGNORECASE),
+    "accommodation": register_pattern("raw_section_accommodation", r'##\s*3\.\s*Accommodation(.*?)(?=##\s*4\.|$)', re.DOTALL | re.IGNORECASE),
+    "dining": register_pattern("raw_section_dining", r'##\s*4\.\s*Dining(.*?)(?=##\s*5\.|$)', re.DOTALL | re.IGNORECASE),
+    "attractions": register_pattern("raw_section_attractions", r'##\s*5\.\s*Attractions(.*?)(?=##\s*6\.|$)', re.DOTALL | re.IGNORECASE),
+    "budget": register_pattern("raw_section_budget", r'##\s*6\.\s*Budget(.*?)(?=##\s*7\.|$)', re.DOTALL | re.IGNORECASE),
+    "essential": register_pattern("raw_section_essential", r'##\s*7\.\s*Essential(.*?)$', re.DOTALL | re.IGNORECASE),
+}
+
+# Keyword vocabularies for the categorical trip fields. Labels are listed in
+# precedence order, which breaks ties between equally scored labels.
+KEYWORD_CATEGORIES = {
+    "Trip Type": {
+        "Adventure": ["adventure", "adventures", "trekking", "trek", "hiking", "hike", "rafting", "climbing"],
+        "Leisure/Beach": ["beach", "beaches", "resort", "resorts", "spa", "relax", "relaxing", "relaxation", "leisure", "vacation"],
+        "Business": ["business", "work", "conference", "meeting", "meetings"],
+        "Cultural/Sightseeing": ["culture", "cultural", "heritage", "museum", "museums", "historical", "sightseeing"],
+        "Family": ["family", "kids", "children"],
+        "Romantic/Honeymoon": ["honeymoon", "romantic", "couple"],
+    },
+    "Transportation Preferences": {
+        "Flight": ["flight", "flights", "fly", "flying", "air", "plane", "planes"],
+        "Train": ["train", "trains", "railway", "railways"],
+        "Car/Road Trip": ["car", "drive", "driving", "road trip"],
+        "Bus": ["bus", "buses", "coach"],
+    },
+    "Accommodation Preferences": {
+        "Luxury": ["luxury", "5 star", "premium", "high-end"],
+        # Bare "budget" names the spending limit ("budget of $3000"), so only
+        # phrases that describe the stay count
+        "Budget": ["budget hotel", "budget hotels", "budget stay", "budget accommodation", "budget friendly",
+                   "on a budget", "tight budget", "cheap", "affordable", "hostel", "hostels"],
+        "Mid-range": ["mid-range", "3 star", "moderate"],
+        "Resort": ["resort", "resorts", "all-inclusive"],
+        "Homestay/Local": ["homestay", "homestays", "local", "authentic"],
+    },
+    "Special Requirements": {
+        "Vegetarian/Vegan food": ["vegetarian", "vegan", "no meat"],
+        "Accessibility requirements": ["disability", "wheelchair", "accessible"],
+        "Pet-friendly": ["pet", "pets", "dog", "dogs", "cat", "cats"],
+        "Medical considerations": ["medical", "medicine", "medication", "treatment"],
+    },
+    "Number of Travelers": {
+        "1": ["alone", "solo", "myself", "just me"],
+        "2": ["couple", "two of us", "me and my"],
+    },
+}
+
+def build_keyword_index(categories):
+    """Map each normalized keyword phrase to the (category, label) pairs it votes for"""
+    index = {}
+    precedence = {}
+    for category, labels in categories.items():
+        for rank, (label, keywords) in enumerate(labels.items()):
+            precedence[(category, label)] = rank
+            for keyword in keywords:
+                phrase = " ".join(KEYWORD_TOKEN_PATTERN.findall(keyword.lower()))
+                index.setdefault(phrase, []).append((category, label))
+    max_words = max(len(phrase.split()) for phrase in index)
+    return index, precedence, max_words
+
+KEYWORD_INDEX, KEYWORD_PRECEDENCE, KEYWORD_MAX_WORDS = build_keyword_index(KEYWORD_CATEGORIES)
+
+def classify_keywords(text):
+    """Match every keyword vocabulary against the text in a single pass.
+
+    The text is tokenized once and each 1..KEYWORD_MAX_WORDS word window is
+    looked up in KEYWORD_INDEX, so matching is on whole words and the cost does
+    not grow with the number of keywords. Returns {category: [(label, score)]}
+    with the best label first; the score is the number of keyword hits.
+    """
+    tokens = KEYWORD_TOKEN_PATTERN.findall(text.lower())
+    scores = {}
+    for i in range(len(tokens)):
+        for n in range(1, min(KEYWORD_MAX_WORDS, len(tokens) - i) + 1):
+            phrase = tokens[i] if n == 1 else " ".join(tokens[i:i + n])
+            for match in KEYWORD_INDEX.get(phrase, ()):
+                scores[match] = scores.get(match, 0) + 1
+    
+    results = {}
+    for (category, label), score in scores.items():
+        results.setdefault(category, []).append((label, score))
+    for category, labels in results.items():
+        labels.sort(key=lambda item: (-item[1], KEYWORD_PRECEDENCE[(category, item[0])]))
+    return results
+
+# Budgets are bound to the matched number: a scale word or currency marker
+# only counts when it touches the amount. Amounts are converted to a base
+# currency with a local, versioned rate table (currency_rates.json).
+CURRENCY_RATES_PATH = os.getenv(
+    "CURRENCY_RATES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "currency_rates.json")
+)
+BUDGET_SCALES = {"k": 1000, "thousand": 1000, "lakh": 100000, "crore": 10000000, "million": 1000000, "billion": 1000000000}
+CURRENCY_MARKERS = {
+    "₹": "INR", "rs": "INR", "inr": "INR", "rupee": "INR", "rupees": "INR",
+    "$": "USD", "us$": "USD", "usd": "USD", "dollar": "USD", "dollars": "USD",
+    "€": "EUR", "eur": "EUR", "euro": "EUR", "euros": "EUR",
+    "£": "GBP", "gbp": "GBP", "pound": "GBP", "pounds": "GBP",
+    "aed": "AED", "dirham": "AED", "dirhams": "AED",
+    "sgd": "SGD", "thb": "THB", "baht": "THB", "jpy": "JPY", "yen": "JPY",
+    "aud": "AUD", "cad": "CAD", "chf": "CHF", "franc": "CHF", "francs": "CHF",
+}
+CURRENCY_SYMBOLS = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£"}
+DEFAULT_BUDGET_CURRENCY = "INR"
+
+@st.cache_resource
+def load_currency_rates(path=None):
+    """Load the rate table once: {"version", "base", "rates": {code: base units per unit}}"""
+    with open(path or CURRENCY_RATES_PATH, encoding="utf-8") as f:
+        table = json.load(f)
+    return {"version": table["version"], "base": table["base"], "rates": table["rates"]}
+
+def currency_code(marker):
+    """Currency code for a symbol, code or word next to an amount"""
+    if not marker:
+        return DEFAULT_BUDGET_CURRENCY
+    return CURRENCY_MARKERS.get(marker.strip().rstrip(".").lower(), DEFAULT_BUDGET_CURRENCY)
+
+def convert_currency(amount, currency, rates=None):
+    """Convert amount to the rate table's base currency, or None for unknown currencies"""
+    rate = (rates or load_currency_rates())["rates"].get(currency)
+    return amount * rate if rate is not None else None
+
+def format_money(amount, currency):
+    amount = f"{amount:,.0f}" if amount == int(amount) else f"{amount:,.2f}"
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    return f"{symbol}{amount}" if symbol else f"{amount} {currency}"
+
+def parse_budget(text, travelers=None, duration_days=None):
+    """Parse the trip budget out of text.
+
+    Returns None when no budget is mentioned, otherwise a dict with the
+    amount and its currency code, the amount in the rate table's base
+    currency, and per-person / per-day figures where the traveler count or
+    duration is known.
+    """
+    match = BUDGET_PATTERN.search(text)
+    if not match:
+        return None
+    amount = float(match.group("amount").replace(",", ""))
+    scale = match.group("scale")
+    if scale:
+        amount *= BUDGET_SCALES[scale.lower().rstrip("s")]
+    currency = currency_code(match.group("prefix") or match.group("suffix"))
+    rates = load_currency_rates()
+    return {
+        "amount": amount,
+        "currency": currency,
+        "base_amount": convert_currency(amount, currency, rates),
+        "base_currency": rates["base"],
+        "rates_version": rates["version"],
+        "per_person": amount / travelers if travelers else None,
+        "per_day": amount / duration_days if duration_days else None,
     }
-    # Extract locations
-    locations = [ent.text for ent in doc.ents if ent.label_ in {"GPE", "LOC"}]    
-    common_destinations = {"goa","Goa","French countryside","goa","Maldives", "Bali", "Paris", "New York", "Los Angeles", "San Francisco", "Tokyo", "London", "Dubai", "Rome", "Bangkok"}
-    # Backup regex-based location extraction
-    regex_matches = re.findall(r'\b(?:from|to|visit|traveling to|heading to|going to|in|at|of|to the|toward the)\s+([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)', text)
-    # Check for cities in text using geonamescache
-    extracted_cities = []
-    words = text.split()
-    for i in range(len(words)):
-        for j in range(i + 1, min(i + 4, len(words))):  # Check up to 3-word phrases
-            phrase = " ".join(words[i:j+1])
-            if phrase.lower() in cities_dict or phrase in common_destinations:
-                extracted_cities.append(cities_dict[phrase.lower()])
-
-    # Combine all sources and remove duplicates while preserving order
-    seen = set()
-    all_locations = [loc for loc in locations + regex_matches + extracted_cities if not (loc in seen or seen.add(loc))]
-
-    # Determine starting location and destination using dependency parsing
-    start_location, destination = None, None
-    for token in doc:
-        if token.text.lower() == "from":
-            location = " ".join(w.text for w in token.subtree if w.ent_type_ in {"GPE", "LOC"})
-            if location:
-                start_location = location
-        elif token.text.lower() in {"to", "toward"}:
-            location = " ".join(w.text for w in token.subtree if w.ent_type_ in {"GPE", "LOC"})
-            if location:
-                destination = location
-
-    # If dependency parsing fails, use list extraction
-    if not start_location and not destination:
-        if len(all_locations) > 1:
-            start_location, destination = all_locations[:2]
-        elif len(all_locations) == 1:
-            destination = all_locations[0]
 
-    # Construct final details dictionary
-    details = {}
-    if start_location:
-        details["Starting Location"] = start_location
-    if destination:
-        details["Destination"] = destination
+# Location resolution. One pass over the request's tokens collects place
+# candidates, each with the role its cue word gives it ("from" starts, "to",
+# "visit" and "in" lead to destinations; commas and "and" continue a list)
+# and the source that recognized it. Each candidate is ranked by its cue (any
+# cue beats a bare mention) and its source (a recognized place beats a name
+# kept as typed); destinations are the candidates of the best rank.
+LOCATION_CUES = {
+    "from": ("start", "explicit"),
+    "to": ("destination", "explicit"),
+    "toward": ("destination", "explicit"),
+    "towards": ("destination", "explicit"),
+    "visit": ("destination", "explicit"),
+    "visiting": ("destination", "explicit"),
+    "via": ("destination", "explicit"),
+    "in": ("destination", "contextual"),
+}
+# "in" ranks with the explicit cues; it only never keeps names as typed
+LOCATION_STRENGTHS = {"explicit": 0, "contextual": 0, "mentioned": 1}
+LOCATION_SOURCE_RANKS = {"gazetteer": 0, "ner": 0, "fuzzy": 0, "typed": 1}
+# Words that continue the current cue's list, and words skipped inside it
+LOCATION_LIST_WORDS = {",", "and", "&"}
+LOCATION_SKIP_WORDS = {"the"}
+# A cued run of capitalized words this long at most is tried as a misspelling,
+# then kept as typed right after an explicit cue or "and" ("to Santorini");
+# after a comma it is more often the next clause ("to Paris, Budget $3000")
+LOCATION_FUZZY_MAX_WORDS = 3
+# Trigram lookups are the expensive part of location resolution. Each request
+# looks up a distinct run once and at most this many distinct runs; past the
+# cap (a long paste, not a trip request) runs are only kept as typed.
+LOCATION_FUZZY_MAX_LOOKUPS = 24
+# Capitalized words that follow cues without being places ("from March to May")
+LOCATION_NON_PLACE_WORDS = (
+    {name.lower() for name in calendar.month_name[1:] + calendar.month_abbr[1:] + calendar.day_name[:]}
+    | {"spring", "summer", "autumn", "fall", "winter", "monsoon", "christmas", "easter", "diwali"}
+)
+# Everyday words that follow "to" ("to relax", "to nice places") and happen to
+# be, or fuzzily resemble, place names. They are skipped inside a cue's list;
+# spaCy stop words and, with a tagger, verbs and adjectives count too.
+LOCATION_COMMON_WORDS = {
+    "relax", "explore", "enjoy", "see", "experience", "discover", "celebrate", "attend", "meet", "stay",
+    "spend", "shop", "eat", "try", "find", "book", "go", "get", "take", "hike", "trek", "surf", "dive",
+    "nice", "beautiful", "amazing", "best", "cheap", "good", "great", "lovely", "fun", "quiet", "warm",
+    "beach", "beaches", "city", "mountains", "hills", "places", "somewhere", "anywhere",
+}
+LOCATION_COMMON_TAGS = {"VERB", "AUX", "ADJ", "ADV", "PRON", "DET"}
+class LocationCandidate(NamedTuple):
+    name: str
+    role: str | None
+    strength: str
+    cue: str | None
+    source: str
+    position: int
+    
+    @property
+    def rank(self):
+        return LOCATION_STRENGTHS[self.strength], LOCATION_SOURCE_RANKS[self.source]
 
-    # Enhanced destination extraction for complex travel patterns
-    def extract_advanced_destinations(text, current_start, current_dest):
-        """Handle complex patterns like 'from india to china, to japan from nepal' or 'to thailand'"""
-        
-        # Pattern 1: Complex multi-destination "from X to Y, to Z from W"
-        complex_pattern = r'from\s+([a-zA-Z\s]+?)\s+to\s+([a-zA-Z\s]+?)(?:,\s*to\s+([a-zA-Z\s]+?))?(?:\s+from\s+([a-zA-Z\s]+?))?'
-        complex_match = re.search(complex_pattern, text, re.IGNORECASE)
-        
-        if complex_match:
-            groups = complex_match.groups()
-            start_loc = groups[0].strip().title() if groups[0] else current_start
-            
-            destinations = []
-            for i in range(1, len(groups)):
-                if groups[i]:
-                    dest = groups[i].strip().title()
-                    if dest and dest not in destinations:
-                        destinations.append(dest)
-            
-            return start_loc, ", ".join(destinations) if destinations else current_dest
-        
-        # Pattern 2: Simple "to X" with multiple destinations
-        to_matches = re.findall(r'\bto\s+([a-zA-Z\s]+?)(?:\s|$|,)', text, re.IGNORECASE)
-        if to_matches:
-            destinations = []
-            for match in to_matches:
-                cleaned = match.strip().title()
-                # Remove common words that aren't locations
-                cleaned = re.sub(r'\b(And|Or|The|A|An|For|Days?|Weeks?|Months?)\b', '', cleaned).strip()
-                if len(cleaned) > 2 and cleaned not in destinations:
-                    destinations.append(cleaned)
-            if destinations:
-                return current_start, ", ".join(destinations)
-        
-        # Pattern 3: Visit/traveling patterns
-        visit_pattern = r'(?:visit|traveling to|going to)\s+([a-zA-Z\s,]+?)(?:\s+for|\s+in|\.|$)'
-        visit_match = re.search(visit_pattern, text, re.IGNORECASE)
-        if visit_match:
-            locations_str = visit_match.group(1)
-            destinations = []
-            for loc in locations_str.split(','):
-                cleaned = loc.strip().title()
-                if len(cleaned) > 2:
-                    destinations.append(cleaned)
-            if destinations:
-                return current_start, ", ".join(destinations)
-        
-        return current_start, current_dest
-    
-    # Apply enhanced extraction
-    start_location, destination = extract_advanced_destinations(text, start_location, destination)
-    
-    # Update details dictionary with enhanced results
-    if start_location:
-        details["Starting Location"] = start_location
-    if destination:
-        details["Destination"] = destination
+def is_common_word(token, tagged):
+    if token.lower_ in LOCATION_COMMON_WORDS or token.is_stop:
+        return True
+    return tagged and token.pos_ in LOCATION_COMMON_TAGS
 
-    # Extract duration
-    duration_match = re.search(r'(?P<value>\d+|one|two|three|four|five|six|seven|eight|nine|ten)\s*[-]?\s*(?P<unit>day|days|night|nights|week|weeks|month|months)', text, re.IGNORECASE)
+class LocationResolution(NamedTuple):
+    start: str | None
+    destinations: tuple
+    candidates: tuple
+    
+    def provenance(self):
+        """{place: "cue + source"} for the places that were used"""
+        used = {self.start, *self.destinations}
+        return {
+            candidate.name: f"{candidate.cue or 'mention'} + {candidate.source}"
+            for candidate in reversed(self.candidates) if candidate.name in used
+        }
+
+def fuzzy_place_name(text, fuzzy_names):
+    """resolve_place_name(text) memoized in fuzzy_names; None once the
+    request has used up LOCATION_FUZZY_MAX_LOOKUPS distinct lookups"""
+    if text not in fuzzy_names:
+        if len(fuzzy_names) >= LOCATION_FUZZY_MAX_LOOKUPS:
+            return None
+        fuzzy_names[text] = resolve_place_name(text)[0]
+    return fuzzy_names[text]
+
+def match_place(doc, i, entities, strength, keep_typed=False, tagged=False, fuzzy_names=None):
+    """(canonical name, source, tokens used) for a place starting at doc[i], or None.
+
+    Exact gazetteer names win, longest first, then spaCy entities; after a cue
+    a capitalized run is also tried as a misspelling, and with keep_typed it
+    is kept as typed. Lowercase words only count after a cue and only as
+    exact names ("from bangalore"), since fuzzy matching turns words like
+    "find" into "Finland". Common words are never a one-word lowercase name
+    ("to nice places"), a misspelling or a typed name ("to Relax").
+    fuzzy_names memoizes entity and misspelling lookups for the request
+    (see fuzzy_place_name).
+    """
+    if fuzzy_names is None:
+        fuzzy_names = {}
+    if doc[i].lower_ in LOCATION_NON_PLACE_WORDS:
+        return None
+    cued = strength != "mentioned"
+    common = is_common_word(doc[i], tagged)
+    width = 0
+    for token in doc[i:i + place_index.max_words]:
+        # No place name runs across a number, a comma or a cue word
+        if token.is_punct and token.text not in "-'’." or token.like_num or token.lower_ in LOCATION_CUES:
+            break
+        width += 1
+    for n in range(width, 0, -1):
+        span = doc[i:i + n]
+        if span[-1].is_punct:
+            continue
+        if n == 1 and common and not span.text[:1].isupper():
+            continue
+        record = place_index.lookup(span.text)
+        if record and (cued or n > 1 or place_index.single_word_place(span.text, record)):
+            return record["name"], "gazetteer", n
+    
+    entity = entities.get(i)
+    if entity is not None:
+        return fuzzy_place_name(entity.text, fuzzy_names) or entity.text, "ner", len(entity)
+    
+    if cued and not common and doc[i].text[:1].isupper():
+        run = 0
+        for token in doc[i:i + LOCATION_FUZZY_MAX_WORDS]:
+            if not token.is_alpha or token.lower_ in LOCATION_CUES or token.lower_ in PLACE_EDGE_STOPWORDS:
+                break
+            run += 1
+        for n in range(run, 0, -1):
+            name = fuzzy_place_name(doc[i:i + n].text, fuzzy_names)
+            if name:
+                return name, "fuzzy", n
+        if keep_typed:
+            # Keep only the capitalized part ("Santorini", not "Santorini beaches")
+            n = next((n for n in range(run) if not doc[i + n].text[:1].isupper()), run)
+            return doc[i:i + n].text, "typed", n
+    return None
+
+def resolve_locations(doc):
+    """Resolve the start and destinations of a request in one token pass"""
+    entities = {ent.start: ent for ent in doc.ents if ent.label_ in {"GPE", "LOC"}}
+    # has_annotation scans the whole doc, so ask once
+    tagged = doc.has_annotation("POS")
+    fuzzy_names = {}
+    candidates = []
+    cue = None
+    i = 0
+    while i < len(doc):
+        token = doc[i]
+        word = token.lower_
+        if word in LOCATION_CUES:
+            cue = word
+            i += 1
+            continue
+        if cue and (word in LOCATION_LIST_WORDS or word in LOCATION_SKIP_WORDS):
+            i += 1
+            continue
+        
+        strength = LOCATION_CUES[cue][1] if cue else "mentioned"
+        keep_typed = strength == "explicit" and doc[i - 1].text != ","
+        match = match_place(doc, i, entities, strength, keep_typed, tagged, fuzzy_names) if token.is_alpha else None
+        if match:
+            name, source, used = match
+            role = LOCATION_CUES[cue][0] if cue else None
+            candidates.append(LocationCandidate(name, role, strength, cue, source, i))
+            i += used
+            continue
+        if cue and is_common_word(token, tagged):
+            # "to Explore Kyoto", "to relax in Goa": the list goes on after it
+            i += 1
+            continue
+        # Any other word ends the cue's list
+        cue = None
+        i += 1
+    
+    # The best-ranked "from" wins, earliest first, so later ones ("to japan
+    # from nepal") are neither start nor destination
+    starts = [candidate for candidate in candidates if candidate.role == "start"]
+    start = min(starts, key=lambda candidate: (candidate.rank, candidate.position)).name if starts else None
+    
+    # Destinations are every candidate of the best rank, in request order
+    ranked = [candidate for candidate in candidates if candidate.role != "start"]
+    best = min((candidate.rank for candidate in ranked), default=None)
+    destinations = list(dict.fromkeys(candidate.name for candidate in ranked if candidate.rank == best))
+    if start in destinations:
+        # A place is never both; it stays a destination if it is the only one
+        if len(destinations) > 1:
+            destinations.remove(start)
+        else:
+            start = None
+    return LocationResolution(start, tuple(destinations), tuple(candidates))
+
+def extract_locations(text, doc):
+    """Return (start location, destination) named in the request"""
+    resolution = resolve_locations(doc)
+    return resolution.start, ", ".join(resolution.destinations) or None
+
+def extract_duration_days(text):
+    """Return the trip length in days mentioned in the text, or None"""
+    duration_match = DURATION_PATTERN.search(text)
     duration_days = None
 
     if duration_match:
@@ -337,62 +1502,49 @@ def extract_details(text):
             duration_days = value * 30
         else:
             duration_days = value
-        details["Trip Duration"] = f"{duration_days} days"
     else:
         # Handle cases where the duration is mentioned without a number
-        if "week" in text:
+        units = {unit.lower().rstrip("s") for unit in DURATION_BARE_UNIT_PATTERN.findall(text)}
+        if "week" in units:
             duration_days = 7
-        elif "month" in text:
+        elif "month" in units:
             duration_days = 30
-        elif "day" in text or "night" in text:
+        elif "day" in units or "night" in units:
             duration_days = 1
-        
-        if duration_days:
-            details["Trip Duration"] = f"{duration_days} days"        
-    
-    # Extract dates
-    text_lower = text.lower()
-    
-    # NEW PATTERN: Handle date ranges with format "5-12th june"
+    return duration_days
+
+def extract_dates(text, duration_days=None):
+    """Return (start date, end date, duration in days) for the dates in the text"""
     text_lower = text.lower()
     
     # Create patterns for different date formats
     
     # Pattern 1: Handle date ranges with format "from 3-13th april 2025"
-    date_range_ordinal_pattern = r'from\s+(\d{1,2})(?:st|nd|rd|th)?-(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?'
-    ordinal_match = re.search(date_range_ordinal_pattern, text, re.IGNORECASE)
+    ordinal_match = DATE_RANGE_ORDINAL_PATTERN.search(text)
     
     # Pattern 2: Handle formats like "from 22th june 2025 to 29th june 2025"
-    date_to_date_pattern = r'from\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?\s+to\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?'
-    to_date_match = re.search(date_to_date_pattern, text, re.IGNORECASE)
+    to_date_match = DATE_TO_DATE_PATTERN.search(text)
     
     # Pattern 3: Handle formats like "from 02-04-2025 to 29-04-2025"
-    numeric_date_pattern = r'from\s+(\d{1,2})-(\d{1,2})-(\d{4})\s+to\s+(\d{1,2})-(\d{1,2})-(\d{4})'
-    numeric_match = re.search(numeric_date_pattern, text, re.IGNORECASE)
+    numeric_match = NUMERIC_DATE_RANGE_PATTERN.search(text)
     
     # Pattern 4: Handle formats like "from 12th march for two week"
-    date_for_duration_pattern = r'from\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?\s+for\s+(\d+|one|two|three|four|five|six|seven|eight|nine|ten)\s+(day|days|week|weeks|month|months)'
-    date_for_duration_match = re.search(date_for_duration_pattern, text, re.IGNORECASE)
+    date_for_duration_match = DATE_FOR_DURATION_PATTERN.search(text)
     
     # Pattern 5: Handle formats like "for a week from 13th april"
-    duration_from_date_pattern = r'for\s+(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten)\s+(day|days|week|weeks|month|months)\s+from\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?'
-    duration_from_date_match = re.search(duration_from_date_pattern, text, re.IGNORECASE)
+    duration_from_date_match = DURATION_FROM_DATE_PATTERN.search(text)
     
     # Pattern 6: Handle formats like "for two weeks on 3rd april"
-    duration_on_date_pattern = r'for\s+(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten)\s+(day|days|week|weeks|month|months)\s+on\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?'
-    duration_on_date_match = re.search(duration_on_date_pattern, text, re.IGNORECASE)
+    duration_on_date_match = DURATION_ON_DATE_PATTERN.search(text)
     
     # Pattern 7: Handle formats like "on 13th march for a week"
-    on_date_for_duration_pattern = r'on\s+(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)(?:\s+(\d{4}))?\s+for\s+(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten)\s+(day|days|week|weeks|month|months)'
-    on_date_for_duration_match = re.search(on_date_for_duration_pattern, text, re.IGNORECASE)
+    on_date_for_duration_match = ON_DATE_FOR_DURATION_PATTERN.search(text)
     
     # Pattern 8: Handle formats like "for 2 weeks on 20/05/2025" or "for two weeks on 02-08-2025"
-    duration_on_numeric_date_pattern = r'for\s+(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten)\s+(day|days|week|weeks|month|months)\s+on\s+(\d{1,2})[/\-](\d{1,2})[/\-](\d{4})'
-    duration_on_numeric_date_match = re.search(duration_on_numeric_date_pattern, text, re.IGNORECASE)
+    duration_on_numeric_date_match = DURATION_ON_NUMERIC_DATE_PATTERN.search(text)
     
     # Pattern 9: Handle formats like "on 05/06/2025 for two weeks" or "on 06-07-2025 for 2 weeks"
-    on_numeric_date_for_duration_pattern = r'on\s+(\d{1,2})[/\-](\d{1,2})[/\-](\d{4})\s+for\s+(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten)\s+(day|days|week|weeks|month|months)'
-    on_numeric_date_for_duration_match = re.search(on_numeric_date_for_duration_pattern, text, re.IGNORECASE)
+    on_numeric_date_for_duration_match = ON_NUMERIC_DATE_FOR_DURATION_PATTERN.search(text)
     
     # Function to convert text numbers to integers
     def convert_text_to_number(text_num):
@@ -612,7 +1764,7 @@ def extract_details(text):
         if not start_date:
             try:
                 # Look for any date-like strings
-                dates_found = search_dates(text)
+                dates_found = [(found, value) for found, value in search_dates(text, settings={"PREFER_DATES_FROM": "future"}) or () if DATE_ANCHOR_PATTERN.search(found)]
                 if dates_found:
                     first_date = dates_found[0][1]
                     start_date = first_date
@@ -621,6 +1773,55 @@ def extract_details(text):
             except:
                 pass
     
+    return start_date, end_date, duration_value
+
+def extract_details(text, timings=None):
+    """Extract trip details from a request. With a timings dict, the seconds
+    spent in each stage are added to it under the stage name."""
+    stage_started = time.perf_counter()
+    def stage_done(stage):
+        nonlocal stage_started
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + now - stage_started
+            stage_started = now
+
+    doc = nlp(text)
+    stage_done("nlp")
+    # Extract locations
+    start_location, destination = extract_locations(text, doc)
+    stage_done("locations")
+
+    # Construct final details dictionary
+    details = {}
+    if start_location:
+        details["Starting Location"] = start_location
+    if destination:
+        details["Destination"] = destination
+
+    destination_types = describe_destination_types(destination)
+    if destination_types:
+        details["Destination Type"] = destination_types
+    
+    # Attach distances and nearby places from the gazetteer
+    travel_distance = describe_distances(start_location, destination)
+    if travel_distance:
+        details["Travel Distance"] = travel_distance
+    nearby_places = describe_nearby_places(text)
+    if nearby_places:
+        details["Nearby Places"] = nearby_places
+    stage_done("places")
+
+    # Extract duration
+    duration_days = extract_duration_days(text)
+    if duration_days:
+        details["Trip Duration"] = f"{duration_days} days"
+    stage_done("duration")
+    
+    # Extract dates
+    start_date, end_date, duration_value = extract_dates(text, duration_days)
+    stage_done("dates")
+    
     # Set the details
     if start_date:
         details["Start Date"] = start_date.strftime("%Y-%m-%d")
@@ -629,40 +1830,24 @@ def extract_details(text):
     if duration_value and not details.get("Trip Duration"):
         details["Trip Duration"] = f"{duration_value} days"
     
-    # Extract budget
-    budget_pattern = r'(?:budget|spend|cost|price|money|funds)\s*(?:is|of)?\s*(?:around|about|approximately)?\s*[\$₹€£]?(\d+(?:,\d+)?(?:\.\d+)?)\s*(?:k|thousand|lakh|crore|million|billion)?'
-    budget_match = re.search(budget_pattern, text, re.IGNORECASE)
-    if budget_match:
-        budget_amount = budget_match.group(1)
-        # Check for currency symbols or mentions
-        if "₹" in text or "rupee" in text_lower or "inr" in text_lower:
-            currency = "₹"
-        elif "$" in text or "dollar" in text_lower or "usd" in text_lower:
-            currency = "$"
-        elif "€" in text or "euro" in text_lower:
-            currency = "€"
-        elif "£" in text or "pound" in text_lower or "gbp" in text_lower:
-            currency = "£"
-        else:
-            currency = "₹"  # Default to Indian Rupees
-        
-        # Handle scale modifiers
-        if "k" in text_lower or "thousand" in text_lower:
-            budget_amount = str(int(float(budget_amount) * 1000))
-        elif "lakh" in text_lower:
-            budget_amount = str(int(float(budget_amount) * 100000))
-        elif "crore" in text_lower:
-            budget_amount = str(int(float(budget_amount) * 10000000))
-        elif "million" in text_lower:
-            budget_amount = str(int(float(budget_amount) * 1000000))
-        elif "billion" in text_lower:
-            budget_amount = str(int(float(budget_amount) * 1000000000))
-        
-        details["Budget Range"] = f"{currency}{budget_amount}"
+    # Order multi-destination trips locally so the model does not have to
+    destinations = [place.strip() for place in (destination or "").split(",") if place.strip()]
+    if len(destinations) > 1:
+        trip_days = int(details["Trip Duration"].split()[0]) if details.get("Trip Duration") else None
+        route = plan_route(start_location, destinations, trip_days)
+        if route:
+            details["Route Plan"] = describe_route(start_location, route)
+            details["Destination"] = ", ".join([stop["name"] for stop in route["stops"]] + route["dropped"])
+            # The route already carries the leg distances
+            details.pop("Travel Distance", None)
+    stage_done("route")
+    
+    # Match all keyword categories in one pass
+    keyword_matches = classify_keywords(text)
+    stage_done("keywords")
     
     # Extract number of travelers
-    travelers_pattern = r'(?:(\d+)\s*(?:people|person|travelers?|pax|individuals?|adults?)|(?:family|group)\s*of\s*(\d+)|(?:me|I)\s*(?:and|with)\s*(\d+)\s*(?:others?|friends?|family)?)'
-    travelers_match = re.search(travelers_pattern, text, re.IGNORECASE)
+    travelers_match = TRAVELERS_PATTERN.search(text)
     if travelers_match:
         # Get the first non-None group
         num = travelers_match.group(1) or travelers_match.group(2) or travelers_match.group(3)
@@ -672,202 +1857,909 @@ def extract_details(text):
                 details["Number of Travelers"] = str(int(num) + 1)
             else:
                 details["Number of Travelers"] = num
-    elif any(word in text_lower for word in ["alone", "solo", "myself", "just me"]):
-        details["Number of Travelers"] = "1"
-    elif any(word in text_lower for word in ["couple", "two of us", "me and my"]):
-        details["Number of Travelers"] = "2"
-    
-    # Extract trip type
-    if any(word in text_lower for word in ["adventure", "trekking", "hiking", "rafting", "climbing"]):
-        details["Trip Type"] = "Adventure"
-    elif any(word in text_lower for word in ["beach", "resort", "spa", "relax", "leisure", "vacation"]):
-        details["Trip Type"] = "Leisure/Beach"
-    elif any(word in text_lower for word in ["business", "work", "conference", "meeting"]):
-        details["Trip Type"] = "Business"
-    elif any(word in text_lower for word in ["culture", "heritage", "museum", "historical", "sightseeing"]):
-        details["Trip Type"] = "Cultural/Sightseeing"
-    elif any(word in text_lower for word in ["family", "kids", "children"]):
-        details["Trip Type"] = "Family"
-    elif any(word in text_lower for word in ["honeymoon", "romantic", "couple"]):
-        details["Trip Type"] = "Romantic/Honeymoon"
-    
-    # Extract transportation preferences
-    if any(word in text_lower for word in ["flight", "fly", "air", "plane"]):
-        details["Transportation Preferences"] = "Flight"
-    elif any(word in text_lower for word in ["train", "railway"]):
-        details["Transportation Preferences"] = "Train"
-    elif any(word in text_lower for word in ["car", "drive", "road trip"]):
-        details["Transportation Preferences"] = "Car/Road Trip"
-    elif any(word in text_lower for word in ["bus", "coach"]):
-        details["Transportation Preferences"] = "Bus"
-    
-    # Extract accommodation preferences
-    if any(word in text_lower for word in ["luxury", "5 star", "premium", "high-end"]):
-        details["Accommodation Preferences"] = "Luxury"
-    elif any(word in text_lower for word in ["budget", "cheap", "affordable", "hostel"]):
-        details["Accommodation Preferences"] = "Budget"
-    elif any(word in text_lower for word in ["mid-range", "3 star", "moderate"]):
-        details["Accommodation Preferences"] = "Mid-range"
-    elif any(word in text_lower for word in ["resort", "all-inclusive"]):
-        details["Accommodation Preferences"] = "Resort"
-    elif any(word in text_lower for word in ["homestay", "local", "authentic"]):
-        details["Accommodation Preferences"] = "Homestay/Local"
-    
-    # Extract special requirements
-    special_requirements = []
-    if any(word in text_lower for word in ["vegetarian", "vegan", "no meat"]):
-        special_requirements.append("Vegetarian/Vegan food")
-    if any(word in text_lower for word in ["disability", "wheelchair", "accessible"]):
-        special_requirements.append("Accessibility requirements")
-    if any(word in text_lower for word in ["pets", "dog", "cat"]):
-        special_requirements.append("Pet-friendly")
-    if any(word in text_lower for word in ["medical", "medicine", "treatment"]):
-        special_requirements.append("Medical considerations")
-    if special_requirements:
+    elif "Number of Travelers" in keyword_matches:
+        details["Number of Travelers"] = keyword_matches["Number of Travelers"][0][0]
+    stage_done("travelers")
+    
+    # Extract budget, with per-person and per-day shares
+    travelers = int(details["Number of Travelers"]) if details.get("Number of Travelers") else None
+    trip_days = int(details["Trip Duration"].split()[0]) if details.get("Trip Duration") else None
+    budget = parse_budget(text, travelers, trip_days)
+    if budget:
+        details["Budget Range"] = format_money(budget["amount"], budget["currency"])
+        if budget["currency"] != budget["base_currency"] and budget["base_amount"] is not None:
+            details["Budget Range"] += f" (≈ {format_money(budget['base_amount'], budget['base_currency'])})"
+        if budget["per_person"] is not None and travelers > 1:
+            details["Budget Per Person"] = format_money(budget["per_person"], budget["currency"])
+        if budget["per_day"] is not None:
+            details["Budget Per Day"] = format_money(budget["per_day"], budget["currency"])
+    stage_done("budget")
+    
+    # Extract trip type, transportation and accommodation preferences
+    for category in ("Trip Type", "Transportation Preferences", "Accommodation Preferences"):
+        if category in keyword_matches:
+            details[category] = keyword_matches[category][0][0]
+    
+    # Extract special requirements (all of them, in a stable order)
+    if "Special Requirements" in keyword_matches:
+        special_requirements = sorted(
+            (label for label, _ in keyword_matches["Special Requirements"]),
+            key=lambda label: KEYWORD_PRECEDENCE[("Special Requirements", label)]
+        )
         details["Special Requirements"] = ", ".join(special_requirements)
+    stage_done("preferences")
     
     return details
 
-def generate_itinerary(details, user_input):
-    try:
-        # Setup Gemini
-        model = setup_gemini()
-        
-        # Create a comprehensive prompt for the AI
-        prompt = f"""
-        Create a detailed travel itinerary based on the following information:
-        
-        **Travel Details:**
-        - Destination: {details.get('Destination', 'Not specified')}
-        - Starting Location: {details.get('Starting Location', 'Not specified')}
-        - Duration: {details.get('Trip Duration', 'Not specified')}
-        - Start Date: {details.get('Start Date', 'Not specified')}
-        - End Date: {details.get('End Date', 'Not specified')}
-        - Number of Travelers: {details.get('Number of Travelers', 'Not specified')}
-        - Budget: {details.get('Budget Range', 'Not specified')}
-        - Trip Type: {details.get('Trip Type', 'Not specified')}
-        - Transportation: {details.get('Transportation Preferences', 'Not specified')}
-        - Accommodation: {details.get('Accommodation Preferences', 'Not specified')}
-        - Special Requirements: {details.get('Special Requirements', 'Not specified')}
-        
-        **Original Request:** {user_input}
-        
-        Please create a comprehensive travel itinerary that includes:
-        
-        ## 1. Trip Overview
-        - Brief summary of the trip
-        - Key highlights and themes
-        
-        ## 2. Daily Itinerary
-        For each day, provide:
-        - **Day X: [Location/Theme]**
-        - **Morning:** Detailed morning activities with times
-        - **Afternoon:** Detailed afternoon activities with times  
-        - **Evening:** Detailed evening activities with times
-        - **Meals:**
-          - Breakfast: Specific restaurant/location recommendations
-          - Lunch: Specific restaurant/location recommendations  
-          - Dinner: Specific restaurant/location recommendations
-        - **Accommodation:** Specific hotel/accommodation recommendations with brief description
-        
-        ## 3. Accommodation Details
-        - Specific hotel recommendations with:
-          - Hotel names and locations
-          - Price ranges per night
-          - Key amenities and features
-          - Why each hotel fits the traveler's needs
-        
-        ## 4. Dining Recommendations  
-        - Must-try restaurants and local cuisines
-        - Food experiences and specialties
-        - Price ranges and dining styles
-        
-        ## 5. Attractions & Activities
-        - Top attractions with descriptions
-        - Unique experiences and activities
-        - Entry fees and timings where applicable
-        
-        ## 6. Budget Breakdown
-        - Accommodation costs
-        - Transportation costs
-        - Food and dining costs
-        - Activities and attractions costs
-        - Shopping and miscellaneous costs
-        - Total estimated cost
-        
-        ## 7. Essential Information
-        - Transportation details (flights, local transport)
-        - Weather considerations and packing suggestions
-        - Local customs and etiquette
-        - Emergency contacts and important numbers
-        - Currency and payment methods
-        - Language tips and useful phrases
-        
-        Please make the itinerary detailed, practical, and tailored to the specific requirements mentioned. Include specific names, locations, and realistic time estimates.
-        """
-        
-        # Generate the itinerary
-        response = model.generate_content(prompt)
-        return response.text
-        
-    except Exception as e:
-        st.error(f"Error generating itinerary: {str(e)}")
-        return None
+# Vectorized extraction for tabular request datasets. The regex and keyword
+# fields run as pandas string operations over the whole column; only dates and
+# locations go row by row, once per distinct text, with spaCy batched.
+NUMBER_WORD_VALUES = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+FRAME_NLP_BATCH_SIZE = 256
 
-def parse_itinerary_data(itinerary_text):
-    """Parse the AI-generated itinerary into structured data for different tabs"""
+def build_keyword_frame_patterns(categories):
+    """One whole-word alternation per (category, label), matching classify_keywords' tokenization"""
+    patterns = {}
+    for category, labels in categories.items():
+        for label, keywords in labels.items():
+            phrases = sorted({r"[^a-z0-9]+".join(KEYWORD_TOKEN_PATTERN.findall(keyword.lower())) for keyword in keywords}, key=len, reverse=True)
+            patterns[(category, label)] = r"(?<![a-z0-9])(?:" + "|".join(phrases) + r")(?![a-z0-9])"
+    return patterns
+
+KEYWORD_FRAME_PATTERNS = build_keyword_frame_patterns(KEYWORD_CATEGORIES)
+
+def best_keyword_labels(counts, category):
+    """Highest-scoring label per row (precedence breaks ties), or None without hits"""
+    labels = list(KEYWORD_CATEGORIES[category])
+    scores = counts[[(category, label) for label in labels]]
+    scores.columns = labels
+    # idxmax keeps the first maximum, and the columns are in precedence order
+    return scores.idxmax(axis=1).where(scores.max(axis=1) > 0)
+
+def extract_details_frame(df, text_col, batch_size=FRAME_NLP_BATCH_SIZE, n_process=1):
+    """Extract trip details for every row of df[text_col] into typed columns.
+
+    Returns a DataFrame aligned with df's index: Budget Amount (float),
+    Number of Travelers and Trip Duration (nullable ints), Start Date and
+    End Date (datetime64) and the same string fields as extract_details.
+    Budgets are parsed like parse_budget: Budget Amount in its own currency,
+    Budget Base Amount converted with the rate table, and per-person and
+    per-day shares.
+    """
+    texts = df[text_col].fillna("").astype(str)
+    lowered = texts.str.lower()
+    result = pd.DataFrame(index=df.index)
     
-    parsed_data = {
-        "overview": "",
-        "days": [],
-        "accommodation": "",
-        "dining": "",
-        "attractions": "",
-        "budget": "",
-        "essential_info": "",
-        "transportation": ""
-    }
+    # Budget: amount, scale and currency all come from the matched span
+    budget = texts.str.extract(BUDGET_PATTERN.pattern, flags=BUDGET_PATTERN.flags)
+    amount = pd.to_numeric(budget["amount"].str.replace(",", "", regex=False), errors="coerce")
+    scale = budget["scale"].str.lower().str.rstrip("s").map(BUDGET_SCALES).fillna(1)
+    amount = (amount * scale).astype("Float64")
+    marker = budget["prefix"].fillna(budget["suffix"]).str.strip().str.rstrip(".").str.lower()
+    currency = marker.map(CURRENCY_MARKERS).fillna(DEFAULT_BUDGET_CURRENCY).where(amount.notna())
+    rates = load_currency_rates()
+    result["Budget Amount"] = amount
+    result["Budget Currency"] = currency
+    result["Budget Base Amount"] = amount * currency.map(rates["rates"]).astype("Float64")
     
-    if not itinerary_text:
-        return parsed_data
+    # Duration in days, with the same bare "week"/"month"/"day" fallbacks
+    duration = texts.str.extract(DURATION_PATTERN.pattern, flags=DURATION_PATTERN.flags)
+    value = duration["value"].str.lower()
+    value = pd.to_numeric(value, errors="coerce").fillna(value.map(NUMBER_WORD_VALUES))
+    unit = duration["unit"].str.lower()
+    days = value * unit.str.startswith("week").map({True: 7, False: 1}) * unit.str.startswith("month").map({True: 30, False: 1})
+    fallback = pd.Series(float("nan"), index=df.index)
+    fallback = fallback.mask(lowered.str.contains(r"\b(?:days?|nights?)\b"), 1)
+    fallback = fallback.mask(lowered.str.contains(r"\bmonths?\b"), 30)
+    fallback = fallback.mask(lowered.str.contains(r"\bweeks?\b"), 7)
+    duration_days = days.where(duration["value"].notna(), fallback)
     
-    # Extract overview section
-    overview_match = re.search(r'##\s*1\.\s*Trip Overview(.*?)(?=##\s*2\.|$)', itinerary_text, re.DOTALL | re.IGNORECASE)
-    if overview_match:
+    # Travelers: explicit counts first ("me and 3 friends" counts me), then keywords
+    travelers = texts.str.extract(TRAVELERS_PATTERN.pattern, flags=TRAVELERS_PATTERN.flags).apply(pd.to_numeric)
+    explicit = travelers[0].fillna(travelers[1]).fillna(travelers[2] + 1)
+    
+    # Keyword categories: whole-word hit counts per label
+    counts = pd.DataFrame({key: lowered.str.count(pattern) for key, pattern in KEYWORD_FRAME_PATTERNS.items()}, index=df.index)
+    keyword_travelers = pd.to_numeric(best_keyword_labels(counts, "Number of Travelers"))
+    result["Number of Travelers"] = explicit.fillna(keyword_travelers).astype("Int64")
+    # Like extract_details, a per-person share is only given for two or more
+    result["Budget Per Person"] = amount / result["Number of Travelers"].where(result["Number of Travelers"] > 1)
+    for category in ("Trip Type", "Transportation Preferences", "Accommodation Preferences"):
+        result[category] = best_keyword_labels(counts, category)
+    special = pd.Series("", index=df.index)
+    for label in KEYWORD_CATEGORIES["Special Requirements"]:
+        hit = counts[("Special Requirements", label)] > 0
+        special = special.mask(hit, special.where(special == "", special + ", ") + label)
+    result["Special Requirements"] = special.where(special != "")
+    
+    # Dates and locations need per-text logic, so run them once per distinct text
+    unique_texts = list(dict.fromkeys(texts))
+    unique_days = dict(zip(texts, duration_days))
+    dates = {}
+    for text in unique_texts:
+        days_hint = unique_days[text]
+        dates[text] = extract_dates(text, int(days_hint) if pd.notna(days_hint) else None)
+    locations = {
+        text: extract_locations(text, doc)
+        for text, doc in zip(unique_texts, nlp.pipe(unique_texts, batch_size=batch_size, n_process=n_process))
+    }
+    
+    result["Starting Location"] = texts.map(lambda text: locations[text][0])
+    result["Destination"] = texts.map(lambda text: locations[text][1])
+    result["Start Date"] = pd.to_datetime(texts.map(lambda text: dates[text][0]))
+    result["End Date"] = pd.to_datetime(texts.map(lambda text: dates[text][1]))
+    result["Trip Duration"] = duration_days.fillna(texts.map(lambda text: dates[text][2])).astype("Int64")
+    result["Budget Per Day"] = amount / result["Trip Duration"]
+    
+    columns = ["Starting Location", "Destination", "Start Date", "End Date", "Trip Duration", "Trip Type",
+               "Number of Travelers", "Budget Amount", "Budget Currency", "Budget Base Amount",
+               "Budget Per Person", "Budget Per Day", "Transportation Preferences",
+               "Accommodation Preferences", "Special Requirements"]
+    return result[columns]
+
+# extract_details label -> TripDetails field, in display order
+TRIP_DETAIL_FIELDS = [
+    ("Starting Location", "starting_location"),
+    ("Destination", "destination"),
+    ("Destination Type", "destination_type"),
+    ("Travel Distance", "travel_distance"),
+    ("Nearby Places", "nearby_places"),
+    ("Trip Duration", "duration_days"),
+    ("Start Date", "start_date"),
+    ("End Date", "end_date"),
+    ("Route Plan", "route_plan"),
+    ("Budget Range", "budget_amount"),
+    ("Budget Per Person", "budget_per_person"),
+    ("Budget Per Day", "budget_per_day"),
+    ("Number of Travelers", "travelers"),
+    ("Trip Type", "trip_type"),
+    ("Transportation Preferences", "transportation"),
+    ("Accommodation Preferences", "accommodation"),
+    ("Special Requirements", "special_requirements"),
+]
+
+MONEY_PATTERN = register_pattern("money", r'^\s*(?P<prefix>[^\d\s]*)\s*(?P<amount>\d[\d,]*(?:\.\d+)?)\s*(?P<suffix>[A-Z]{3})?')
+
+def parse_money(value):
+    """Inverse of format_money: '₹50,000 (≈ ...)' -> (50000.0, 'INR')"""
+    match = MONEY_PATTERN.match(value)
+    if not match:
+        return None, None
+    return float(match.group("amount").replace(",", "")), currency_code(match.group("prefix") or match.group("suffix"))
+
+@dataclass(slots=True)
+class TripDetails:
+    """Typed trip details: numbers and dates instead of display strings.
+
+    extract_details still returns the labelled string dict the prompt is built
+    from; from_details converts it once, and to_details formats it back for
+    display.
+    """
+    
+    starting_location: str | None = None
+    destination: str | None = None
+    destination_type: str | None = None
+    travel_distance: str | None = None
+    nearby_places: str | None = None
+    route_plan: str | None = None
+    start_date: date | None = None
+    end_date: date | None = None
+    duration_days: int | None = None
+    travelers: int | None = None
+    budget_amount: float | None = None
+    budget_currency: str | None = None
+    budget_per_person: float | None = None
+    budget_per_day: float | None = None
+    trip_type: str | None = None
+    transportation: str | None = None
+    accommodation: str | None = None
+    special_requirements: str | None = None
+    
+    @classmethod
+    def from_details(cls, details):
+        values = {field: details.get(label) or None for label, field in TRIP_DETAIL_FIELDS}
+        values["budget_currency"] = None
+        for field in ("budget_amount", "budget_per_person", "budget_per_day"):
+            if values[field]:
+                values[field], currency = parse_money(values[field])
+                values["budget_currency"] = values["budget_currency"] or currency
+        if values["duration_days"]:
+            values["duration_days"] = int(values["duration_days"].split()[0])
+        if values["travelers"]:
+            values["travelers"] = int(values["travelers"])
+        for field in ("start_date", "end_date"):
+            if values[field]:
+                values[field] = date.fromisoformat(values[field])
+        return cls(**values)
+    
+    def to_details(self):
+        """Labelled display strings for the fields that are set, like extract_details"""
+        details = {}
+        for label, field in TRIP_DETAIL_FIELDS:
+            value = getattr(self, field)
+            if value is None:
+                continue
+            if field in ("budget_amount", "budget_per_person", "budget_per_day"):
+                value = format_money(value, self.budget_currency or DEFAULT_BUDGET_CURRENCY)
+            elif field == "duration_days":
+                value = f"{value} days"
+            elif isinstance(value, date):
+                value = value.isoformat()
+            details[label] = str(value)
+        return details
+    
+    def to_json(self):
+        """JSON-ready dict of the typed fields (dates as ISO strings)"""
+        data = {field: getattr(self, field) for field in self.__slots__}
+        for field in ("start_date", "end_date"):
+            if data[field]:
+                data[field] = data[field].isoformat()
+        return data
+    
+    @classmethod
+    def from_json(cls, data):
+        if isinstance(data, str):
+            data = json.loads(data)
+        values = {field: data.get(field) for field in cls.__slots__}
+        for field in ("start_date", "end_date"):
+            if values[field]:
+                values[field] = date.fromisoformat(values[field])
+        return cls(**values)
+
+# Generated itineraries are reused across sessions in two tiers. The exact
+# tier is keyed on the prompt. The near-duplicate tier catches paraphrases: the
+# extracted details must normalize to the same key, and a SimHash of the words
+# the details do not already capture must be within a few bits. Fingerprints
+# are split into bands and indexed per band, so by pigeonhole any fingerprint
+# within SIMHASH_BANDS - 1 bits shares a band and lookups only compare a
+# handful of candidates however large the cache grows. Start and End Date are
+# left out of the key: relative dates ("next Friday", "in two weeks") resolve
+# against today, so the same request would key differently from day to day. Requests with fewer than NEAR_DUPLICATE_MIN_WORDS uncaptured words only
+# use the exact tier; an empty word list would fingerprint as 0 and match any
+# other request with the same details.
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "512"))
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3"))
+NEAR_DUPLICATE_MIN_WORDS = int(os.getenv("NEAR_DUPLICATE_MIN_WORDS", "2"))
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+NEAR_DUPLICATE_FIELDS = [
+    "Starting Location", "Destination", "Trip Duration",
+    "Number of Travelers", "Budget Range", "Trip Type", "Transportation Preferences",
+    "Accommodation Preferences", "Special Requirements",
+]
+NEAR_DUPLICATE_STOPWORDS = {
+    "a", "an", "the", "and", "or", "for", "to", "in", "on", "of", "from", "with", "by", "at", "is", "are",
+    "i", "we", "me", "my", "our", "us", "want", "would", "like", "please", "plan", "planning", "trip",
+    "travel", "traveling", "travelling", "going", "visit", "budget", "around", "about", "approximately",
+    "day", "days", "night", "nights", "week", "weeks", "month", "months", "people", "person", "persons",
+    "traveler", "travelers", "pax", "adult", "adults", "individual", "individuals", "total", "each",
+}
+NEAR_DUPLICATE_WORD_PATTERN = register_pattern("near_duplicate_word", r"[^\W\d_]+")
+
+def details_cache_key(details):
+    """Canonical tuple of the fields that shape an itinerary"""
+    key = []
+    for field in NEAR_DUPLICATE_FIELDS:
+        value = details.get(field)
+        if not value:
+            continue
+        value = str(value).casefold()
+        if field in ("Destination", "Special Requirements"):
+            # Route planning orders the stops, so their order carries no meaning
+            value = ", ".join(sorted(item.strip() for item in value.split(",")))
+        key.append((field, value))
+    return tuple(key)
+
+def residual_request_words(details, user_input):
+    """Words of the request that the extracted details do not already capture"""
+    captured = set(NEAR_DUPLICATE_STOPWORDS) | set(NUMBER_WORD_VALUES) | set(BUDGET_SCALES) | set(CURRENCY_MARKERS)
+    for category in KEYWORD_CATEGORIES.values():
+        for keywords in category.values():
+            for keyword in keywords:
+                captured.update(KEYWORD_TOKEN_PATTERN.findall(keyword.lower()))
+    for field in ("Starting Location", "Destination"):
+        captured.update(NEAR_DUPLICATE_WORD_PATTERN.findall(str(details.get(field) or "").casefold()))
+    words = NEAR_DUPLICATE_WORD_PATTERN.findall((user_input or "").casefold())
+    # Fold plurals so "museums" and "museum" count as the same word
+    return [word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words if word not in captured]
+
+def simhash(words):
+    """64-bit SimHash over word counts; 0 for an empty word list"""
+    weights = [0] * SIMHASH_BITS
+    for word, count in Counter(words).items():
+        value = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+def simhash_bands(fingerprint):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    return [(band, fingerprint >> (band * width) & ((1 << width) - 1)) for band in range(SIMHASH_BANDS)]
+
+class GenerationCache:
+    """LRU of generated itineraries with exact and near-duplicate lookup"""
+    
+    def __init__(self, max_entries=GENERATION_CACHE_SIZE, max_distance=NEAR_DUPLICATE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # (details key, band, band value) -> prompt keys of the entries in it
+        self.bands = {}
+        self.stats = Counter()
+    
+    def lookup(self, prompt_key, details_key, fingerprint):
+        """Return (entry, tier, distance) for a cached itinerary, or None.
+
+        A fingerprint of None only looks up the exact tier.
+        """
+        with self.lock:
+            entry = self.entries.get(prompt_key)
+            if entry is not None:
+                self.entries.move_to_end(prompt_key)
+                self.stats["exact"] += 1
+                return entry, "exact", 0
+            
+            candidates = set()
+            for band in simhash_bands(fingerprint) if fingerprint is not None else ():
+                candidates.update(self.bands.get((details_key, *band), ()))
+            best = None
+            for key in candidates:
+                distance = bin(self.entries[key]["fingerprint"] ^ fingerprint).count("1")
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (key, distance)
+            self.stats["compared"] += len(candidates)
+            if best is None:
+                self.stats["miss"] += 1
+                return None
+            self.entries.move_to_end(best[0])
+            self.stats["near"] += 1
+            return self.entries[best[0]], "near", best[1]
+    
+    def add(self, prompt_key, details_key, fingerprint, itinerary, usage):
+        with self.lock:
+            if prompt_key in self.entries:
+                self.discard(prompt_key)
+            self.entries[prompt_key] = {
+                "details_key": details_key,
+                "fingerprint": fingerprint,
+                "itinerary": itinerary,
+                "usage": usage,
+            }
+            for band in simhash_bands(fingerprint) if fingerprint is not None else ():
+                self.bands.setdefault((details_key, *band), set()).add(prompt_key)
+            while len(self.entries) > self.max_entries:
+                self.discard(next(iter(self.entries)))
+    
+    def discard(self, prompt_key):
+        """Drop an entry and its band postings; the caller holds the lock"""
+        entry = self.entries.pop(prompt_key)
+        for band in simhash_bands(entry["fingerprint"]) if entry["fingerprint"] is not None else ():
+            postings = self.bands[(entry["details_key"], *band)]
+            postings.discard(prompt_key)
+            if not postings:
+                del self.bands[(entry["details_key"], *band)]
+
+@st.cache_resource
+def get_generation_cache():
+    return GenerationCache()
+
+def generation_cache_keys(details, user_input, prompt):
+    """(prompt key, details key, fingerprint) a request is cached under; the
+    fingerprint is None when too few words are left to compare wording"""
+    prompt_key = hashlib.sha256(f"{GEMINI_MODEL_NAME}\n{ITINERARY_INSTRUCTIONS_VERSION}\n{prompt}".encode("utf-8")).hexdigest()
+    words = residual_request_words(details, user_input)
+    fingerprint = simhash(words) if len(words) >= NEAR_DUPLICATE_MIN_WORDS else None
+    return prompt_key, details_cache_key(details), fingerprint
+
+def generate_itinerary_with_usage(details, user_input, use_cache=True):
+    """Generate an itinerary and return (text, usage) for the request.
+
+    A cached itinerary for the same or a paraphrased request is returned
+    instead when there is one; its usage then carries "cache" ("exact" or
+    "near") and the Hamming "distance" of the match.
+    """
+    try:
+        model, instructions_in_context = get_itinerary_model(ITINERARY_INSTRUCTIONS_VERSION)
+        
+        prompt = build_itinerary_prompt(details, user_input)
+        if not instructions_in_context:
+            prompt = f"{ITINERARY_INSTRUCTIONS}\n\n{prompt}"
+        
+        cache = get_generation_cache()
+        prompt_key, details_key, fingerprint = generation_cache_keys(details, user_input, prompt)
+        if use_cache:
+            hit = cache.lookup(prompt_key, details_key, fingerprint)
+            if hit:
+                entry, tier, distance = hit
+                return entry["itinerary"], {**entry["usage"], "cache": tier, "distance": distance}
+        
+        # Generate the itinerary
+        started = time.perf_counter()
+        response = model.generate_content(prompt)
+        usage = record_usage(response, time.perf_counter() - started)
+        cache.add(prompt_key, details_key, fingerprint, response.text, usage)
+        return response.text, usage
+        
+    except Exception as e:
+        st.error(f"Error generating itinerary: {str(e)}")
+        return None, None
+
+def generate_itinerary(details, user_input):
+    itinerary, _ = generate_itinerary_with_usage(details, user_input)
+    return itinerary
+
+# Hardened parsing mode for untrusted model output: input and line lengths are
+# capped, every pattern runs on a single bounded line, and the parse stops at
+# a per-parse CPU deadline, returning what it has so far.
+PARSE_MODE = os.getenv("TRAVEL_PLANNER_PARSE_MODE", "standard")
+PARSE_MAX_INPUT_CHARS = int(os.getenv("PARSE_MAX_INPUT_CHARS", "200000"))
+PARSE_MAX_LINE_CHARS = 2000
+PARSE_DEADLINE_SECONDS = float(os.getenv("PARSE_DEADLINE_SECONDS", "1.0"))
+# Day blocks are parsed line by line ("lines"); "regex" selects the previous
+# per-field regex parser
+DAY_PARSER = os.getenv("TRAVEL_PLANNER_DAY_PARSER", "lines")
+
+SECTION_KEYS = {
+    "1": "overview",
+    "2": "daily",
+    "3": "accommodation",
+    "4": "dining",
+    "5": "attractions",
+    "6": "budget",
+    "7": "essential_info",
+}
+
+# Line labels that switch the current day slot
+DAY_SLOT_LABELS = {
+    "morning": "morning",
+    "am": "morning",
+    "afternoon": "afternoon",
+    "pm": "afternoon",
+    "evening": "evening",
+    "night": "evening",
+    "meals": "meals",
+    "breakfast": "breakfast",
+    "lunch": "lunch",
+    "dinner": "dinner",
+    "accommodation": "accommodation",
+    "stay": "accommodation",
+    "hotel": "accommodation",
+    "overnight": "accommodation",
+    "date": "date",
+}
+
+ACTIVITY_VERBS = ("visit", "explore", "experience", "activity")
+STAY_PREFIXES = ("stay at", "overnight at", "check in at")
+MEAL_NAMES = ("breakfast", "lunch", "dinner")
+# Day lines are split with string operations; only numbered list markers
+# need a pattern. A label is the text before the first separator, looked up
+# in DAY_SLOT_LABELS, so it never needs to be longer than this.
+LIST_BULLETS = ("*", "-", "•")
+LINE_LABEL_SEPARATORS = (":", "-", "–")
+LINE_LABEL_MAX_CHARS = 26
+
+class ParseDeadlineExceeded(TimeoutError):
+    """Raised when a hardened parse runs past its CPU deadline"""
+
+def check_parse_deadline(deadline):
+    if time.thread_time() > deadline:
+        raise ParseDeadlineExceeded("itinerary parse exceeded its CPU deadline")
+
+def match_section_heading(line):
+    """Match a numbered section heading, skipping the pattern on lines without '#'"""
+    line = line.lstrip()
+    return HARDENED_SECTION_HEADING_PATTERN.match(line) if line.startswith("#") else None
+
+def empty_day_data(day_num, title):
+    return {
+        "day_number": day_num,
+        "title": title,
+        "morning": "",
+        "afternoon": "",
+        "evening": "",
+        "meals": {
+            "breakfast": "",
+            "lunch": "",
+            "dinner": ""
+        },
+        "accommodation": "",
+        "activities": []
+    }
+
+def split_line_label(line):
+    """Split 'Morning: ...' style lines into (slot, rest), ignoring list and bold markers"""
+    stripped = line.strip().replace("**", "")
+    if stripped.startswith(LIST_BULLETS):
+        stripped = stripped[1:].lstrip(" \t")
+    elif stripped[:1].isdigit():
+        stripped = HARDENED_LIST_MARKER_PATTERN.sub("", stripped, count=1)
+    cuts = [cut for cut in (stripped.find(sep, 1, LINE_LABEL_MAX_CHARS) for sep in LINE_LABEL_SEPARATORS) if cut > 0]
+    if cuts:
+        cut = min(cuts)
+        slot = DAY_SLOT_LABELS.get(stripped[:cut].strip().lower())
+        if slot:
+            return slot, stripped[cut + 1:].strip()
+    return None, stripped
+
+def parse_day_lines(lines, day_data, deadline=None):
+    """Fill day_data from the lines of one day block with a single pass.
+
+    The current slot is switched by label lines (Morning:, **Meals:** ...);
+    unlabeled lines are appended to the current slot. Meals named in passing
+    ("... lunch at Jay Fai") fill empty meals until a labeled meal line
+    replaces them.
+    """
+    slot = None
+    inline_meals = set()
+    for line in lines:
+        if deadline is not None:
+            check_parse_deadline(deadline)
+        if not line.strip():
+            continue
+        
+        label, content = split_line_label(line)
+        if label == "date":
+            day_data["date"] = content
+            continue
+        lowered = content.lower()
+        if not label and lowered.startswith(STAY_PREFIXES):
+            label = "accommodation"
+            prefix = next(prefix for prefix in STAY_PREFIXES if lowered.startswith(prefix))
+            content = content[len(prefix):].strip()
+            lowered = content.lower()
+        if label:
+            slot = label
+        if not content:
+            continue
+        
+        if lowered.startswith(ACTIVITY_VERBS) or not slot:
+            day_data["activities"].append(content)
+        
+        # "... lunch at Jay Fai" names a meal in passing; labeled meals win
+        if slot not in MEAL_NAMES and any(meal in lowered for meal in MEAL_NAMES):
+            for meal, place in INLINE_MEAL_PATTERN.findall(content):
+                meal = meal.lower()
+                if not day_data["meals"][meal]:
+                    day_data["meals"][meal] = place.strip()
+                    inline_meals.add(meal)
+        
+        if slot in MEAL_NAMES:
+            if slot in inline_meals:
+                inline_meals.discard(slot)
+                day_data["meals"][slot] = ""
+            meal = day_data["meals"][slot]
+            day_data["meals"][slot] = f"{meal} {content}".strip()
+        elif slot in ("morning", "afternoon", "evening", "accommodation"):
+            day_data[slot] = f"{day_data[slot]}\n{content}".strip()
+    
+    return day_data
+
+def parse_itinerary_data_hardened(itinerary_text, max_chars=None, deadline_seconds=None):
+    """Parse untrusted itinerary text in linear time with a CPU deadline.
+
+    Produces the same structure as parse_itinerary_data. If the deadline is hit,
+    whatever was parsed so far is returned with "parse_incomplete" set.
+    """
+    parsed_data = {
+        "overview": "",
+        "days": [],
+        "accommodation": "",
+        "dining": "",
+        "attractions": "",
+        "budget": "",
+        "essential_info": "",
+        "transportation": "",
+        "transport_legs": []
+    }
+    
+    if not itinerary_text:
+        return parsed_data
+    
+    max_chars = max_chars or PARSE_MAX_INPUT_CHARS
+    deadline = time.thread_time() + (deadline_seconds or PARSE_DEADLINE_SECONDS)
+    text = itinerary_text[:max_chars]
+    
+    sections = {}
+    day_blocks = []
+    current = None
+    try:
+        for raw_line in text.split("\n"):
+            check_parse_deadline(deadline)
+            line = raw_line[:PARSE_MAX_LINE_CHARS]
+            
+            heading_match = match_section_heading(line)
+            if heading_match:
+                current = SECTION_KEYS[heading_match.group(1)]
+                sections[current] = []
+                continue
+            if current is None:
+                continue
+            
+            if current == "daily":
+                day_match = HARDENED_DAY_HEADING_PATTERN.search(line) if "**" in line else None
+                if day_match:
+                    title = day_match.group(0).strip()
+                    day_blocks.append((int(day_match.group(1)), title, [line[day_match.end():]]))
+                    continue
+                if day_blocks:
+                    day_blocks[-1][2].append(line)
+                    continue
+            sections[current].append(line)
+        
+        for key, lines in sections.items():
+            if key != "daily":
+                parsed_data[key] = "\n".join(lines).strip()
+        
+        for day_num, title, lines in day_blocks:
+            parsed_data["days"].append(parse_day_lines(lines, empty_day_data(day_num, title), deadline))
+        
+        if day_blocks:
+            extract_transportation(text, parsed_data)
+    except ParseDeadlineExceeded:
+        parsed_data["parse_incomplete"] = True
+    
+    return parsed_data
+
+def parse_day_content_regex(day_num, day_title, day_content):
+    """Previous day parser: one regex search per field over the whole block,
+    with filler text for missing slots. Kept for TRAVEL_PLANNER_DAY_PARSER=regex
+    and as the baseline for travel_planner bench-parse."""
+    # Initialize day data structure
+    day_data = {
+        "day_number": day_num,
+        "title": day_title,
+        "morning": "",
+        "afternoon": "",
+        "evening": "",
+        "meals": {
+            "breakfast": "",
+            "lunch": "",
+            "dinner": ""
+        },
+        "accommodation": "",
+        "activities": []
+    }
+
+    # Extract date if present
+    date_match = DAY_DATE_PATTERN.search(day_content)
+    if date_match:
+        day_data["date"] = date_match.group(1).strip()
+
+    # Extract time-based activities with more detailed pattern matching
+    # Morning section
+    morning_match = MORNING_PATTERN.search(day_content)
+    if morning_match:
+        day_data["morning"] = morning_match.group(1).strip()
+
+    # Also check for bullet points in the Morning section
+    if "* **Morning:**" in day_content or "- **Morning:**" in day_content:
+        morning_bullet = MORNING_BULLET_PATTERN.search(day_content)
+        if morning_bullet:
+            day_data["morning"] = morning_bullet.group(1).strip()
+
+    # Afternoon section
+    afternoon_match = AFTERNOON_PATTERN.search(day_content)
+    if afternoon_match:
+        day_data["afternoon"] = afternoon_match.group(1).strip()
+
+    # Also check for bullet points in the Afternoon section
+    if "* **Afternoon:**" in day_content or "- **Afternoon:**" in day_content:
+        afternoon_bullet = AFTERNOON_BULLET_PATTERN.search(day_content)
+        if afternoon_bullet:
+            day_data["afternoon"] = afternoon_bullet.group(1).strip()
+
+    # Evening section
+    evening_match = EVENING_PATTERN.search(day_content)
+    if evening_match:
+        day_data["evening"] = evening_match.group(1).strip()
+
+    # Also check for bullet points in the Evening section
+    if "* **Evening:**" in day_content or "- **Evening:**" in day_content:
+        evening_bullet = EVENING_BULLET_PATTERN.search(day_content)
+        if evening_bullet:
+            day_data["evening"] = evening_bullet.group(1).strip()
+
+    # Extract meals - enhanced to capture more details
+    # Check for the Meals section with bullet points
+    meals_section = MEALS_SECTION_PATTERN.search(day_content)
+    if meals_section:
+        meals_content = meals_section.group(1).strip()
+
+        # Extract breakfast details
+        breakfast_match = MEAL_LINE_PATTERNS["breakfast"].search(meals_content)
+        if breakfast_match:
+            day_data["meals"]["breakfast"] = breakfast_match.group(1).strip()
+
+        # Extract lunch details
+        lunch_match = MEAL_LINE_PATTERNS["lunch"].search(meals_content)
+        if lunch_match:
+            day_data["meals"]["lunch"] = lunch_match.group(1).strip()
+
+        # Extract dinner details
+        dinner_match = MEAL_LINE_PATTERNS["dinner"].search(meals_content)
+        if dinner_match:
+            day_data["meals"]["dinner"] = dinner_match.group(1).strip()
+    else:
+        # Fallback to original approach
+        breakfast_match = MEAL_INLINE_PATTERNS["breakfast"].search(day_content)
+        if breakfast_match:
+            day_data["meals"]["breakfast"] = breakfast_match.group(1).strip()
+
+        lunch_match = MEAL_INLINE_PATTERNS["lunch"].search(day_content)
+        if lunch_match:
+            day_data["meals"]["lunch"] = lunch_match.group(1).strip()
+
+        dinner_match = MEAL_INLINE_PATTERNS["dinner"].search(day_content)
+        if dinner_match:
+            day_data["meals"]["dinner"] = dinner_match.group(1).strip()
+
+    # Extract accommodation - enhanced to capture more details
+    accommodation_match = ACCOMMODATION_BULLET_PATTERN.search(day_content)
+    if accommodation_match:
+        day_data["accommodation"] = accommodation_match.group(1).strip()
+    else:
+        # Fallback approach
+        accommodation_match = ACCOMMODATION_INLINE_PATTERN.search(day_content)
+        if accommodation_match:
+            day_data["accommodation"] = accommodation_match.group(1).strip()
+
+    # Extract activities list
+    activities_matches = ACTIVITY_PATTERN.findall(day_content)
+    if activities_matches:
+        day_data["activities"] = [activity.strip() for activity in activities_matches]
+    else:
+        # Try to extract from bullet points or numbered lists
+        bullet_activities = BULLET_ACTIVITY_PATTERN.findall(day_content)
+        if bullet_activities:
+            # Filter out section headers and keep actual activities
+            all_activities = []
+            for activity in bullet_activities:
+                activity = activity.strip()
+                # Skip if it looks like a section header
+                if not SLOT_HEADER_PATTERN.match(activity):
+                    # Split by common separators and clean
+                    section_activities = ACTIVITY_SEPARATOR_PATTERN.split(activity)
+                    all_activities.extend([act.strip() for act in section_activities if act.strip()])
+
+            day_data["activities"] = all_activities
+
+    # Enhanced fallback: Extract any structured content from day text
+    if not day_data["morning"] and not day_data["afternoon"] and not day_data["evening"]:
+        # Try to extract from bullet points or numbered lists
+        content_lines = [line.strip() for line in day_content.split('\n') if line.strip()]
+        activities = []
+
+        for line in content_lines:
+            # Skip headers and formatting
+            if SKIP_LINE_PATTERN.match(line):
+                continue
+            # Look for bullet points or activities
+            if BULLET_LINE_PATTERN.match(line) or NUMBERED_LINE_PATTERN.match(line):
+                activity = LIST_MARKER_PATTERN.sub('', line).strip()
+                if activity and len(activity) > 10:
+                    activities.append(activity)
+            elif len(line) > 15 and not line.startswith('**'):
+                activities.append(line)
+
+        # Distribute activities across time periods
+        if activities:
+            if len(activities) >= 1:
+                day_data["morning"] = activities[0]
+            if len(activities) >= 2:
+                day_data["afternoon"] = activities[1]
+            if len(activities) >= 3:
+                day_data["evening"] = activities[2]
+            else:
+                # If only 1-2 activities, use generic content
+                if not day_data["afternoon"]:
+                    day_data["afternoon"] = "Continue exploring local attractions"
+                if not day_data["evening"]:
+                    day_data["evening"] = "Evening leisure time"
+
+    # Enhanced meal extraction if still empty  
+    if not day_data["meals"]["breakfast"] and not day_data["meals"]["lunch"] and not day_data["meals"]["dinner"]:
+        # Try to find meal references in the day content
+        for meal_type in ["breakfast", "lunch", "dinner"]:
+            # Look for various meal patterns
+            for pattern in MEAL_FALLBACK_PATTERNS[meal_type]:
+                meal_match = pattern.search(day_content)
+                if meal_match:
+                    meal_info = meal_match.group(1).strip()
+                    if len(meal_info) > 5:  # Only use if substantial
+                        day_data["meals"][meal_type] = meal_info
+                        break
+
+        # If still no meals found, add realistic defaults
+        if not day_data["meals"]["breakfast"]:
+            day_data["meals"]["breakfast"] = "Local breakfast restaurant or hotel dining"
+        if not day_data["meals"]["lunch"]:
+            day_data["meals"]["lunch"] = "Traditional local cuisine for lunch"
+        if not day_data["meals"]["dinner"]:
+            day_data["meals"]["dinner"] = "Local restaurant with regional specialties"
+
+    # Enhanced accommodation extraction if still empty
+    if not day_data["accommodation"]:
+        # Try to find accommodation references in the day content
+        for pattern in ACCOMMODATION_FALLBACK_PATTERNS:
+            acc_match = pattern.search(day_content)
+            if acc_match:
+                acc_info = acc_match.group(1).strip()
+                if len(acc_info) > 5:  # Only use if substantial
+                    day_data["accommodation"] = acc_info
+                    break
+
+        # If still no accommodation found, add a realistic default
+        if not day_data["accommodation"]:
+            day_data["accommodation"] = "Mid-range hotel or guesthouse in city center"
+    
+    return day_data
+
+def parse_day_content(day_num, day_title, day_content):
+    """Parse one day block in a single pass over its lines"""
+    return parse_day_lines(day_content.split("\n"), empty_day_data(day_num, day_title))
+
+DAY_PARSERS = {"lines": parse_day_content, "regex": parse_day_content_regex}
+
+def parse_itinerary_data(itinerary_text, mode=None, day_parser=None):
+    """Parse the AI-generated itinerary into structured data for different tabs"""
+    
+    if (mode or PARSE_MODE) == "hardened":
+        return parse_itinerary_data_hardened(itinerary_text)
+    
+    parsed_data = {
+        "overview": "",
+        "days": [],
+        "accommodation": "",
+        "dining": "",
+        "attractions": "",
+        "budget": "",
+        "essential_info": "",
+        "transportation": "",
+        "transport_legs": []
+    }
+    
+    if not itinerary_text:
+        return parsed_data
+    
+    # Extract overview section
+    overview_match = OVERVIEW_SECTION_PATTERN.search(itinerary_text)
+    if overview_match:
         parsed_data["overview"] = overview_match.group(1).strip()
     
     # Extract accommodation section
-    accommodation_match = re.search(r'##\s*3\.\s*Accommodation Details(.*?)(?=##\s*4\.|$)', itinerary_text, re.DOTALL | re.IGNORECASE)
+    accommodation_match = ACCOMMODATION_SECTION_PATTERN.search(itinerary_text)
     if accommodation_match:
         parsed_data["accommodation"] = accommodation_match.group(1).strip()
     
     # Extract dining section
-    dining_match = re.search(r'##\s*4\.\s*Dining Recommendations(.*?)(?=##\s*5\.|$)', itinerary_text, re.DOTALL | re.IGNORECASE)
+    dining_match = DINING_SECTION_PATTERN.search(itinerary_text)
     if dining_match:
         parsed_data["dining"] = dining_match.group(1).strip()
     
     # Extract attractions section
-    attractions_match = re.search(r'##\s*5\.\s*Attractions & Activities(.*?)(?=##\s*6\.|$)', itinerary_text, re.DOTALL | re.IGNORECASE)
+    attractions_match = ATTRACTIONS_SECTION_PATTERN.search(itinerary_text)
     if attractions_match:
         parsed_data["attractions"] = attractions_match.group(1).strip()
     
     # Extract budget section
-    budget_match = re.search(r'##\s*6\.\s*Budget Breakdown(.*?)(?=##\s*7\.|$)', itinerary_text, re.DOTALL | re.IGNORECASE)
+    budget_match = BUDGET_SECTION_PATTERN.search(itinerary_text)
     if budget_match:
         parsed_data["budget"] = budget_match.group(1).strip()
     
     # Extract essential info section
-    essential_match = re.search(r'##\s*7\.\s*Essential Information(.*?)$', itinerary_text, re.DOTALL | re.IGNORECASE)
+    essential_match = ESSENTIAL_SECTION_PATTERN.search(itinerary_text)
     if essential_match:
         parsed_data["essential_info"] = essential_match.group(1).strip()
     
     # Extract daily itinerary section
-    daily_section_match = re.search(r'##\s*2\.\s*Daily Itinerary(.*?)(?=##\s*3\.|$)', itinerary_text, re.DOTALL | re.IGNORECASE)
+    daily_section_match = DAILY_SECTION_PATTERN.search(itinerary_text)
     if daily_section_match:
         daily_content = daily_section_match.group(1).strip()
         
         # Find all day entries
-        day_matches = list(re.finditer(r'\*\*Day (\d+):[^*]*\*\*', daily_content, re.IGNORECASE))
+        day_matches = list(DAY_HEADER_PATTERN.finditer(daily_content))
+        day_parser = DAY_PARSERS[day_parser or DAY_PARSER]
         
         for i, match in enumerate(day_matches):
             day_num = int(match.group(1))
@@ -878,298 +2770,717 @@ def parse_itinerary_data(itinerary_text):
             end_pos = day_matches[i+1].start() if i < len(day_matches) - 1 else len(daily_content)
             day_content = daily_content[start_pos:end_pos].strip()
             
-            # Initialize day data structure
-            day_data = {
-                "day_number": day_num,
-                "title": day_title,
-                "morning": "",
-                "afternoon": "",
-                "evening": "",
-                "meals": {
-                    "breakfast": "",
-                    "lunch": "",
-                    "dinner": ""
-                },
-                "accommodation": "",
-                "activities": []
-            }
-            
-            # Extract date if present
-            date_match = re.search(r'(?:Date|On):\s*(\d{1,2}(?:st|nd|rd|th)?\s+\w+(?:\s+\d{4})?|\d{4}-\d{2}-\d{2}|\w+\s+\d{1,2}(?:st|nd|rd|th)?,\s*\d{4})', day_content, re.IGNORECASE)
-            if date_match:
-                day_data["date"] = date_match.group(1).strip()
-            
-            # Extract time-based activities with more detailed pattern matching
-            # Morning section
-            morning_match = re.search(r'(?:Morning|AM)(?:[\s\-:]+)([\s\S]*?)(?=(?:Afternoon|Lunch|PM|Evening|Dinner|Accommodation|Day|$))', day_content, re.IGNORECASE)
-            if morning_match:
-                day_data["morning"] = morning_match.group(1).strip()
-            
-            # Also check for bullet points in the Morning section
-            if "* **Morning:**" in day_content or "- **Morning:**" in day_content:
-                morning_bullet = re.search(r'(?:\*|\-)\s+\*\*Morning:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Afternoon|Lunch|Evening|Dinner|Meals|Accommodation)|$)', day_content, re.IGNORECASE)
-                if morning_bullet:
-                    day_data["morning"] = morning_bullet.group(1).strip()
-            
-            # Afternoon section
-            afternoon_match = re.search(r'(?:Afternoon|PM)(?:[\s\-:]+)([\s\S]*?)(?=(?:Evening|Dinner|Accommodation|Day|$))', day_content, re.IGNORECASE)
-            if afternoon_match:
-                day_data["afternoon"] = afternoon_match.group(1).strip()
-            
-            # Also check for bullet points in the Afternoon section
-            if "* **Afternoon:**" in day_content or "- **Afternoon:**" in day_content:
-                afternoon_bullet = re.search(r'(?:\*|\-)\s+\*\*Afternoon:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Evening|Dinner|Meals|Accommodation)|$)', day_content, re.IGNORECASE)
-                if afternoon_bullet:
-                    day_data["afternoon"] = afternoon_bullet.group(1).strip()
-            
-            # Evening section
-            evening_match = re.search(r'(?:Evening|Night)(?:[\s\-:]+)([\s\S]*?)(?=(?:Accommodation|Day|$))', day_content, re.IGNORECASE)
-            if evening_match:
-                day_data["evening"] = evening_match.group(1).strip()
-            
-            # Also check for bullet points in the Evening section
-            if "* **Evening:**" in day_content or "- **Evening:**" in day_content:
-                evening_bullet = re.search(r'(?:\*|\-)\s+\*\*Evening:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Meals|Accommodation)|$)', day_content, re.IGNORECASE)
-                if evening_bullet:
-                    day_data["evening"] = evening_bullet.group(1).strip()
-            
-            # Extract meals - enhanced to capture more details
-            # Check for the Meals section with bullet points
-            meals_section = re.search(r'(?:\*|\-)\s+\*\*Meals:\*\*([\s\S]*?)(?=(?:\*|\-)\s+\*\*(?:Accommodation)|$)', day_content, re.IGNORECASE)
-            if meals_section:
-                meals_content = meals_section.group(1).strip()
-                
-                # Extract breakfast details
-                breakfast_match = re.search(r'(?:Breakfast|breakfast):\s+([^\n]+)', meals_content, re.IGNORECASE)
-                if breakfast_match:
-                    day_data["meals"]["breakfast"] = breakfast_match.group(1).strip()
-                
-                # Extract lunch details
-                lunch_match = re.search(r'(?:Lunch|lunch):\s+([^\n]+)', meals_content, re.IGNORECASE)
-                if lunch_match:
-                    day_data["meals"]["lunch"] = lunch_match.group(1).strip()
-                
-                # Extract dinner details
-                dinner_match = re.search(r'(?:Dinner|dinner):\s+([^\n]+)', meals_content, re.IGNORECASE)
-                if dinner_match:
-                    day_data["meals"]["dinner"] = dinner_match.group(1).strip()
-            else:
-                # Fallback to original approach
-                breakfast_match = re.search(r'(?:Breakfast)(?:[\s\-:]+)([^#\n]+)', day_content, re.IGNORECASE)
-                if breakfast_match:
-                    day_data["meals"]["breakfast"] = breakfast_match.group(1).strip()
-                
-                lunch_match = re.search(r'(?:Lunch)(?:[\s\-:]+)([^#\n]+)', day_content, re.IGNORECASE)
-                if lunch_match:
-                    day_data["meals"]["lunch"] = lunch_match.group(1).strip()
-                
-                dinner_match = re.search(r'(?:Dinner)(?:[\s\-:]+)([^#\n]+)', day_content, re.IGNORECASE)
-                if dinner_match:
-                    day_data["meals"]["dinner"] = dinner_match.group(1).strip()
-            
-            # Extract accommodation - enhanced to capture more details
-            accommodation_match = re.search(r'(?:\*|\-)\s+\*\*Accommodation:\*\*\s+([\s\S]*?)(?=(?:\*|\-)\s+\*\*|$)', day_content, re.IGNORECASE)
-            if accommodation_match:
-                day_data["accommodation"] = accommodation_match.group(1).strip()
-            else:
-                # Fallback approach
-                accommodation_match = re.search(r'(?:Accommodation|Stay|Hotel)(?:[\s\-:]+)([^#\n]+)', day_content, re.IGNORECASE)
-                if accommodation_match:
-                    day_data["accommodation"] = accommodation_match.group(1).strip()
-            
-            # Extract activities list
-            activities_matches = re.findall(r'(?:Visit|Explore|Experience|Activity)(?:[\s\-:]+)([^#\n]+)', day_content, re.IGNORECASE)
-            if activities_matches:
-                day_data["activities"] = [activity.strip() for activity in activities_matches]
-            else:
-                # Try to extract from bullet points or numbered lists
-                bullet_activities = re.findall(r'(?:^|\n)(?:\d+\.|\*|\-)\s*([^*#\n]+)', day_content, re.MULTILINE)
-                if bullet_activities:
-                    # Filter out section headers and keep actual activities
-                    all_activities = []
-                    for activity in bullet_activities:
-                        activity = activity.strip()
-                        # Skip if it looks like a section header
-                        if not re.match(r'\*\*(Morning|Afternoon|Evening|Meals|Accommodation):', activity):
-                            # Split by common separators and clean
-                            section_activities = re.split(r'[,;]', activity)
-                            all_activities.extend([act.strip() for act in section_activities if act.strip()])
-                
-                day_data["activities"] = all_activities
-            
-            # Enhanced fallback: Extract any structured content from day text
-            if not day_data["morning"] and not day_data["afternoon"] and not day_data["evening"]:
-                # Try to extract from bullet points or numbered lists
-                content_lines = [line.strip() for line in day_content.split('\n') if line.strip()]
-                activities = []
-                
-                for line in content_lines:
-                    # Skip headers and formatting
-                    if re.match(r'^\*+|^#+|^Day \d+|^\-+$', line):
-                        continue
-                    # Look for bullet points or activities
-                    if re.match(r'^[\*\-•]\s*', line) or re.match(r'^\d+\.', line):
-                        activity = re.sub(r'^[\*\-•]\s*|\d+\.\s*', '', line).strip()
-                        if activity and len(activity) > 10:
-                            activities.append(activity)
-                    elif len(line) > 15 and not line.startswith('**'):
-                        activities.append(line)
-                
-                # Distribute activities across time periods
-                if activities:
-                    if len(activities) >= 1:
-                        day_data["morning"] = activities[0]
-                    if len(activities) >= 2:
-                        day_data["afternoon"] = activities[1]
-                    if len(activities) >= 3:
-                        day_data["evening"] = activities[2]
-                    else:
-                        # If only 1-2 activities, use generic content
-                        if not day_data["afternoon"]:
-                            day_data["afternoon"] = "Continue exploring local attractions"
-                        if not day_data["evening"]:
-                            day_data["evening"] = "Evening leisure time"
-            
-            # Enhanced meal extraction if still empty  
-            if not day_data["meals"]["breakfast"] and not day_data["meals"]["lunch"] and not day_data["meals"]["dinner"]:
-                # Try to find meal references in the day content
-                for meal_type in ["breakfast", "lunch", "dinner"]:
-                    # Look for various meal patterns
-                    meal_patterns = [
-                        rf'{meal_type}[:\-]\s*([^\n,;]+)',
-                        rf'\b{meal_type}\s+at\s+([^\n,;]+)',
-                        rf'for\s+{meal_type}[:\-]?\s*([^\n,;]+)',
-                        rf'{meal_type.capitalize()}[:\-]\s*([^\n,;]+)'
-                    ]
-                    
-                    for pattern in meal_patterns:
-                        meal_match = re.search(pattern, day_content, re.IGNORECASE)
-                        if meal_match:
-                            meal_info = meal_match.group(1).strip()
-                            if len(meal_info) > 5:  # Only use if substantial
-                                day_data["meals"][meal_type] = meal_info
-                                break
-                
-                # If still no meals found, add realistic defaults
-                if not day_data["meals"]["breakfast"]:
-                    day_data["meals"]["breakfast"] = "Local breakfast restaurant or hotel dining"
-                if not day_data["meals"]["lunch"]:
-                    day_data["meals"]["lunch"] = "Traditional local cuisine for lunch"
-                if not day_data["meals"]["dinner"]:
-                    day_data["meals"]["dinner"] = "Local restaurant with regional specialties"
-            
-            # Enhanced accommodation extraction if still empty
-            if not day_data["accommodation"]:
-                # Try to find accommodation references in the day content
-                accommodation_patterns = [
-                    r'(?:accommodation|hotel|stay|lodge|resort)[:\-]\s*([^\n,;]+)',
-                    r'stay\s+at\s+([^\n,;]+)',
-                    r'overnight\s+at\s+([^\n,;]+)',
-                    r'accommodation[:\-]?\s*([^\n,;]+)'
-                ]
-                
-                for pattern in accommodation_patterns:
-                    acc_match = re.search(pattern, day_content, re.IGNORECASE)
-                    if acc_match:
-                        acc_info = acc_match.group(1).strip()
-                        if len(acc_info) > 5:  # Only use if substantial
-                            day_data["accommodation"] = acc_info
-                            break
-                
-                # If still no accommodation found, add a realistic default
-                if not day_data["accommodation"]:
-                    day_data["accommodation"] = "Mid-range hotel or guesthouse in city center"
-            
-            parsed_data["days"].append(day_data)
+            parsed_data["days"].append(day_parser(day_num, day_title, day_content))
         
         # Extract transportation details
         extract_transportation(itinerary_text, parsed_data)
     
     return parsed_data
 
+class TransportLeg(NamedTuple):
+    mode: str
+    origin: str | None
+    destination: str | None
+    day: int | None
+    section: str | None
+    text: str
+
+class TransportTracker:
+    """Finds transport legs in itinerary text, fed whole or chunk by chunk.
+
+    Only complete lines are scanned, each once, so feeding a streamed
+    response costs time proportional to the new text. The tracker follows the
+    section headings and day headings to attribute each leg, and drops a
+    mention whose normalized clause was already seen for the same mode.
+    """
+    
+    def __init__(self):
+        self.section = None
+        self.day = None
+        self.pending = ""
+        self.seen = set()
+        self.legs = []
+    
+    def feed(self, chunk):
+        """Scan the lines completed by chunk and return the new legs"""
+        lines = (self.pending + chunk).split("\n")
+        self.pending = lines.pop()
+        found = []
+        for line in lines:
+            found += self.scan_line(line)
+        return found
+    
+    def close(self):
+        """Scan the unterminated last line and return every leg found"""
+        if self.pending:
+            self.scan_line(self.pending)
+            self.pending = ""
+        return self.legs
+    
+    def scan_line(self, line):
+        line = line[:PARSE_MAX_LINE_CHARS]
+        heading_match = match_section_heading(line)
+        if heading_match:
+            self.section = SECTION_KEYS[heading_match.group(1)]
+            self.day = None
+            return []
+        if self.section == "daily" and "**" in line:
+            day_match = HARDENED_DAY_HEADING_PATTERN.search(line)
+            if day_match:
+                self.day = int(day_match.group(1))
+                line = line[day_match.end():]
+        if TRANSPORT_TRIGGER_TOKENS.isdisjoint(TRANSPORT_TOKEN_PATTERN.findall(line.lower())):
+            return []
+        
+        found = []
+        slot, content = split_line_label(line)
+        if slot in ("breakfast", "lunch", "dinner"):
+            # "Dinner: Cruise buffet" names a restaurant, not a boat
+            return []
+        for clause in TRANSPORT_CLAUSE_SPLIT_PATTERN.split(content):
+            modes = {TRANSPORT_KEYWORD_MODES[keyword.lower()] for keyword in TRANSPORT_KEYWORD_PATTERN.findall(clause)}
+            if not modes:
+                continue
+            clause = clause.strip().rstrip(".;")
+            normalized = TRANSPORT_NORMALIZE_PATTERN.sub(" ", clause.casefold()).strip()
+            origin = TRANSPORT_FROM_PATTERN.search(clause)
+            destination = TRANSPORT_TO_PATTERN.search(clause)
+            for mode in sorted(modes):
+                if (mode, normalized) in self.seen:
+                    continue
+                self.seen.add((mode, normalized))
+                found.append(TransportLeg(
+                    mode,
+                    origin.group(1) if origin else None,
+                    destination.group(1) if destination else None,
+                    self.day,
+                    self.section,
+                    clause,
+                ))
+        self.legs += found
+        return found
+
+def extract_transport_legs(itinerary_text):
+    tracker = TransportTracker()
+    tracker.feed(itinerary_text)
+    return tracker.close()
+
+def describe_transport_leg(leg):
+    icon, label, _ = TRANSPORT_MODES[leg.mode]
+    route = f" {leg.origin or '…'} → {leg.destination}" if leg.destination else (f" from {leg.origin}" if leg.origin else "")
+    day = f" (Day {leg.day})" if leg.day else ""
+    return f"{icon} {label}{route}: {leg.text}{day}"
+
 def extract_transportation(itinerary_text, parsed_data):
-    """Extract transportation information from the itinerary"""
-    
-    transportation_info = []
-    
-    # Look for flight information
-    flight_matches = re.findall(r'(?:flight|airline|plane|air travel)[\s\-:]*([^\n.]+)', itinerary_text, re.IGNORECASE)
-    for match in flight_matches:
-        if len(match.strip()) > 10:
-            transportation_info.append(f"✈️ Flight: {match.strip()}")
-    
-    # Look for train information
-    train_matches = re.findall(r'(?:train|railway|rail)[\s\-:]*([^\n.]+)', itinerary_text, re.IGNORECASE)
-    for match in train_matches:
-        if len(match.strip()) > 10:
-            transportation_info.append(f"🚂 Train: {match.strip()}")
-    
-    # Look for local transport
-    local_transport_matches = re.findall(r'(?:taxi|bus|metro|local transport|public transport)[\s\-:]*([^\n.]+)', itinerary_text, re.IGNORECASE)
-    for match in local_transport_matches:
-        if len(match.strip()) > 10:
-            transportation_info.append(f"🚌 Local Transport: {match.strip()}")
-    
-    if transportation_info:
-        parsed_data["transportation"] = "\n".join(transportation_info)
+    """Extract transportation legs from the itinerary, with a display summary"""
+    
+    legs = extract_transport_legs(itinerary_text)
+    parsed_data["transport_legs"] = [leg._asdict() for leg in legs]
+    if legs:
+        parsed_data["transportation"] = "\n".join(describe_transport_leg(leg) for leg in legs)
     else:
         parsed_data["transportation"] = "Transportation details will vary based on your preferences and final bookings."
 
+class Meals(NamedTuple):
+    breakfast: str = ""
+    lunch: str = ""
+    dinner: str = ""
+
+@dataclass(slots=True, frozen=True)
+class DayPlan:
+    """One parsed day; immutable and hashable, so rendered days can be cached by content"""
+    
+    day_number: int
+    title: str
+    morning: str = ""
+    afternoon: str = ""
+    evening: str = ""
+    meals: Meals = Meals()
+    accommodation: str = ""
+    activities: tuple = ()
+    
+    @classmethod
+    def from_dict(cls, day_data):
+        return cls(
+            day_number=day_data["day_number"],
+            title=day_data["title"],
+            morning=day_data["morning"],
+            afternoon=day_data["afternoon"],
+            evening=day_data["evening"],
+            meals=Meals(**day_data["meals"]),
+            accommodation=day_data["accommodation"],
+            activities=tuple(day_data["activities"]),
+        )
+    
+    def to_json(self):
+        """The same dict shape parse_itinerary_data produces for a day"""
+        return {
+            "day_number": self.day_number,
+            "title": self.title,
+            "morning": self.morning,
+            "afternoon": self.afternoon,
+            "evening": self.evening,
+            "meals": self.meals._asdict(),
+            "accommodation": self.accommodation,
+            "activities": list(self.activities),
+        }
+    
+    from_json = from_dict
+
+@dataclass(slots=True)
+class ParsedItinerary:
+    """Typed parse_itinerary_data result"""
+    
+    overview: str = ""
+    days: tuple = ()
+    accommodation: str = ""
+    dining: str = ""
+    attractions: str = ""
+    budget: str = ""
+    essential_info: str = ""
+    transportation: str = ""
+    transport_legs: tuple = ()
+    parse_incomplete: bool = False
+    
+    @classmethod
+    def from_dict(cls, parsed_data):
+        return cls(
+            overview=parsed_data["overview"],
+            days=tuple(DayPlan.from_dict(day) for day in parsed_data["days"]),
+            accommodation=parsed_data["accommodation"],
+            dining=parsed_data["dining"],
+            attractions=parsed_data["attractions"],
+            budget=parsed_data["budget"],
+            essential_info=parsed_data["essential_info"],
+            transportation=parsed_data["transportation"],
+            transport_legs=tuple(TransportLeg(**leg) for leg in parsed_data.get("transport_legs", ())),
+            parse_incomplete=parsed_data.get("parse_incomplete", False),
+        )
+    
+    def to_json(self):
+        """The same dict shape parse_itinerary_data produces"""
+        data = {
+            "overview": self.overview,
+            "days": [day.to_json() for day in self.days],
+            "accommodation": self.accommodation,
+            "dining": self.dining,
+            "attractions": self.attractions,
+            "budget": self.budget,
+            "essential_info": self.essential_info,
+            "transportation": self.transportation,
+            "transport_legs": [leg._asdict() for leg in self.transport_legs],
+        }
+        if self.parse_incomplete:
+            data["parse_incomplete"] = True
+        return data
+    
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_dict(json.loads(data) if isinstance(data, str) else data)
+
+# Flat tables for bulk export: one row per day and one per top-level section
+EXPORT_DAY_COLUMNS = [
+    "itinerary_id", "day_number", "title", "morning", "afternoon", "evening",
+    "breakfast", "lunch", "dinner", "accommodation", "activities",
+]
+EXPORT_SECTION_COLUMNS = ["itinerary_id", "section", "content"]
+EXPORT_SECTIONS = ["overview", "accommodation", "dining", "attractions", "budget", "essential_info", "transportation"]
+
+def itinerary_hash(itinerary_text):
+    return hashlib.sha256(itinerary_text.encode("utf-8")).hexdigest()[:16]
+
+def flatten_parsed_itinerary(itinerary_id, parsed_data):
+    """Return (day rows, section rows) for a parse_itinerary_data result"""
+    day_rows = [
+        {
+            "itinerary_id": itinerary_id,
+            "day_number": day["day_number"],
+            "title": day["title"],
+            "morning": day["morning"],
+            "afternoon": day["afternoon"],
+            "evening": day["evening"],
+            "breakfast": day["meals"]["breakfast"],
+            "lunch": day["meals"]["lunch"],
+            "dinner": day["meals"]["dinner"],
+            "accommodation": day["accommodation"],
+            "activities": "; ".join(day["activities"]),
+        }
+        for day in parsed_data["days"]
+    ]
+    section_rows = [
+        {"itinerary_id": itinerary_id, "section": section, "content": parsed_data[section]}
+        for section in EXPORT_SECTIONS
+        if parsed_data.get(section)
+    ]
+    return day_rows, section_rows
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_parsed_json(itinerary_key, _parsed):
+    """Indented parsed_data JSON, cached by itinerary hash.
+
+    Only this part is shared: the same itinerary text can reach several
+    sessions (presets, the generation cache), each with its own request.
+    """
+    return json.dumps(_parsed.to_json(), indent=2)
+
+def build_export_json(itinerary_key, user_input, details, parsed):
+    """Session JSON download, built on click from this session's request.
+
+    The raw text is left out (the text download carries it), so the
+    itinerary content is not duplicated next to parsed_data.
+    """
+    session_json = json.dumps({
+        "user_input": user_input,
+        "extracted_details": details.to_json(),
+        "itinerary_hash": itinerary_key,
+        "generated_date": datetime.now().isoformat()
+    }, indent=2)
+    parsed_json = export_parsed_json(itinerary_key, parsed).replace("\n", "\n  ")
+    # Splice the cached block in as the last key of the indented object
+    return f'{session_json[:-2]},\n  "parsed_data": {parsed_json}\n}}'
+
+def parse_itinerary(itinerary_text, mode=None):
+    """parse_itinerary_data, returned as a ParsedItinerary"""
+    return ParsedItinerary.from_dict(parse_itinerary_data(itinerary_text, mode))
+
+# Incremental updates for edited requests. Each extracted field maps to the
+# itinerary sections it shapes ("*" for the whole itinerary); an edit that
+# only touches a few fields regenerates just those sections and splices them
+# into the stored trip, so the output tokens follow the size of the change.
+SECTION_DEPENDENCIES = {
+    "Starting Location": "*",
+    "Destination": "*",
+    "Destination Type": "*",
+    "Travel Distance": "*",
+    "Nearby Places": "*",
+    "Route Plan": "*",
+    "Trip Duration": "*",
+    "Start Date": ("overview", "daily", "essential_info"),
+    "End Date": ("overview", "daily", "essential_info"),
+    "Budget Range": ("accommodation", "budget"),
+    "Budget Per Person": ("accommodation", "budget"),
+    "Budget Per Day": ("accommodation", "budget"),
+    "Number of Travelers": ("accommodation", "budget"),
+    "Trip Type": ("overview", "daily", "attractions"),
+    "Transportation Preferences": ("daily", "budget", "essential_info"),
+    "Accommodation Preferences": ("accommodation", "budget"),
+    "Special Requirements": ("daily", "dining"),
+    # Request words no field captures, when more than a few changed
+    "Request": "*",
+}
+SECTION_TITLES = {
+    "overview": "Trip Overview",
+    "daily": "Daily Itinerary",
+    "accommodation": "Accommodation Details",
+    "dining": "Dining Recommendations",
+    "attractions": "Attractions & Activities",
+    "budget": "Budget Breakdown",
+    "essential_info": "Essential Information",
+}
+# Past this many sections a full regeneration costs about the same
+PARTIAL_UPDATE_MAX_SECTIONS = int(os.getenv("PARTIAL_UPDATE_MAX_SECTIONS", "3"))
+PARTIAL_UPDATE_MAX_REQUEST_WORDS = 2
+
+def diff_details(old_details, new_details, old_input="", new_input=""):
+    """{field: (old, new)} for the extracted fields that differ between two requests.
+
+    Both sides go through TripDetails so formatting differences do not count.
+    With the request texts, the words no field captures are compared too, and
+    more than PARTIAL_UPDATE_MAX_REQUEST_WORDS added or removed is reported
+    under "Request".
+    """
+    old = TripDetails.from_details(old_details).to_details()
+    new = TripDetails.from_details(new_details).to_details()
+    changes = {field: (old.get(field), new.get(field)) for field in dict.fromkeys([*old, *new]) if old.get(field) != new.get(field)}
+    old_words = set(residual_request_words(old_details, old_input))
+    new_words = set(residual_request_words(new_details, new_input))
+    if len(old_words ^ new_words) > PARTIAL_UPDATE_MAX_REQUEST_WORDS:
+        changes["Request"] = (old_input, new_input)
+    return changes
+
+def affected_sections(changes):
+    """Section keys to regenerate for a diff_details result, in itinerary order;
+    None when the whole itinerary has to be regenerated"""
+    sections = set()
+    for field in changes:
+        depends = SECTION_DEPENDENCIES.get(field, "*")
+        if depends == "*":
+            return None
+        sections.update(depends)
+    return [key for key in SECTION_TITLES if key in sections]
+
+def split_itinerary_sections(itinerary_text):
+    """(text before the first section, {section key: block with its heading})"""
+    preamble, sections, current = [], {}, None
+    for line in itinerary_text.split("\n"):
+        heading_match = match_section_heading(line)
+        if heading_match:
+            current = SECTION_KEYS[heading_match.group(1)]
+            sections[current] = []
+        (sections[current] if current else preamble).append(line)
+    return "\n".join(preamble), {key: "\n".join(lines).strip() for key, lines in sections.items()}
+
+def build_section_update_prompt(details, user_input, changes, old_sections):
+    labels = dict(PROMPT_FIELDS)
+    lines = [build_itinerary_prompt(details, user_input), "", "The traveler changed their request:"]
+    for field, (before, after) in changes.items():
+        if field != "Request":
+            lines.append(f"- {labels.get(field, field)}: {before or 'not specified'} -> {after or 'not specified'}")
+    lines += [
+        "",
+        f"Rewrite only these sections: {', '.join(SECTION_TITLES[key] for key in old_sections)}",
+        "Keep their headings and format, change what the new details require and keep the rest of the trip as it is. Current versions:",
+        "",
+        *old_sections.values(),
+    ]
+    return "\n".join(lines)
+
+def update_itinerary(trip, details, user_input):
+    """Regenerate only the sections an edited request affects.
+
+    Returns (itinerary, parsed, usage) with the new sections spliced into the
+    stored trip's text and ParsedItinerary, or None when the edit needs a
+    full regeneration (or changed nothing the itinerary depends on). usage
+    lists the regenerated section keys under "sections".
+    """
+    changes = diff_details(trip.details.to_details(), details, trip.user_input, user_input)
+    sections = affected_sections(changes) if changes else None
+    if not sections or len(sections) > PARTIAL_UPDATE_MAX_SECTIONS:
+        return None
+    
+    preamble, blocks = split_itinerary_sections(trip.itinerary)
+    if any(key not in blocks for key in sections):
+        return None
+    try:
+        model, instructions_in_context = get_itinerary_model(ITINERARY_INSTRUCTIONS_VERSION)
+        prompt = build_section_update_prompt(details, user_input, changes, {key: blocks[key] for key in sections})
+        if not instructions_in_context:
+            prompt = f"{ITINERARY_INSTRUCTIONS}\n\n{prompt}"
+        started = time.perf_counter()
+        response = model.generate_content(prompt)
+        usage = record_usage(response, time.perf_counter() - started)
+    except Exception as e:
+        st.error(f"Error updating itinerary: {str(e)}")
+        return None
+    
+    _, new_blocks = split_itinerary_sections(response.text)
+    if any(key not in new_blocks for key in sections):
+        # The model did not keep the headings; splicing would lose sections
+        return None
+    blocks.update({key: new_blocks[key] for key in sections})
+    itinerary = "\n\n".join(part for part in [preamble.strip(), *(blocks[key] for key in SECTION_TITLES if key in blocks)] if part)
+    
+    # Merge the re-parsed sections into the stored parse
+    parsed_data = trip.parsed().to_json()
+    fresh = parse_itinerary_data("\n\n".join(new_blocks[key] for key in sections))
+    for key in sections:
+        parsed_data["days" if key == "daily" else key] = fresh["days" if key == "daily" else key]
+    if "daily" in sections or "essential_info" in sections:
+        extract_transportation(itinerary, parsed_data)
+    usage = {**usage, "sections": sections}
+    
+    # Repeating the edited request is then an exact cache hit
+    cache_prompt = build_itinerary_prompt(details, user_input)
+    if not instructions_in_context:
+        cache_prompt = f"{ITINERARY_INSTRUCTIONS}\n\n{cache_prompt}"
+    get_generation_cache().add(*generation_cache_keys(details, user_input, cache_prompt), itinerary, usage)
+    return itinerary, ParsedItinerary.from_dict(parsed_data), usage
+
+# Session storage. st.session_state only holds a key; the trip lives in a
+# process-wide store with the raw itinerary zlib-compressed once, parsed
+# itineraries are shared between sessions by content hash, and sessions idle
+# for SESSION_IDLE_SECONDS are evicted.
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+SESSION_SWEEP_SECONDS = min(60, SESSION_IDLE_SECONDS)
+PARSED_CACHE_SIZE = int(os.getenv("PARSED_CACHE_SIZE", "256"))
+
+def approx_size(obj, seen=None):
+    """Deep sys.getsizeof over the containers trips are built from"""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(key, seen) + approx_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(approx_size(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+@st.cache_resource
+def get_session_store():
+    return {"lock": threading.Lock(), "trips": {}, "parsed": OrderedDict(), "last_sweep": time.time()}
+
+@dataclass(slots=True)
+class StoredTrip:
+    itinerary_key: str
+    itinerary_blob: bytes
+    raw_chars: int
+    details: TripDetails
+    user_input: str
+    usage: dict | None
+    last_seen: float
+    
+    @property
+    def itinerary(self):
+        return zlib.decompress(self.itinerary_blob).decode("utf-8")
+    
+    def parsed(self):
+        """The shared ParsedItinerary, re-parsed from the stored text if it was evicted"""
+        return shared_parsed_itinerary(self.itinerary_key, lambda: parse_itinerary(self.itinerary))
+    
+    def footprint(self):
+        """Bytes this session holds on its own (the parsed itinerary is shared)"""
+        return approx_size(self)
+
+def shared_parsed_itinerary(itinerary_key, build):
+    store = get_session_store()
+    with store["lock"]:
+        parsed = store["parsed"].get(itinerary_key)
+        if parsed is not None:
+            store["parsed"].move_to_end(itinerary_key)
+            return parsed
+    parsed = build()
+    with store["lock"]:
+        store["parsed"][itinerary_key] = parsed
+        while len(store["parsed"]) > PARSED_CACHE_SIZE:
+            store["parsed"].popitem(last=False)
+    return parsed
+
+def session_trip_key():
+    if "trip_key" not in st.session_state:
+        st.session_state.trip_key = uuid.uuid4().hex
+    return st.session_state.trip_key
+
+def store_trip(itinerary, details, user_input, usage=None, parsed=None):
+    """Store this session's trip, replacing any previous one"""
+    itinerary_key = itinerary_hash(itinerary)
+    if parsed is not None:
+        shared_parsed_itinerary(itinerary_key, lambda: parsed)
+    trip = StoredTrip(
+        itinerary_key=itinerary_key,
+        itinerary_blob=zlib.compress(itinerary.encode("utf-8")),
+        raw_chars=len(itinerary),
+        details=details,
+        user_input=user_input,
+        usage=usage,
+        last_seen=time.time(),
+    )
+    store = get_session_store()
+    with store["lock"]:
+        store["trips"][session_trip_key()] = trip
+    st.session_state.has_trip = True
+    evict_idle_sessions()
+    return trip
+
+def current_trip():
+    """This session's trip (marking the session active), or None"""
+    store = get_session_store()
+    if time.time() - store["last_sweep"] > SESSION_SWEEP_SECONDS:
+        evict_idle_sessions()
+    with store["lock"]:
+        trip = store["trips"].get(st.session_state.get("trip_key"))
+        if trip:
+            trip.last_seen = time.time()
+    return trip
+
+def clear_trip():
+    store = get_session_store()
+    with store["lock"]:
+        store["trips"].pop(st.session_state.get("trip_key"), None)
+    st.session_state.has_trip = False
+
+def evict_idle_sessions(idle_seconds=None):
+    """Drop trips of sessions idle longer than idle_seconds; returns how many"""
+    cutoff = time.time() - (idle_seconds if idle_seconds is not None else SESSION_IDLE_SECONDS)
+    store = get_session_store()
+    with store["lock"]:
+        store["last_sweep"] = time.time()
+        idle = [key for key, trip in store["trips"].items() if trip.last_seen < cutoff]
+        for key in idle:
+            del store["trips"][key]
+    return len(idle)
+
+def session_memory_report():
+    """Per-session and shared byte counts for the session store"""
+    store = get_session_store()
+    with store["lock"]:
+        trips = dict(store["trips"])
+        parsed = list(store["parsed"].values())
+    now = time.time()
+    sessions = [
+        {"session": key, "bytes": trip.footprint(), "raw_chars": trip.raw_chars,
+         "compressed_bytes": len(trip.itinerary_blob), "idle_seconds": now - trip.last_seen}
+        for key, trip in trips.items()
+    ]
+    return {
+        "sessions": sessions,
+        "session_bytes": sum(session["bytes"] for session in sessions),
+        "shared_parsed_bytes": approx_size(parsed),
+        "shared_parsed_entries": len(parsed),
+    }
+
+# "lazy" renders only the selected tab and the expanded days, one page of days
+# at a time; "tabs" renders every tab and day on each rerun. Lazy mode needs
+# tabs and expanders that report their open state (key=, on_change=), which
+# older Streamlit releases do not have; those fall back to "tabs".
+STATEFUL_CONTAINERS = all("on_change" in inspect.signature(container).parameters for container in (st.tabs, st.expander))
+ITINERARY_VIEW_MODE = os.getenv("TRAVEL_PLANNER_VIEW_MODE", "lazy") if STATEFUL_CONTAINERS else "tabs"
+DAYS_PER_PAGE = int(os.getenv("DAYS_PER_PAGE", "7"))
+MARKDOWN_CACHE_SIZE = 512
+
+@st.cache_resource
+def get_markdown_cache():
+    """Process-wide LRU of rendered markdown keyed by content hash"""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+def cached_markdown(key, build):
+    """Return build() for key, reusing the markdown built for the same content"""
+    cache = get_markdown_cache()
+    with cache["lock"]:
+        if key in cache["entries"]:
+            cache["entries"].move_to_end(key)
+            return cache["entries"][key]
+    markdown = build()
+    with cache["lock"]:
+        cache["entries"][key] = markdown
+        while len(cache["entries"]) > MARKDOWN_CACHE_SIZE:
+            cache["entries"].popitem(last=False)
+    return markdown
+
+def day_markdown(day_data):
+    """(left column, right column) markdown for one day"""
+    slots = [("🌅 Morning", day_data.morning), ("☀️ Afternoon", day_data.afternoon), ("🌙 Evening", day_data.evening)]
+    left = "\n\n".join(
+        f"#### {label}\n{text}" if text else f"#### {label}\n_{label.split()[-1]} activities not specified_"
+        for label, text in slots
+    )
+    meals = [f"**{meal.title()}:** {text}" for meal, text in day_data.meals._asdict().items() if text]
+    right = ["#### 🍽️ Meals", *(meals or ["_Meals not specified_"]), "#### 🏨 Accommodation", day_data.accommodation or "_Accommodation details not specified_"]
+    if day_data.activities:
+        right += ["#### 🎯 Key Activities", "\n".join(f"- {activity}" for activity in day_data.activities)]
+    return left, "\n\n".join(right)
+
 def display_day_details(day_data):
     """Display detailed information for a specific day"""
     
+    left, right = cached_markdown(("day", day_data), lambda: day_markdown(day_data))
     col1, col2 = st.columns(2)
-    
     with col1:
-        # Morning activities
-        st.subheader("🌅 Morning")
-        if day_data["morning"]:
-            st.write(day_data["morning"])
-        else:
-            st.info("Morning activities not specified")
-        
-        # Afternoon activities
-        st.subheader("☀️ Afternoon") 
-        if day_data["afternoon"]:
-            st.write(day_data["afternoon"])
+        st.markdown(left)
+    with col2:
+        st.markdown(right)
+
+def raw_section(trip, section):
+    """A section cut straight from the raw itinerary, for when parsing found nothing"""
+    def build():
+        match = RAW_SECTION_PATTERNS[section].search(trip.itinerary)
+        return match.group(1).strip() if match else ""
+    return cached_markdown(("raw", section, trip.itinerary_key), build)
+
+def render_overview(parsed, trip):
+    st.header("🌟 Trip Overview")
+    if parsed.overview:
+        st.markdown(parsed.overview)
+    else:
+        st.info("Overview information is being processed...")
+    
+    # Display key trip details
+    if trip.details:
+        st.subheader("📊 Trip Summary")
+        details_df_data = []
+        for key, value in trip.details.to_details().items():
+            if value:
+                details_df_data.append({"Detail": key, "Information": str(value)})
+        
+        if details_df_data:
+            try:
+                details_df = pd.DataFrame(details_df_data)
+                st.dataframe(details_df, use_container_width=True, hide_index=True)
+            except Exception as e:
+                # Fallback to simple display if DataFrame creation fails
+                for item in details_df_data:
+                    st.write(f"**{item['Detail']}:** {item['Information']}")
+
+def render_daily(parsed, trip):
+    st.header("📅 Daily Itinerary")
+    
+    if not parsed.days:
+        st.info("Daily itinerary is being processed...")
+        # Show raw itinerary as fallback
+        daily_section = raw_section(trip, "daily")
+        if daily_section:
+            st.markdown(daily_section)
+        return
+    
+    lazy = ITINERARY_VIEW_MODE == "lazy"
+    # Widgets are keyed by position: the model sometimes repeats or skips day
+    # numbers, and duplicate keys would raise
+    days = list(enumerate(parsed.days))
+    if lazy and len(days) > DAYS_PER_PAGE:
+        pages = [days[start:start + DAYS_PER_PAGE] for start in range(0, len(days), DAYS_PER_PAGE)]
+        labels = [f"Days {page[0][1].day_number}–{page[-1][1].day_number}" for page in pages]
+        selected = st.segmented_control("Days", range(len(pages)), default=0, format_func=labels.__getitem__,
+                                        key="itinerary_day_page", label_visibility="collapsed")
+        days = pages[selected] if selected is not None else pages[0]
+    
+    for index, day in days:
+        if lazy:
+            expander = st.expander(f"🗓️ {day.title}", expanded=False, key=f"itinerary_day_{index}", on_change="rerun")
+            if not expander.open:
+                continue
         else:
-            st.info("Afternoon activities not specified")
-        
-        # Evening activities
-        st.subheader("🌙 Evening")
-        if day_data["evening"]:
-            st.write(day_data["evening"])
+            expander = st.expander(f"🗓️ {day.title}", expanded=False)
+        with expander:
+            display_day_details(day)
+
+def section_renderer(field, header, pending, raw_key):
+    """Renderer for the sections that show parsed markdown with a raw fallback"""
+    def render(parsed, trip):
+        st.header(header)
+        if getattr(parsed, field):
+            st.markdown(getattr(parsed, field))
         else:
-            st.info("Evening activities not specified")
+            st.info(pending)
+            # Extract and show the raw section as fallback
+            section = raw_section(trip, raw_key)
+            if section:
+                st.markdown(section)
+    return render
+
+def render_essential(parsed, trip):
+    section_renderer("essential_info", "ℹ️ Essential Travel Information", "Essential information is being processed...", "essential")(parsed, trip)
     
-    with col2:
-        # Meals
-        st.subheader("🍽️ Meals")
-        
-        # Breakfast
-        if day_data["meals"]["breakfast"]:
-            st.write(f"**Breakfast:** {day_data['meals']['breakfast']}")
-        
-        # Lunch
-        if day_data["meals"]["lunch"]:
-            st.write(f"**Lunch:** {day_data['meals']['lunch']}")
-        
-        # Dinner
-        if day_data["meals"]["dinner"]:
-            st.write(f"**Dinner:** {day_data['meals']['dinner']}")
-        
-        # Accommodation
-        st.subheader("🏨 Accommodation")
-        if day_data["accommodation"]:
-            st.write(day_data["accommodation"])
-        else:
-            st.info("Accommodation details not specified")
-        
-        # Activities
-        if day_data["activities"]:
-            st.subheader("🎯 Key Activities")
-            for activity in day_data["activities"]:
-                st.write(f"• {activity}")
+    # Add transportation info if available
+    if parsed.transportation:
+        st.subheader("🚗 Transportation Details")
+        st.markdown(parsed.transportation)
+
+ITINERARY_TABS = [
+    ("📋 Overview", render_overview),
+    ("📅 Daily Itinerary", render_daily),
+    ("🏨 Accommodation", section_renderer("accommodation", "🏨 Accommodation Recommendations", "Accommodation recommendations are being processed...", "accommodation")),
+    ("🍽️ Dining", section_renderer("dining", "🍽️ Dining Recommendations", "Dining recommendations are being processed...", "dining")),
+    ("🎯 Attractions", section_renderer("attractions", "🎯 Attractions & Activities", "Attractions and activities are being processed...", "attractions")),
+    ("💰 Budget", section_renderer("budget", "💰 Budget Breakdown", "Budget breakdown is being processed...", "budget")),
+    ("ℹ️ Essential Info", render_essential),
+]
+
+def render_itinerary_tabs(parsed, trip):
+    """Render the itinerary tabs; in lazy mode only the selected tab runs"""
+    labels = [label for label, _ in ITINERARY_TABS]
+    if ITINERARY_VIEW_MODE == "lazy":
+        tabs = st.tabs(labels, key="itinerary_tab", on_change="rerun")
+    else:
+        tabs = st.tabs(labels)
+    for tab, (_, render) in zip(tabs, ITINERARY_TABS):
+        # .open is None when tabs don't track state, so every tab renders
+        if getattr(tab, "open", None) is False:
+            continue
+        with tab:
+            render(parsed, trip)
 
 def create_trip_examples():
     """Create example trip requests for users"""
@@ -1199,8 +3510,114 @@ def create_trip_examples():
     
     return examples
 
+# Presets are warmed ahead of time so a sidebar click does not pay for a
+# full extraction and generation. Results are persisted so a deploy-time
+# warm-up (python -m travel_planner warm-presets) survives restarts. The
+# in-app background warm-up spends model calls, so it is opt-in
+# (PRESET_WARMUP=1).
+PRESET_CACHE_PATH = os.getenv(
+    "PRESET_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "preset_cache.json")
+)
+PRESET_REFRESH_SECONDS = int(os.getenv("PRESET_REFRESH_SECONDS", str(6 * 60 * 60)))
+PRESET_WARMUP_ENABLED = os.getenv("PRESET_WARMUP", "0") == "1"
+
+@st.cache_resource
+def get_preset_cache():
+    """Process-wide preset results, seeded from the persisted cache file.
+
+    save_error holds the last failure to write the file, or None.
+    """
+    cache = {"lock": threading.Lock(), "entries": {}, "save_error": None}
+    try:
+        with open(PRESET_CACHE_PATH, encoding="utf-8") as f:
+            cache["entries"] = json.load(f)
+    except (OSError, ValueError):
+        pass
+    return cache
+
+def save_preset_cache(entries):
+    """Atomically write preset results to PRESET_CACHE_PATH"""
+    tmp_path = f"{PRESET_CACHE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+    os.replace(tmp_path, PRESET_CACHE_PATH)
+
+def is_preset_fresh(entry):
+    try:
+        generated_at = datetime.fromisoformat(entry["generated_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return (datetime.now() - generated_at).total_seconds() < PRESET_REFRESH_SECONDS
+
+def warm_up_presets(force=False):
+    """Pre-extract, generate and parse every sidebar preset.
+
+    Fresh entries are kept unless force is set. Returns the preset entries.
+    """
+    cache = get_preset_cache()
+    for title, example in create_trip_examples().items():
+        entry = cache["entries"].get(title)
+        if not force and entry and entry.get("text") == example["text"] and is_preset_fresh(entry):
+            continue
+        
+        try:
+            details = extract_details(example["text"])
+            itinerary, usage = generate_itinerary_with_usage(details, example["text"], use_cache=False)
+        except Exception:
+            # One broken preset must not keep the others cold
+            traceback.print_exc()
+            continue
+        if not itinerary:
+            continue
+        
+        entry = {
+            "text": example["text"],
+            "details": details,
+            "itinerary": itinerary,
+            "parsed_data": parse_itinerary_data(itinerary),
+            "usage": usage,
+            "generated_at": datetime.now().isoformat()
+        }
+        with cache["lock"]:
+            cache["entries"] = {**cache["entries"], title: entry}
+            try:
+                save_preset_cache(cache["entries"])
+                cache["save_error"] = None
+            except OSError as e:
+                # Presets stay warm in memory; the next warm-up retries the write
+                cache["save_error"] = str(e)
+                traceback.print_exc()
+    
+    return cache["entries"]
+
+@st.cache_resource
+def start_preset_warmup():
+    """Start the background thread that keeps presets warm (once per process)"""
+    def refresh_loop():
+        while True:
+            try:
+                warm_up_presets()
+            except Exception:
+                traceback.print_exc()
+            time.sleep(PRESET_REFRESH_SECONDS)
+    
+    thread = threading.Thread(target=refresh_loop, name="preset-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def get_preset(text):
+    """Return the warmed preset entry for an input text, if there is one"""
+    for entry in get_preset_cache()["entries"].values():
+        if entry.get("text") == text:
+            return entry
+    return None
+
 # Main application
 def main():
+    if PRESET_WARMUP_ENABLED:
+        start_preset_warmup()
+    
     # Header
     st.title("🌍 Travel Planner Pro")
     st.markdown("### Plan your perfect trip with AI-powered recommendations")
@@ -1215,6 +3632,16 @@ def main():
         for title, example in examples.items():
             if st.button(f"{example['icon']} {title}", key=f"example_{title}", use_container_width=True):
                 st.session_state.example_text = example['text']
+                
+                # Show the warmed itinerary straight away; Generate still regenerates it
+                preset = get_preset(example['text'])
+                if preset:
+                    store_trip(
+                        preset['itinerary'],
+                        TripDetails.from_details(preset['details']),
+                        preset['text'],
+                        parsed=ParsedItinerary.from_dict(preset['parsed_data'])
+                    )
         
         st.markdown("---")
         st.markdown("### 💡 Tips for Better Results")
@@ -1265,7 +3692,8 @@ def main():
         if user_input:
             st.subheader("🔍 Trip Details Preview")
             with st.spinner("Analyzing your request..."):
-                details = extract_details(user_input)
+                preset = get_preset(user_input)
+                details = preset['details'] if preset else extract_details(user_input)
                 
                 if details:
                     # Create a nice display of extracted details
@@ -1292,132 +3720,56 @@ def main():
     if generate_button and user_input:
         with st.spinner("🤖 AI is crafting your perfect itinerary... This may take a few moments."):
             details = extract_details(user_input)
-            itinerary = generate_itinerary(details, user_input)
+            
+            # An edit of the current trip only regenerates the sections it affects
+            trip = current_trip()
+            update = update_itinerary(trip, details, user_input) if trip else None
+            if update:
+                itinerary, parsed, usage = update
+                store_trip(itinerary, TripDetails.from_details(details), user_input, usage, parsed=parsed)
+                st.success("🎉 Your itinerary is updated!")
+                st.rerun()
+            itinerary, usage = generate_itinerary_with_usage(details, user_input)
             
             if itinerary:
-                # Store in session state
-                st.session_state.itinerary = itinerary
-                st.session_state.details = details
-                st.session_state.user_input = user_input
+                # Store in the session store
+                store_trip(itinerary, TripDetails.from_details(details), user_input, usage)
                 st.success("🎉 Your itinerary is ready!")
                 st.rerun()
     
     # Display itinerary if available
-    if hasattr(st.session_state, 'itinerary') and st.session_state.itinerary:
+    trip = current_trip()
+    if trip is None and st.session_state.get('has_trip'):
+        st.session_state.has_trip = False
+        st.info("Your previous itinerary was cleared after a period of inactivity. Generate it again to continue.")
+    if trip:
         st.markdown("---")
         
-        # Parse the itinerary data
-        parsed_data = parse_itinerary_data(st.session_state.itinerary)
+        # Token usage and cost of the request that produced this itinerary
+        usage = trip.usage
+        if usage and usage.get("cache"):
+            match = "the same request" if usage["cache"] == "exact" else "a very similar request"
+            st.caption(f"♻️ Reused the itinerary generated for {match} · saved ${usage['cost_usd']:.4f}")
+        elif usage and usage.get("sections"):
+            st.caption(
+                f"✏️ Updated only {', '.join(SECTION_TITLES[key] for key in usage['sections'])} · "
+                f"{usage['output_tokens']:,} output tokens · ${usage['cost_usd']:.4f} · {usage['latency_seconds']:.1f}s"
+            )
+        elif usage:
+            st.caption(
+                f"🧮 {usage['input_tokens']:,} input / {usage['output_tokens']:,} output tokens · "
+                f"${usage['cost_usd']:.4f} · {usage['latency_seconds']:.1f}s"
+            )
+        st.caption(
+            f"💾 Session storage: {trip.footprint() / 1024:.1f} KB "
+            f"(itinerary {len(trip.itinerary_blob) / 1024:.1f} KB compressed from {trip.raw_chars / 1024:.1f} KB)"
+        )
+        
+        # The parsed itinerary is shared between sessions by content hash
+        parsed = trip.parsed()
         
         # Create tabs for different sections
-        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-            "📋 Overview", 
-            "📅 Daily Itinerary", 
-            "🏨 Accommodation", 
-            "🍽️ Dining", 
-            "🎯 Attractions", 
-            "💰 Budget", 
-            "ℹ️ Essential Info"
-        ])
-        
-        with tab1:
-            st.header("🌟 Trip Overview")
-            if parsed_data["overview"]:
-                st.markdown(parsed_data["overview"])
-            else:
-                st.info("Overview information is being processed...")
-            
-            # Display key trip details
-            if hasattr(st.session_state, 'details'):
-                st.subheader("📊 Trip Summary")
-                details_df_data = []
-                for key, value in st.session_state.details.items():
-                    if value:
-                        details_df_data.append({"Detail": key, "Information": str(value)})
-                
-                if details_df_data:
-                    try:
-                        details_df = pd.DataFrame(details_df_data)
-                        st.dataframe(details_df, use_container_width=True, hide_index=True)
-                    except Exception as e:
-                        # Fallback to simple display if DataFrame creation fails
-                        for item in details_df_data:
-                            st.write(f"**{item['Detail']}:** {item['Information']}")
-        
-        with tab2:
-            st.header("📅 Daily Itinerary")
-            
-            if parsed_data["days"]:
-                for day in parsed_data["days"]:
-                    with st.expander(f"🗓️ {day['title']}", expanded=False):
-                        display_day_details(day)
-            else:
-                st.info("Daily itinerary is being processed...")
-                # Show raw itinerary as fallback
-                if st.session_state.itinerary:
-                    daily_section = re.search(r'##\s*2\.\s*Daily Itinerary(.*?)(?=##\s*3\.|$)', st.session_state.itinerary, re.DOTALL | re.IGNORECASE)
-                    if daily_section:
-                        st.markdown(daily_section.group(1).strip())
-        
-        with tab3:
-            st.header("🏨 Accommodation Recommendations")
-            if parsed_data["accommodation"]:
-                st.markdown(parsed_data["accommodation"])
-            else:
-                st.info("Accommodation recommendations are being processed...")
-                # Extract and show accommodation info as fallback
-                accommodation_section = re.search(r'##\s*3\.\s*Accommodation(.*?)(?=##\s*4\.|$)', st.session_state.itinerary, re.DOTALL | re.IGNORECASE)
-                if accommodation_section:
-                    st.markdown(accommodation_section.group(1).strip())
-        
-        with tab4:
-            st.header("🍽️ Dining Recommendations")
-            if parsed_data["dining"]:
-                st.markdown(parsed_data["dining"])
-            else:
-                st.info("Dining recommendations are being processed...")
-                # Extract and show dining info as fallback
-                dining_section = re.search(r'##\s*4\.\s*Dining(.*?)(?=##\s*5\.|$)', st.session_state.itinerary, re.DOTALL | re.IGNORECASE)
-                if dining_section:
-                    st.markdown(dining_section.group(1).strip())
-        
-        with tab5:
-            st.header("🎯 Attractions & Activities")
-            if parsed_data["attractions"]:
-                st.markdown(parsed_data["attractions"])
-            else:
-                st.info("Attractions and activities are being processed...")
-                # Extract and show attractions info as fallback
-                attractions_section = re.search(r'##\s*5\.\s*Attractions(.*?)(?=##\s*6\.|$)', st.session_state.itinerary, re.DOTALL | re.IGNORECASE)
-                if attractions_section:
-                    st.markdown(attractions_section.group(1).strip())
-        
-        with tab6:
-            st.header("💰 Budget Breakdown")
-            if parsed_data["budget"]:
-                st.markdown(parsed_data["budget"])
-            else:
-                st.info("Budget breakdown is being processed...")
-                # Extract and show budget info as fallback
-                budget_section = re.search(r'##\s*6\.\s*Budget(.*?)(?=##\s*7\.|$)', st.session_state.itinerary, re.DOTALL | re.IGNORECASE)
-                if budget_section:
-                    st.markdown(budget_section.group(1).strip())
-        
-        with tab7:
-            st.header("ℹ️ Essential Travel Information")
-            if parsed_data["essential_info"]:
-                st.markdown(parsed_data["essential_info"])
-            else:
-                st.info("Essential information is being processed...")
-                # Extract and show essential info as fallback
-                essential_section = re.search(r'##\s*7\.\s*Essential(.*?)$', st.session_state.itinerary, re.DOTALL | re.IGNORECASE)
-                if essential_section:
-                    st.markdown(essential_section.group(1).strip())
-            
-            # Add transportation info if available
-            if parsed_data["transportation"]:
-                st.subheader("🚗 Transportation Details")
-                st.markdown(parsed_data["transportation"])
+        render_itinerary_tabs(parsed, trip)
         
         # Download options
         st.markdown("---")
@@ -1429,24 +3781,16 @@ def main():
             # Text download
             st.download_button(
                 label="📄 Download as Text",
-                data=st.session_state.itinerary,
+                data=lambda: trip.itinerary,
                 file_name=f"travel_itinerary_{datetime.now().strftime('%Y%m%d')}.txt",
                 mime="text/plain"
             )
         
         with col2:
-            # JSON download for structured data
-            json_data = {
-                "user_input": st.session_state.user_input,
-                "extracted_details": st.session_state.details,
-                "itinerary": st.session_state.itinerary,
-                "parsed_data": parsed_data,
-                "generated_date": datetime.now().isoformat()
-            }
-            
+            # JSON download for structured data, serialized only when clicked
             st.download_button(
                 label="📊 Download as JSON",
-                data=json.dumps(json_data, indent=2),
+                data=lambda: build_export_json(trip.itinerary_key, trip.user_input, trip.details, parsed),
                 file_name=f"travel_data_{datetime.now().strftime('%Y%m%d')}.json",
                 mime="application/json"
             )
@@ -1454,11 +3798,11 @@ def main():
         with col3:
             # Clear session to start over
             if st.button("🔄 Plan Another Trip", type="secondary"):
-                # Clear session state
-                for key in ['itinerary', 'details', 'user_input']:
-                    if key in st.session_state:
-                        del st.session_state[key]
+                # Clear this session's trip
+                clear_trip()
                 st.rerun()
 
-if __name__ == "__main__":
+# travel_planner serve runs this file once with TRAVEL_PLANNER_PRELOAD=1 to
+# build the cached resources before forking workers, without rendering
+if __name__ == "__main__" and os.getenv("TRAVEL_PLANNER_PRELOAD") != "1":
     main()
@@ -0,0 +1,1238 @@
+"""Command-line tools for Travel Planner Pro.
+
+Usage:
+    python -m travel_planner warm-presets [--force]
+    python -m travel_planner regex-stats ITINERARY_FILE... [--request TEXT]...
+    python -m travel_planner fuzz-parse [--size N] [--iterations N] [--compare]
+    python -m travel_planner export [SOURCE...] [--presets] --out DIR [--format jsonl|csv|parquet]
+    python -m travel_planner loadtest [--users N] [--concurrency N] [--trace NAME] [--model-latency S]
+    python -m travel_planner serve [--workers N] [--port PORT] [--no-preload] [--report-interval S]
+    python -m travel_planner bench-parse [SOURCE...] [--presets] [--repeats N]
+    python -m travel_planner eval-extraction [--corpus FILE] [--baseline FILE] [--save-baseline FILE]
+    python -m travel_planner batch REQUESTS.jsonl|.csv --out RESULTS.jsonl [--concurrency N] [--backend fake|gemini]
+    python -m travel_planner profile TEXT [--profiler sample|cprofile] [--speedscope FILE] [--tracemalloc]
+"""
+import argparse
+import asyncio
+import cProfile
+import csv
+import gc
+import json
+import math
+import os
+import pstats
+import random
+import runpy
+import signal
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+DAILY_HEADER = "## 2. Daily Itinerary\n**Day 1: Start**\n"
+
+# Inputs that make backtracking parsers blow up; each builds roughly n characters
+PATHOLOGICAL_ITINERARIES = {
+    "unterminated_morning": lambda n: DAILY_HEADER + "Morning " + "- " * (n // 2),
+    "day_heading_stars": lambda n: "## 2. Daily Itinerary\n**Day 1:" + "*" * n,
+    "many_days": lambda n: "## 2. Daily Itinerary\n" + "**Day 1: A**\n- **Morning:** x\n" * (n // 32),
+    "long_bullet_line": lambda n: DAILY_HEADER + "- **Morning:** " + "a " * (n // 2),
+    "label_spam": lambda n: DAILY_HEADER + "Morning:" * (n // 8),
+    "whitespace_run": lambda n: DAILY_HEADER + " " * n + "\n",
+    "meal_words": lambda n: DAILY_HEADER + "breakfast lunch dinner " * (n // 23),
+}
+
+# Requests for extract_details' location stage: long cue chains and lists
+# that never end, with capitalized words it has to try as places
+PATHOLOGICAL_REQUESTS = {
+    "from_chain": lambda n: "from Ab " * (n // 8),
+    "to_list": lambda n: "to Ab, " * (n // 7),
+    "visit_run": lambda n: "visit Ab Cd Ef " * (n // 15),
+}
+
+FUZZ_ALPHABET = [
+    "## 2. Daily Itinerary\n", "## 3. Accommodation Details\n", "**Day 1:", "**Day 12: Rome**", "**",
+    "Morning", "Afternoon", "Evening", "Meals", "Breakfast:", "Lunch -", "Dinner", "Accommodation:",
+    "Stay at ", ":", "-", "*", "•", "1.", " ", "  ", "\n", "\n\n", "Visit ", "train", "flight ", "x" * 40,
+]
+
+
+def cmd_warm_presets(args):
+    """Generate and persist the sidebar preset itineraries"""
+    import tk
+
+    entries = tk.warm_up_presets(force=args.force)
+    for title, entry in entries.items():
+        print(f"{title}: {len(entry['parsed_data']['days'])} days, generated {entry['generated_at']}")
+    save_error = tk.get_preset_cache()["save_error"]
+    if save_error:
+        print(f"Could not save presets to {tk.PRESET_CACHE_PATH}: {save_error}")
+        return 1
+    print(f"Saved {len(entries)} presets to {tk.PRESET_CACHE_PATH}")
+    return 0
+
+
+def cmd_regex_stats(args):
+    """Parse itineraries with pattern timing on and print the slowest patterns"""
+    import tk
+
+    tk.set_pattern_timing(True)
+    tk.reset_pattern_stats()
+    for path in args.files:
+        with open(path, encoding="utf-8") as f:
+            tk.parse_itinerary_data(f.read())
+    for text in args.request:
+        tk.extract_details(text)
+
+    print(f"{'pattern':40} {'calls':>7} {'total ms':>10} {'max ms':>9} {'max input':>10}")
+    for row in tk.get_pattern_stats()[:args.top]:
+        print(
+            f"{row['name']:40} {row['calls']:>7} {row['total_seconds'] * 1000:>10.3f} "
+            f"{row['max_seconds'] * 1000:>9.3f} {row['max_input_chars']:>10}"
+        )
+    return 0
+
+
+def iter_itineraries(paths, include_presets=False):
+    """Yield (itinerary_id, itinerary_text) from stored sources, one at a time.
+
+    JSONL files hold one object per line with an "itinerary" field (and an
+    optional "id"); JSON files are session downloads or preset caches; any
+    other file is read as a single itinerary. Session downloads carry only the
+    parsed itinerary, so they yield a parse_itinerary_data dict, not text.
+    """
+    if include_presets:
+        import tk
+
+        for title, entry in tk.get_preset_cache()["entries"].items():
+            yield f"preset:{title}", entry["itinerary"]
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    if line.strip():
+                        record = json.loads(line)
+                        if record.get("itinerary"):
+                            yield str(record.get("id", f"{name}:{line_number}")), record["itinerary"]
+        elif path.endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if "itinerary" in data:
+                yield name, data["itinerary"]
+            elif "parsed_data" in data:
+                yield name, data["parsed_data"]
+            else:
+                for key, entry in data.items():
+                    yield f"{name}:{key}", entry["itinerary"]
+        else:
+            with open(path, encoding="utf-8") as f:
+                yield name, f.read()
+
+
+class TableWriter:
+    """Append rows to a JSONL, CSV or Parquet file in chunks of chunk_size"""
+
+    def __init__(self, path, fmt, columns, chunk_size):
+        self.path = path
+        self.fmt = fmt
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+        if fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self.pa = pa
+            self.schema = pa.schema([(column, pa.int64() if column == "day_number" else pa.string()) for column in columns])
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+            if fmt == "csv":
+                self.writer = csv.DictWriter(self.file, fieldnames=columns)
+                self.writer.writeheader()
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.fmt == "parquet":
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+        elif self.fmt == "csv":
+            self.writer.writerows(self.rows)
+        else:
+            self.file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.fmt == "parquet":
+            self.writer.close()
+        else:
+            self.file.close()
+
+
+def iter_requests(path, text_field="text"):
+    """Yield (request_id, text) from a JSONL or CSV file of trip requests.
+
+    Rows without an "id" are numbered by their line (JSONL) or data row
+    (CSV), so a rerun over the same file assigns the same ids.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            rows = enumerate(csv.DictReader(f), 1)
+        else:
+            rows = ((line_number, json.loads(line)) for line_number, line in enumerate(f, 1) if line.strip())
+        for number, record in rows:
+            text = (record.get(text_field) or "").strip()
+            if text:
+                yield str(record.get("id") or f"{name}:{number}"), text
+
+
+def load_batch_checkpoint(path):
+    """Ids already written to a batch output file, for resuming.
+
+    Only "ok" rows count as done, so failed rows are retried. A line cut off
+    by an interrupted write is dropped from the file before appending.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        keep = data.rfind(b"\n") + 1
+        if keep < len(data):
+            f.truncate(keep)
+    for line in data[:keep].decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "ok":
+            done.add(record["id"])
+    return done
+
+
+async def run_batch(tk, requests, out, args):
+    """Extract, generate and parse every request, appending one JSON line each.
+
+    Extraction is CPU-bound and runs on the event loop thread, one request at
+    a time; generation runs in worker threads, at most --concurrency at once,
+    through the app's generation cache, so repeated and paraphrased requests
+    reuse an itinerary. Identical texts in flight share one model call.
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+    inflight = {}
+    stats = Counter()
+    started = last_report = time.perf_counter()
+
+    async def generate(details, text):
+        async with semaphore:
+            return await asyncio.to_thread(tk.generate_itinerary_with_usage, details, text)
+
+    async def plan(request_id, text, details):
+        row_started = time.perf_counter()
+        shared = text in inflight
+        if not shared:
+            inflight[text] = asyncio.ensure_future(generate(details, text))
+            # Later repeats go through the generation cache instead
+            inflight[text].add_done_callback(lambda _: inflight.pop(text, None))
+        itinerary, usage = await asyncio.shield(inflight[text])
+        record = {"id": request_id, "text": text, "details": details}
+        if itinerary:
+            parsed = tk.parse_itinerary_data(itinerary)
+            record.update(status="ok", itinerary=itinerary, parsed_data=parsed, usage=usage)
+            stats["ok"] += 1
+            stats["cached"] += shared or bool(usage and usage.get("cache"))
+        else:
+            record.update(status="error", error="generation failed")
+            stats["errors"] += 1
+        record["seconds"] = round(time.perf_counter() - row_started, 3)
+        out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        out.flush()
+
+    def report(final=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        if not final and now - last_report < args.report_interval:
+            return
+        last_report = now
+        done = stats["ok"] + stats["errors"]
+        rate = done / (now - started) if now > started else 0.0
+        eta = f"{(len(requests) - done) / rate:.0f}s" if rate else "?"
+        print(
+            f"{done}/{len(requests)} done, {rate:.2f} rows/s, ETA {eta}, "
+            f"{stats['cached']} from cache, {stats['errors']} errors",
+            file=sys.stderr,
+        )
+
+    tasks = set()
+    for request_id, text in requests:
+        details = tk.extract_details(text)
+        task = asyncio.ensure_future(plan(request_id, text, details))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        report()
+        # Let finished generations write their rows between extractions
+        await asyncio.sleep(0)
+    while tasks:
+        await asyncio.wait(tasks, timeout=args.report_interval)
+        if tasks:
+            report()
+    report(final=True)
+    return stats
+
+
+def cmd_batch(args):
+    """Plan itineraries for a file of trip requests without the UI"""
+    if args.backend == "fake":
+        os.environ["TRAVEL_PLANNER_MODEL_BACKEND"] = "fake"
+        os.environ["FAKE_MODEL_LATENCY"] = str(args.model_latency)
+    os.environ["PRESET_WARMUP"] = "0"
+    import tk
+
+    requests = list(iter_requests(args.requests, args.text_field))
+    if args.limit:
+        requests = requests[:args.limit]
+    done = load_batch_checkpoint(args.out) if args.resume else set()
+    pending = [(request_id, text) for request_id, text in requests if request_id not in done]
+    print(f"{len(requests)} requests in {args.requests}, {len(requests) - len(pending)} already done, {len(pending)} to plan", file=sys.stderr)
+
+    started = time.perf_counter()
+    with open(args.out, "a" if args.resume else "w", encoding="utf-8") as out:
+        stats = asyncio.run(run_batch(tk, pending, out, args))
+    elapsed = time.perf_counter() - started
+    print(
+        f"Planned {stats['ok']} itineraries ({stats['cached']} from cache, {stats['errors']} errors) "
+        f"in {elapsed:.1f}s, {len(pending) / elapsed if elapsed else 0:.2f} rows/s, to {args.out}"
+    )
+    return 1 if stats["errors"] else 0
+
+
+def cmd_export(args):
+    """Parse stored itineraries and write day- and section-level tables"""
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("Parquet export needs pyarrow (pip install pyarrow)", file=sys.stderr)
+            return 2
+    import tk
+
+    os.makedirs(args.out, exist_ok=True)
+    days = TableWriter(os.path.join(args.out, f"days.{args.format}"), args.format, tk.EXPORT_DAY_COLUMNS, args.chunk_size)
+    sections = TableWriter(os.path.join(args.out, f"sections.{args.format}"), args.format, tk.EXPORT_SECTION_COLUMNS, args.chunk_size)
+    started = time.perf_counter()
+    exported = 0
+    try:
+        for itinerary_id, itinerary in iter_itineraries(args.sources, args.presets):
+            parsed = itinerary if isinstance(itinerary, dict) else tk.parse_itinerary_data(itinerary, mode=args.mode)
+            day_rows, section_rows = tk.flatten_parsed_itinerary(itinerary_id, parsed)
+            days.write(day_rows)
+            sections.write(section_rows)
+            exported += 1
+    finally:
+        days.close()
+        sections.close()
+    print(
+        f"Exported {exported} itineraries ({days.count} day rows, {sections.count} section rows) "
+        f"to {args.out} in {time.perf_counter() - started:.1f}s"
+    )
+    return 0
+
+
+# Requests virtual users type, and the traces they replay. A "type" step
+# commits the request in a few growing edits, like a user revising it, so each
+# commit is one rerun with a fresh extract_details preview.
+LOAD_REQUESTS = [
+    "Plan a 5-day trip to Paris for 2 people in June. We love art and good food. Budget is $3000.",
+    "7-day beach vacation to Goa for a family of 4 in December, budget 80k rupees, vegetarian food",
+    "From Mumbai to Thailand for 8 days in February. Couple trip, mid-range hotels, street food. Budget ₹80,000.",
+    "Solo trek in Nepal for two weeks from 12th march, budget $1500, cheap hostels",
+    "Business trip to Singapore for 3 days, luxury hotel, flights from Delhi",
+    "Honeymoon in Bali for 10 days in May, resort, budget 3 lakh",
+]
+LOAD_TRACES = {
+    "generate": [("type",), ("generate",), ("tab", "📅 Daily Itinerary"), ("expand", 1), ("expand", 2), ("tab", "💰 Budget")],
+    "preset": [("preset", "Beach Vacation"), ("tab", "📅 Daily Itinerary"), ("expand", 1), ("tab", "📋 Overview")],
+    "browse": [("type",), ("type",), ("preset", "Cultural Tour")],
+}
+LOAD_TRACES["mixed"] = None  # each user picks one of the traces above
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux /proc, else peak RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def shared_test_runtime(script_path):
+    """Context manager pinning one mock Runtime for every AppTest session.
+
+    AppTest swaps a mock Runtime singleton in and out around each run, which
+    breaks as soon as two sessions rerun at once, and recompiles the script on
+    every run. A real server has a single runtime and script cache shared by
+    all sessions, so the load test does the same.
+    """
+    from contextlib import ExitStack
+    from unittest import mock
+
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    stack = ExitStack()
+    stack.enter_context(mock.patch.object(Runtime, "instance", classmethod(lambda cls: runtime)))
+    stack.enter_context(mock.patch.object(Runtime, "exists", classmethod(lambda cls: True)))
+    script_cache = ScriptCache()
+    # Compile once up front; concurrent ast.parse calls can trip CPython 3.11
+    script_cache.get_bytecode(script_path)
+    for module in ("app_test", "local_script_runner"):
+        stack.enter_context(mock.patch(f"streamlit.testing.v1.{module}.ScriptCache", lambda: script_cache))
+    return stack
+
+
+def run_virtual_user(script_path, trace, rng, args, timings, errors):
+    """Replay one trace against a fresh AppTest session, timing every rerun"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(script_path, default_timeout=args.timeout)
+
+    def timed(action, run):
+        started = time.perf_counter()
+        run()
+        timings.append((action, time.perf_counter() - started))
+        if at.exception:
+            errors.append(f"{action}: {at.exception[0].message}")
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+
+    timed("load", at.run)
+    request = rng.choice(LOAD_REQUESTS)
+    edits = 0
+    for step in trace:
+        action = step[0]
+        if action == "type":
+            # Commit a growing prefix of the request, ending with all of it
+            edits += 1
+            words = request.split()
+            cut = max(1, len(words) * min(edits, args.edits) // args.edits)
+            text = " ".join(words[:cut])
+            timed("type", lambda: at.text_area(key="trip_input").input(text).run())
+        elif action == "generate":
+            timed("generate", lambda: next(b for b in at.button if "Generate" in b.label).click().run())
+        elif action == "preset":
+            timed("preset", lambda: at.button(key=f"example_{step[1]}").click().run())
+        elif action == "tab":
+            at.session_state["itinerary_tab"] = step[1]
+            timed("tab", at.run)
+        elif action == "expand":
+            at.session_state[f"itinerary_day_{step[1]}"] = True
+            timed("expand", at.run)
+
+
+def cmd_loadtest(args):
+    """Drive many headless app sessions concurrently and report capacity numbers"""
+    if args.backend == "fake":
+        os.environ["TRAVEL_PLANNER_MODEL_BACKEND"] = "fake"
+        os.environ["FAKE_MODEL_LATENCY"] = str(args.model_latency)
+    # Background preset warm-up would add model calls nobody asked for
+    os.environ["PRESET_WARMUP"] = "0"
+    import fake_model
+
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tk.py")
+    rng = random.Random(args.seed)
+    traces = [name for name in LOAD_TRACES if LOAD_TRACES[name]] if args.trace == "mixed" else [args.trace]
+    plans = [(LOAD_TRACES[rng.choice(traces)], random.Random(rng.random())) for _ in range(args.users)]
+
+    timings, errors = [], []
+    rss_start = rss_peak = rss_bytes()
+    sampling = threading.Event()
+
+    def sample_rss():
+        nonlocal rss_peak
+        while not sampling.wait(0.25):
+            rss_peak = max(rss_peak, rss_bytes())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    fake_model.reset_call_stats()
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    with shared_test_runtime(script_path), ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = []
+        for index, (trace, user_rng) in enumerate(plans):
+            futures.append(pool.submit(run_virtual_user, script_path, trace, user_rng, args, timings, errors))
+            if args.ramp and index < len(plans) - 1:
+                time.sleep(args.ramp / len(plans))
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"session failed: {type(e).__name__}: {e}")
+        wall = time.perf_counter() - wall_started
+        cpu = time.process_time() - cpu_started
+        # Read the session store the virtual users filled, from inside the shared runtime
+        memory = run_app_module(script_path)["session_memory_report"]()
+    sampling.set()
+    sampler.join()
+    rss_end = rss_bytes()
+    rss_peak = max(rss_peak, rss_end)
+
+    print(f"{args.users} sessions, concurrency {args.concurrency}, {len(timings)} reruns in {wall:.1f}s, {len(errors)} errors")
+    print(f"{'rerun latency (ms)':20} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for action in ["all"] + sorted({action for action, _ in timings}):
+        values = [seconds * 1000 for name, seconds in timings if action in ("all", name)]
+        print(
+            f"{action:20} {len(values):>6} {percentile(values, 0.5):>8.1f} {percentile(values, 0.9):>8.1f} "
+            f"{percentile(values, 0.99):>8.1f} {max(values):>8.1f}"
+        )
+    print(f"CPU: {cpu:.1f}s total, {cpu / args.users * 1000:.0f} ms per session, {cpu / max(len(timings), 1) * 1000:.1f} ms per rerun")
+    sessions = memory["sessions"]
+    if sessions:
+        compressed = sum(session["compressed_bytes"] for session in sessions)
+        raw = sum(session["raw_chars"] for session in sessions)
+        print(
+            f"Session store: {len(sessions)} sessions, {memory['session_bytes'] / 2**10:.0f} KB "
+            f"({memory['session_bytes'] / len(sessions) / 1024:.1f} KB each), itineraries {raw / 2**10:.0f} KB "
+            f"compressed to {compressed / 2**10:.0f} KB; {memory['shared_parsed_entries']} shared parsed "
+            f"itineraries, {memory['shared_parsed_bytes'] / 2**10:.0f} KB"
+        )
+    print(
+        f"RSS: {rss_start / 2**20:.0f} MB start, {rss_peak / 2**20:.0f} MB peak, {rss_end / 2**20:.0f} MB end, "
+        f"{(rss_end - rss_start) / args.users / 1024:.0f} KB growth per session"
+    )
+    calls = fake_model.call_stats()["count"] if args.backend == "fake" else None
+    if calls is not None:
+        print(f"Model calls: {calls} ({calls / wall * 60:.1f}/min, {calls / args.users:.2f} per session)")
+    for error in errors[:10]:
+        print(f"error: {error}")
+    return 1 if errors else 0
+
+
+# Labeled trip requests for extract_details. Each line holds "id", "text",
+# "expected" (every field the request states; anything else extracted counts
+# as a false positive) and coverage "tags". "{year}" in a value stands for the
+# current year, which is what undated seasonal requests resolve to. Fields in
+# a case's optional "known_failures" are still scored, but a mismatch there is
+# reported as known and does not fail the run.
+EXTRACTION_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extraction_corpus.jsonl")
+EXTRACTION_FIELDS = [
+    "Starting Location", "Destination", "Start Date", "End Date", "Trip Duration",
+    "Number of Travelers", "Budget Range", "Trip Type", "Transportation Preferences",
+    "Accommodation Preferences", "Special Requirements",
+]
+# Compared as sets of comma-separated items, since route planning reorders stops
+EXTRACTION_LIST_FIELDS = {"Destination", "Special Requirements"}
+
+
+def load_extraction_corpus(path):
+    year = str(datetime.now().year)
+    with open(path, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    for case in cases:
+        case["expected"] = {field: value.replace("{year}", year) for field, value in case["expected"].items()}
+    return cases
+
+
+def field_values(field, value):
+    """Comparable set of items for one detail value"""
+    if not value:
+        return set()
+    value = str(value)
+    if field == "Budget Range":
+        # The base-currency conversion depends on the rate table, not extraction
+        value = value.split(" (≈")[0]
+    items = value.split(",") if field in EXTRACTION_LIST_FIELDS else [value]
+    return {item.strip().casefold() for item in items if item.strip()}
+
+
+def score_extraction(cases, predictions):
+    """Per-field precision and recall over item matches, plus every mismatch"""
+    counts = {field: {"tp": 0, "fp": 0, "fn": 0} for field in EXTRACTION_FIELDS}
+    mismatches = []
+    for case, details in zip(cases, predictions):
+        for field in EXTRACTION_FIELDS:
+            expected = field_values(field, case["expected"].get(field))
+            got = field_values(field, details.get(field))
+            counts[field]["tp"] += len(expected & got)
+            counts[field]["fp"] += len(got - expected)
+            counts[field]["fn"] += len(expected - got)
+            if expected != got:
+                mismatches.append((case["id"], field, case["expected"].get(field), details.get(field)))
+    scores = {}
+    for field, c in counts.items():
+        scores[field] = {
+            "precision": c["tp"] / (c["tp"] + c["fp"]) if c["tp"] + c["fp"] else 1.0,
+            "recall": c["tp"] / (c["tp"] + c["fn"]) if c["tp"] + c["fn"] else 1.0,
+            "support": c["tp"] + c["fn"],
+        }
+    return scores, mismatches
+
+
+def cmd_eval_extraction(args):
+    """Score extract_details against the labeled corpus and time each stage"""
+    import tk
+
+    cases = load_extraction_corpus(args.corpus)
+    # The first pass also warms the gazetteer and spaCy caches
+    predictions = [tk.extract_details(case["text"]) for case in cases]
+    scores, mismatches = score_extraction(cases, predictions)
+
+    # Fastest of the repeats per request and stage, to keep scheduler noise out
+    stage_times = {}
+    for case in cases:
+        best = {}
+        for _ in range(args.repeats):
+            timings = {}
+            tk.extract_details(case["text"], timings)
+            timings["total"] = sum(timings.values())
+            for stage, seconds in timings.items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+        for stage, seconds in best.items():
+            stage_times.setdefault(stage, []).append(seconds * 1000)
+    latency = {stage: {"mean": statistics.mean(values), "p90": percentile(values, 0.9)} for stage, values in stage_times.items()}
+
+    print(f"{len(cases)} requests from {args.corpus}")
+    print(f"{'field':28} {'support':>8} {'precision':>10} {'recall':>8}")
+    for field, score in scores.items():
+        print(f"{field:28} {score['support']:>8} {score['precision']:>10.2f} {score['recall']:>8.2f}")
+    total_mean = latency["total"]["mean"]
+    print(f"{'stage (ms per request)':28} {'mean':>8} {'p90':>10} {'share':>8}")
+    for stage, row in latency.items():
+        print(f"{stage:28} {row['mean']:>8.3f} {row['p90']:>10.3f} {row['mean'] / total_mean:>8.0%}")
+    known = {(case["id"], field) for case in cases for field in case.get("known_failures", ())}
+    unexpected = [mismatch for mismatch in mismatches if mismatch[:2] not in known]
+    fixed = sorted(known - {mismatch[:2] for mismatch in mismatches})
+    print(f"{len(unexpected)} unexpected mismatches, {len(mismatches) - len(unexpected)} known failures")
+    for case_id, field in fixed:
+        print(f"{case_id}: {field}: listed in known_failures but now passes")
+    if args.show_failures:
+        texts = {case["id"]: case["text"] for case in cases}
+        for case_id, field, expected, got in mismatches:
+            status = " (known)" if (case_id, field) in known else ""
+            print(f"{case_id}: {field}: expected {expected!r}, got {got!r}{status}")
+            if field in ("Starting Location", "Destination"):
+                # Where each resolved place came from
+                resolution = tk.resolve_locations(tk.nlp(texts[case_id]))
+                print(f"  locations: {resolution.provenance()}")
+
+    report = {"corpus": os.path.basename(args.corpus), "cases": len(cases), "fields": scores, "latency_ms": latency}
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if not args.baseline:
+        return 1 if unexpected else 0
+
+    # Accept a change only if no field got less accurate and it is not slower
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for field, score in scores.items():
+        before = baseline["fields"].get(field)
+        for metric in ("precision", "recall"):
+            if before and score[metric] < before[metric] - args.tolerance:
+                regressions.append(f"{field} {metric} {before[metric]:.2f} -> {score[metric]:.2f}")
+    before_ms = baseline["latency_ms"]["total"]["mean"]
+    if total_mean > before_ms * args.max_slowdown:
+        regressions.append(f"mean latency {before_ms:.3f} ms -> {total_mean:.3f} ms")
+    regressions += [f"{case_id}: {field}: expected {expected!r}, got {got!r}" for case_id, field, expected, got in unexpected]
+    for regression in regressions:
+        print(f"regression: {regression}")
+    print("REGRESSED" if regressions else f"OK against {args.baseline} ({before_ms:.3f} ms -> {total_mean:.3f} ms)")
+    return 1 if regressions else 0
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer.
+
+    A stdlib stand-in for py-spy: a daemon thread reads the target thread's
+    frame from sys._current_frames() every interval and weights each stack by
+    the time since the previous sample. The interpreter's switch interval is
+    lowered while sampling, or the sampler would only get the GIL every 5 ms.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.frames = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._switch_interval = None
+
+    def frame_index(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        if key not in self.frames:
+            self.frames[key] = len(self.frames)
+        return self.frames[key]
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_index(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += now - last
+            last = now
+
+    def __enter__(self):
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        self._thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def frame_label(self, index):
+        name, filename, line = self.frame_names[index]
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    @property
+    def frame_names(self):
+        return sorted(self.frames, key=self.frames.get)
+
+    def folded(self):
+        """Brendan Gregg's folded stacks, one "root;...;leaf microseconds" line each"""
+        return [
+            ";".join(self.frame_label(index) for index in stack) + f" {max(1, round(seconds * 1e6))}"
+            for stack, seconds in self.stacks.most_common()
+        ]
+
+    def speedscope(self, name):
+        """A speedscope "sampled" profile with seconds as the sample weight"""
+        stacks = list(self.stacks.items())
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "travel_planner profile",
+            "shared": {"frames": [{"name": name, "file": filename, "line": line} for name, filename, line in self.frame_names]},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(seconds for _, seconds in stacks),
+                "samples": [list(stack) for stack, _ in stacks],
+                "weights": [seconds for _, seconds in stacks],
+            }],
+        }
+
+    def top_self(self, limit):
+        """[(frame label, self seconds, total seconds)] by self time"""
+        own, total = Counter(), Counter()
+        for stack, seconds in self.stacks.items():
+            own[stack[-1]] += seconds
+            for index in set(stack):
+                total[index] += seconds
+        return [(self.frame_label(index), seconds, total[index]) for index, seconds in own.most_common(limit)]
+
+
+def run_profiled_pipeline(tk, text, itinerary_text, stage_rows, trace_memory):
+    """extract_details, generation and parsing once, adding one row per stage"""
+
+    def stage(name, func, *call_args):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = func(*call_args)
+        row = stage_rows.setdefault(name, {"seconds": []})
+        row["seconds"].append(time.perf_counter() - started)
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            row["net_bytes"] = current - before
+            row["peak_bytes"] = max(row.get("peak_bytes", 0), peak - before)
+        return result
+
+    timings = {}
+    details = stage("extract_details", tk.extract_details, text, timings)
+    for name, seconds in timings.items():
+        stage_rows.setdefault(f"  {name}", {"seconds": []})["seconds"].append(seconds)
+    if itinerary_text is None:
+        # use_cache=False so every repeat reaches the model
+        itinerary_text, _ = stage("generate_itinerary", tk.generate_itinerary_with_usage, details, text, False)
+    if itinerary_text:
+        stage("parse_itinerary_data", tk.parse_itinerary_data, itinerary_text)
+
+
+def cmd_profile(args):
+    """Profile one request through extraction, generation and parsing"""
+    if args.backend == "fake":
+        os.environ["TRAVEL_PLANNER_MODEL_BACKEND"] = "fake"
+        os.environ["FAKE_MODEL_LATENCY"] = str(args.model_latency)
+    os.environ["PRESET_WARMUP"] = "0"
+    import tk
+
+    itinerary_text = None
+    if args.itinerary:
+        with open(args.itinerary, encoding="utf-8") as f:
+            itinerary_text = f.read()
+    elif args.backend == "none":
+        itinerary_text = ""
+    if not args.cold:
+        # Load spaCy, the gazetteer and the patterns outside the profile
+        run_profiled_pipeline(tk, args.text, itinerary_text, {}, False)
+
+    stage_rows = {}
+    if args.tracemalloc:
+        tracemalloc.start(args.tracemalloc_frames)
+        before = tracemalloc.take_snapshot()
+    if args.profiler == "sample":
+        profiler = StackSampler(threading.get_ident(), args.interval / 1000)
+        with profiler:
+            for _ in range(args.repeats):
+                run_profiled_pipeline(tk, args.text, itinerary_text, stage_rows, args.tracemalloc)
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        for _ in range(args.repeats):
+            run_profiled_pipeline(tk, args.text, itinerary_text, stage_rows, args.tracemalloc)
+        profiler.disable()
+    if args.tracemalloc:
+        # Leave out the profiler's own bookkeeping
+        ignore = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        retained = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        tracemalloc.stop()
+
+    print(f"{args.repeats} run(s) of {len(args.text)}-character request, {args.profiler} profiler")
+    memory_columns = f" {'peak KB':>10} {'net KB':>10}" if args.tracemalloc else ""
+    print(f"{'stage':28} {'mean ms':>10} {'max ms':>10}{memory_columns}")
+    for name, row in stage_rows.items():
+        line = f"{name:28} {statistics.mean(row['seconds']) * 1000:>10.3f} {max(row['seconds']) * 1000:>10.3f}"
+        if args.tracemalloc and "peak_bytes" in row:
+            line += f" {row['peak_bytes'] / 1024:>10.1f} {row['net_bytes'] / 1024:>10.1f}"
+        print(line)
+
+    if args.profiler == "sample":
+        print(f"{'function (by self time)':60} {'self ms':>10} {'total ms':>10}")
+        for label, own, total in profiler.top_self(args.top):
+            print(f"{label[:60]:60} {own * 1000:>10.2f} {total * 1000:>10.2f}")
+        if args.speedscope:
+            with open(args.speedscope, "w", encoding="utf-8") as f:
+                json.dump(profiler.speedscope(args.text[:60]), f)
+            print(f"Wrote speedscope profile to {args.speedscope} (open at https://www.speedscope.app)")
+        if args.folded:
+            with open(args.folded, "w", encoding="utf-8") as f:
+                f.write("\n".join(profiler.folded()) + "\n")
+            print(f"Wrote folded stacks to {args.folded} (flamegraph.pl or speedscope)")
+    else:
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats(args.sort).print_stats(args.top)
+        if args.pstats:
+            profiler.dump_stats(args.pstats)
+            print(f"Wrote cProfile stats to {args.pstats} (snakeviz or python -m pstats)")
+
+    if args.tracemalloc:
+        print(f"{'retained allocations by line':60} {'KB':>10} {'blocks':>8}")
+        for diff in retained[:args.top]:
+            frame = diff.traceback[0]
+            label = f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            print(f"{label:60} {diff.size_diff / 1024:>10.1f} {diff.count_diff:>8}")
+    return 0
+
+
+def process_memory(pid="self"):
+    """{"rss", "pss", "uss"} bytes for a process from /proc, or None.
+
+    PSS splits shared pages between the processes mapping them and USS is
+    what the process alone holds, so USS is what each extra worker costs.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[1].isdigit():
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def run_app_module(script_path):
+    """Run the app script as __main__ without rendering and return its globals.
+
+    Streamlit keys st.cache_resource entries by the defining module and
+    source, so functions from this namespace see the same cached state as
+    the app's own script runs in this process.
+    """
+    os.environ["TRAVEL_PLANNER_PRELOAD"] = "1"
+    try:
+        return runpy.run_path(script_path, run_name="__main__")
+    finally:
+        del os.environ["TRAVEL_PLANNER_PRELOAD"]
+
+
+def preload_app(script_path, warm_presets=False):
+    """Run the app script once as __main__ without rendering, then freeze the heap.
+
+    The spaCy pipeline, pattern registry and gazetteer indexes built here are
+    the st.cache_resource entries the forked workers' script runs look up
+    (see run_app_module). gc.freeze()
+    moves everything allocated so far out of the collector's reach; otherwise
+    the first collection in each worker would write to every object header and
+    unshare the copy-on-write pages. With warm_presets the preset itineraries
+    are generated here too, so every worker starts with them.
+    """
+    namespace = run_app_module(script_path)
+    namespace["load_currency_rates"]()
+    if warm_presets:
+        namespace["warm_up_presets"]()
+    gc.collect()
+    gc.freeze()
+    return namespace
+
+
+def run_worker(script_path, port, args):
+    """Serve the app on one port; runs in the forked child and never returns"""
+    from streamlit.web import cli
+
+    cli.main(
+        ["run", script_path, "--server.port", str(port), "--server.address", args.address, "--server.headless", "true"],
+        prog_name="streamlit",
+    )
+    os._exit(0)
+
+
+def report_workers(workers, parent_memory):
+    print(f"{'worker':>8} {'port':>6} {'rss MB':>8} {'pss MB':>8} {'uss MB':>8}")
+    total_pss = 0
+    uss = []
+    for pid, port in workers.items():
+        memory = process_memory(pid)
+        if memory is None:
+            print(f"{pid:>8} {port:>6} {'gone':>8}")
+            continue
+        total_pss += memory["pss"]
+        uss.append(memory["uss"])
+        print(f"{pid:>8} {port:>6} {memory['rss'] / 2**20:>8.1f} {memory['pss'] / 2**20:>8.1f} {memory['uss'] / 2**20:>8.1f}")
+    parent = process_memory()
+    if parent:
+        total_pss += parent["pss"]
+        print(f"{'parent':>8} {'':>6} {parent['rss'] / 2**20:>8.1f} {parent['pss'] / 2**20:>8.1f} {parent['uss'] / 2**20:>8.1f}")
+    if uss:
+        shared = parent_memory["rss"] if parent_memory else 0
+        print(
+            f"total PSS {total_pss / 2**20:.1f} MB for {len(uss)} workers; "
+            f"each extra worker costs ~{statistics.mean(uss) / 2**20:.1f} MB private"
+            + (f" on top of {shared / 2**20:.1f} MB preloaded" if shared else "")
+        )
+    sys.stdout.flush()
+
+
+def cmd_serve(args):
+    """Preload the app's read-only state once, then fork Streamlit workers"""
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tk.py")
+    # Each worker would start its own background warm-up and spend the model
+    # calls once per worker; the parent warms the presets once before forking
+    warm_presets = os.environ.get("PRESET_WARMUP") == "1"
+    os.environ["PRESET_WARMUP"] = "0"
+    parent_memory = None
+    if args.no_preload:
+        if warm_presets:
+            import tk
+
+            tk.warm_up_presets()
+    else:
+        started = time.perf_counter()
+        preload_app(script_path, warm_presets)
+        parent_memory = process_memory()
+        print(f"Preloaded {script_path} in {time.perf_counter() - started:.1f}s"
+              + (f", {parent_memory['rss'] / 2**20:.1f} MB" if parent_memory else ""))
+
+    workers = {}
+    for index in range(args.workers):
+        port = args.port + index
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(script_path, port, args)
+            finally:
+                os._exit(1)
+        workers[pid] = port
+        print(f"worker {pid} serving http://{args.address}:{port}")
+    sys.stdout.flush()
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    started = time.monotonic()
+    next_report = started + args.report_interval
+    while workers:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            print(f"worker {pid} on port {workers.pop(pid)} exited with status {os.waitstatus_to_exitcode(status)}")
+            continue
+        now = time.monotonic()
+        if now >= next_report:
+            report_workers(workers, parent_memory)
+            next_report = now + args.report_interval
+        if args.duration and now - started >= args.duration:
+            stop(signal.SIGTERM, None)
+        time.sleep(0.5)
+    return 0
+
+
+def time_call(func, arg, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def growth_exponent(func, builder, base_size, doublings=3):
+    """Estimate k in time ~ size**k by timing inputs of doubling size"""
+    sizes = [base_size * 2 ** i for i in range(doublings + 1)]
+    timings = [max(time_call(func, builder(size)), 1e-6) for size in sizes]
+    exponent = math.log(timings[-1] / timings[0]) / math.log(sizes[-1] / sizes[0])
+    return exponent, timings
+
+
+def cmd_fuzz_parse(args):
+    """Check that hardened parsing stays linear and never fails on hostile input"""
+    import tk
+
+    failures = 0
+    hardened = lambda text: tk.parse_itinerary_data_hardened(text, deadline_seconds=60)
+    standard = lambda text: tk.parse_itinerary_data(text, mode="standard")
+
+    print(f"{'input':28} {'exponent':>9} {'ms @ max size':>14}  result")
+    cases = [(name, hardened, builder) for name, builder in PATHOLOGICAL_ITINERARIES.items()]
+    # Tokenizer only, so the timing is the location stage and not the tagger
+    locations = lambda text: tk.resolve_locations(tk.nlp.make_doc(text))
+    cases += [(name, locations, builder) for name, builder in PATHOLOGICAL_REQUESTS.items()]
+    for name, func, builder in cases:
+        exponent, timings = growth_exponent(func, builder, args.size)
+        ok = exponent <= args.max_exponent
+        failures += not ok
+        print(f"{name:28} {exponent:>9.2f} {timings[-1] * 1000:>14.2f}  {'ok' if ok else 'SUPERLINEAR'}")
+        if args.compare and name in PATHOLOGICAL_ITINERARIES:
+            exponent, timings = growth_exponent(standard, builder, max(args.size // 16, 250), doublings=2)
+            print(f"{'  standard mode':28} {exponent:>9.2f} {timings[-1] * 1000:>14.2f}")
+
+    rng = random.Random(args.seed)
+    slowest = 0.0
+    for _ in range(args.iterations):
+        text = "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(1, 400)))
+        started = time.thread_time()
+        try:
+            parsed = tk.parse_itinerary_data_hardened(text)
+            assert isinstance(parsed["days"], list)
+        except Exception as e:
+            failures += 1
+            print(f"fuzz failure {type(e).__name__}: {e!r} on {text[:200]!r}")
+        slowest = max(slowest, time.thread_time() - started)
+    # The deadline is checked once per line, so allow a little slack over it
+    if slowest > tk.PARSE_DEADLINE_SECONDS * 1.5:
+        failures += 1
+        print(f"fuzz parse took {slowest:.3f}s CPU, over the {tk.PARSE_DEADLINE_SECONDS}s deadline")
+    print(f"fuzzed {args.iterations} inputs, slowest {slowest * 1000:.2f} ms CPU")
+
+    print("FAILED" if failures else "OK")
+    return 1 if failures else 0
+
+
+DAY_SLOTS = ("morning", "afternoon", "evening", "accommodation")
+MEAL_SLOTS = ("breakfast", "lunch", "dinner")
+# What the regex day parser writes into slots it could not find
+DAY_PARSER_FILLERS = {
+    "Continue exploring local attractions",
+    "Evening leisure time",
+    "Local breakfast restaurant or hotel dining",
+    "Traditional local cuisine for lunch",
+    "Local restaurant with regional specialties",
+    "Mid-range hotel or guesthouse in city center",
+}
+
+
+def cmd_bench_parse(args):
+    """Time the line-based day parser against the previous per-field regex parser"""
+    import tk
+
+    texts = [text for _, text in iter_itineraries(args.sources, args.presets) if isinstance(text, str)]
+    if not texts:
+        print("No itineraries to parse; pass files or --presets")
+        return 1
+
+    print(f"{len(texts)} itineraries")
+    print(f"{'day parser':12} {'days':>6} {'total ms':>10} {'us per day':>11} {'scans per day':>14} {'filled slots':>13} {'fillers':>8}")
+    results = {}
+    for name in tk.DAY_PARSERS:
+        # Count pattern calls on one pass, then time with counting off
+        tk.set_pattern_timing(True)
+        tk.reset_pattern_stats()
+        parsed = [tk.parse_itinerary_data(text, day_parser=name) for text in texts]
+        scans = sum(row["calls"] for row in tk.get_pattern_stats())
+        tk.set_pattern_timing(False)
+        seconds = sum(time_call(lambda text: tk.parse_itinerary_data(text, day_parser=name), text, args.repeats) for text in texts)
+
+        days = [day for data in parsed for day in data["days"]]
+        values = [day[slot] for day in days for slot in DAY_SLOTS] + [day["meals"][meal] for day in days for meal in MEAL_SLOTS]
+        fillers = sum(value in DAY_PARSER_FILLERS for value in values)
+        filled = sum(bool(value) for value in values) - fillers
+        results[name] = seconds
+        print(
+            f"{name:12} {len(days):>6} {seconds * 1000:>10.2f} {seconds / max(len(days), 1) * 1e6:>11.1f} "
+            f"{scans / max(len(days), 1):>14.1f} {filled:>13} {fillers:>8}"
+        )
+    if "regex" in results and results.get("lines"):
+        print(f"lines is {results['regex'] / results['lines']:.1f}x faster than regex")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="travel_planner", description="Travel Planner Pro tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    warm_parser = subparsers.add_parser("warm-presets", help="pre-generate the sidebar preset itineraries")
+    warm_parser.add_argument("--force", action="store_true", help="regenerate presets that are still fresh")
+    warm_parser.set_defaults(func=cmd_warm_presets)
+
+    stats_parser = subparsers.add_parser("regex-stats", help="time every registered pattern on sample itineraries")
+    stats_parser.add_argument("files", nargs="*", help="itinerary text files to parse")
+    stats_parser.add_argument("--request", action="append", default=[], help="trip request to run through extract_details")
+    stats_parser.add_argument("--top", type=int, default=20, help="number of patterns to show")
+    stats_parser.set_defaults(func=cmd_regex_stats)
+
+    fuzz_parser = subparsers.add_parser("fuzz-parse", help="fuzz and benchmark the hardened itinerary parser")
+    fuzz_parser.add_argument("--size", type=int, default=20000, help="smallest pathological input size in characters")
+    fuzz_parser.add_argument("--max-exponent", type=float, default=1.3, help="largest accepted growth exponent")
+    fuzz_parser.add_argument("--iterations", type=int, default=2000, help="random inputs to fuzz with")
+    fuzz_parser.add_argument("--seed", type=int, default=0)
+    fuzz_parser.add_argument("--compare", action="store_true", help="also time the standard parser on smaller inputs")
+    fuzz_parser.set_defaults(func=cmd_fuzz_parse)
+
+    export_parser = subparsers.add_parser("export", help="export parsed itineraries as day and section tables")
+    export_parser.add_argument("sources", nargs="*", help="JSONL job files, JSON downloads or preset caches, or itinerary text files")
+    export_parser.add_argument("--presets", action="store_true", help="include the warmed preset itineraries")
+    export_parser.add_argument("--out", required=True, help="output directory for days.* and sections.*")
+    export_parser.add_argument("--format", choices=["jsonl", "csv", "parquet"], default="jsonl")
+    export_parser.add_argument("--chunk-size", type=int, default=1000, help="rows buffered before each write")
+    export_parser.add_argument("--mode", choices=["standard", "hardened"], default=None, help="parse mode (default: TRAVEL_PLANNER_PARSE_MODE)")
+    export_parser.set_defaults(func=cmd_export)
+
+    load_parser = subparsers.add_parser("loadtest", help="simulate concurrent app sessions against the fake model")
+    load_parser.add_argument("--users", type=int, default=200, help="virtual user sessions to run")
+    load_parser.add_argument("--concurrency", type=int, default=50, help="sessions running at the same time")
+    load_parser.add_argument("--trace", choices=sorted(LOAD_TRACES), default="mixed", help="interaction trace to replay")
+    load_parser.add_argument("--edits", type=int, default=3, help="commits it takes to type a request")
+    load_parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between actions in seconds")
+    load_parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which sessions start")
+    load_parser.add_argument("--backend", choices=["fake", "gemini"], default="fake", help="model backend")
+    load_parser.add_argument("--model-latency", type=float, default=0.5, help="fake model response time in seconds")
+    load_parser.add_argument("--timeout", type=float, default=120, help="per-rerun timeout in seconds")
+    load_parser.add_argument("--seed", type=int, default=0)
+    load_parser.set_defaults(func=cmd_loadtest)
+
+    serve_parser = subparsers.add_parser("serve", help="preload shared state, then fork Streamlit workers")
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="worker processes to fork")
+    serve_parser.add_argument("--port", type=int, default=8501, help="first port; worker i listens on port + i")
+    serve_parser.add_argument("--address", default="127.0.0.1", help="address the workers bind to")
+    serve_parser.add_argument("--no-preload", action="store_true", help="let every worker load its own state (for comparison)")
+    serve_parser.add_argument("--report-interval", type=float, default=60, help="seconds between memory reports")
+    serve_parser.add_argument("--duration", type=float, default=0, help="stop the workers after this many seconds (0: run until signalled)")
+    serve_parser.set_defaults(func=cmd_serve)
+
+    bench_parser = subparsers.add_parser("bench-parse", help="benchmark the day parsers on recorded itineraries")
+    bench_parser.add_argument("sources", nargs="*", help="itinerary files (.md/.txt, .json, .jsonl)")
+    bench_parser.add_argument("--presets", action="store_true", help="include the warmed preset itineraries")
+    bench_parser.add_argument("--repeats", type=int, default=5, help="timed runs per itinerary; the median counts")
+    bench_parser.set_defaults(func=cmd_bench_parse)
+
+    eval_parser = subparsers.add_parser("eval-extraction", help="score extract_details on the labeled corpus with stage timings")
+    eval_parser.add_argument("--corpus", default=EXTRACTION_CORPUS_PATH, help="labeled JSONL corpus")
+    eval_parser.add_argument("--repeats", type=int, default=5, help="timed runs per request; the fastest counts")
+    eval_parser.add_argument("--show-failures", action="store_true", help="print every mismatched field")
+    eval_parser.add_argument("--save-baseline", metavar="FILE", help="write the scores and timings as JSON")
+    eval_parser.add_argument("--baseline", metavar="FILE", help="fail on accuracy or speed regressions against FILE")
+    eval_parser.add_argument("--tolerance", type=float, default=0.0, help="allowed drop in precision or recall")
+    eval_parser.add_argument("--max-slowdown", type=float, default=1.10, help="allowed mean latency ratio")
+    eval_parser.set_defaults(func=cmd_eval_extraction)
+
+    batch_parser = subparsers.add_parser("batch", help="plan itineraries for a JSONL or CSV file of trip requests")
+    batch_parser.add_argument("requests", help="JSONL or CSV file with a text field and an optional id")
+    batch_parser.add_argument("--out", required=True, help="JSONL file the results are appended to")
+    batch_parser.add_argument("--text-field", default="text", help="field or column holding the request text")
+    batch_parser.add_argument("--concurrency", type=int, default=8, help="model calls in flight at once")
+    batch_parser.add_argument("--backend", choices=["gemini", "fake"], default="gemini")
+    batch_parser.add_argument("--model-latency", type=float, default=0.5, help="seconds the fake model waits per call")
+    batch_parser.add_argument("--no-resume", dest="resume", action="store_false", help="overwrite --out instead of skipping rows it already has")
+    batch_parser.add_argument("--limit", type=int, default=0, help="plan only the first N requests")
+    batch_parser.add_argument("--report-interval", type=float, default=5, help="seconds between progress lines")
+    batch_parser.set_defaults(func=cmd_batch)
+
+    profile_parser = subparsers.add_parser("profile", help="profile one request through extraction, generation and parsing")
+    profile_parser.add_argument("text", help="trip request to reproduce")
+    profile_parser.add_argument("--profiler", choices=["sample", "cprofile"], default="sample")
+    profile_parser.add_argument("--backend", choices=["fake", "gemini", "none"], default="fake", help="itinerary model; none skips generation and parsing")
+    profile_parser.add_argument("--model-latency", type=float, default=0.0, help="seconds the fake model waits per call")
+    profile_parser.add_argument("--itinerary", help="parse this recorded itinerary instead of generating one")
+    profile_parser.add_argument("--repeats", type=int, default=1, help="pipeline runs under the profiler")
+    profile_parser.add_argument("--cold", action="store_true", help="include model and gazetteer loading in the profile")
+    profile_parser.add_argument("--interval", type=float, default=1.0, help="sampling interval in milliseconds")
+    profile_parser.add_argument("--speedscope", help="write the sampled profile as speedscope JSON")
+    profile_parser.add_argument("--folded", help="write the sampled profile as folded stacks for flamegraph.pl")
+    profile_parser.add_argument("--pstats", help="write the cProfile stats file")
+    profile_parser.add_argument("--sort", default="cumulative", help="cProfile sort key")
+    profile_parser.add_argument("--top", type=int, default=25, help="rows in the function and allocation tables")
+    profile_parser.add_argument("--tracemalloc", action="store_true", help="track allocations per stage (slows the run)")
+    profile_parser.add_argument("--tracemalloc-frames", type=int, default=1, help="traceback depth kept by tracemalloc")
+    profile_parser.set_defaults(func=cmd_profile)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())